@@ -9,21 +9,389 @@ import streamlit as st
 import time
 import re
 import ast
-import io
-import base64
 import datetime
+import os
+import sys
+import argparse
+import contextlib
+import threading
+import hashlib
+import secrets
+import codecs
+import csv
+import io
+import email.utils
+import gzip
+import unicodedata
+import xlsxwriter
+import pyarrow as pa
+import pyarrow.parquet as pq
+import operator
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from urllib.parse import quote
+
+# Set page title and configuration, unless running headless from the command line (see run_cli)
+if st.runtime.exists():
+    st.set_page_config(
+        page_title="Medad Reporter",
+        page_icon="📚",
+        layout="wide",
+        initial_sidebar_state="expanded"
+    )
+
+    # Create app header
+    st.title("📚 Medad Reporter")
+    st.markdown("Seamlessly integrate with Medad to harvest rich bibliographic insights and craft bespoke analytical reports")
+
+# Session values of a headless run (see run_cli), where st.session_state does not persist
+HEADLESS_STATE = {}
+
+# Background load job (see LoadJob) the current thread works for, if any
+JOB_CONTEXT = threading.local()
+
+# Function to get the background load job the current thread works for
+def current_job():
+    return getattr(JOB_CONTEXT, 'job', None)
+
+# Function to get a value of the current session, created with factory on first use
+def session_value(name, factory):
+    job = current_job()
+    if job is not None:
+        state = job.state
+    else:
+        state = st.session_state if st.runtime.exists() else HEADLESS_STATE
+    if name not in state:
+        state[name] = factory()
+    return state[name]
+
+# Function to show a status message in the app, or on stderr when running headless
+def notify(message, level="info"):
+    job = current_job()
+    if job is not None:
+        job.messages.append((level, message))
+    elif st.runtime.exists():
+        getattr(st, level)(message)
+    else:
+        print(message, file=sys.stderr)
+
+# Function to show a spinner while a step runs, or log the step when running headless
+def status_spinner(text):
+    job = current_job()
+    if job is not None:
+        job.progress(stage=text)
+        return contextlib.nullcontext()
+    if st.runtime.exists():
+        return st.spinner(text)
+    print(text, file=sys.stderr)
+    return contextlib.nullcontext()
+
+# Function to report how far the current step is to the background job running it, if any
+def report_progress(done=None, total=None):
+    job = current_job()
+    if job is not None:
+        job.progress(done=done, total=total)
+
+# Error raised inside a background load once its job has been cancelled
+class JobCancelled(Exception):
+    pass
+
+class LoadJob:
+    """
+    A report load running on a background thread, so it survives reruns and a browser
+    refresh. work() runs with the job as the thread's current job: status_spinner()
+    steps become its stage, report_progress() counts become its progress, notify()
+    messages are collected and session_value() reads from state, a copy of the session
+    values the loaders need. A cancelled job stops at its next progress report.
+    shared holds what work() hands to other loads before it ends, such as the inventory
+    a loan count load harvested.
+    """
+    def __init__(self, label, work, state):
+        self.label = label
+        self.work = work
+        self.state = state
+        self.status = "running"
+        self.stage = "Starting..."
+        self.done = 0
+        self.total = None
+        self.messages = []
+        self.result = None
+        self.shared = {}
+        self.error = None
+        self.started = time.time()
+        self.finished = None
+        self.cancelled = threading.Event()
+        self.thread = threading.Thread(target=self.run, name=f"load-{label}", daemon=True)
+
+    @property
+    def running(self):
+        return self.status == "running"
+
+    def run(self):
+        JOB_CONTEXT.job = self
+        try:
+            self.result = self.work()
+            self.status = "done"
+        except JobCancelled:
+            self.status = "cancelled"
+        except Exception as e:
+            self.error = str(e)
+            self.status = "failed"
+        finally:
+            self.finished = time.time()
+            JOB_CONTEXT.job = None
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def progress(self, stage=None, done=None, total=None):
+        if self.cancelled.is_set():
+            raise JobCancelled()
+        if stage is not None and stage != self.stage:
+            self.stage, self.done, self.total = stage, 0, None
+        if done is not None:
+            self.done = done
+        if total is not None:
+            self.total = total
+
+    def fraction(self):
+        return min(self.done / self.total, 1.0) if self.total else 0.0
+
+    def describe(self):
+        if self.cancelled.is_set():
+            return f"{self.label}: Cancelling..."
+        text = f"{self.label}: {self.stage}"
+        if self.total:
+            text += f" {self.done:,} of {self.total:,}"
+        elif self.done:
+            text += f" {self.done:,}"
+        return text + f" ({int(time.time() - self.started)} s)"
+
+# Connection pool size and retry policy of the shared HTTP client
+HTTP_POOL_SIZE = 16
+# Number of requests a single loader keeps in flight
+HTTP_MAX_WORKERS = 8
+HTTP_RETRIES = 3
+HTTP_BACKOFF_FACTOR = 0.5
+# Requests in flight to one tenant, across all loaders and sessions, never exceed this
+HTTP_TENANT_MAX_CONCURRENCY = int(os.environ.get("MEDAD_MAX_CONCURRENCY", "8"))
+# Requests in flight to a tenant before the scheduler has seen how it copes
+HTTP_INITIAL_CONCURRENCY = 2
+# Statuses by which the gateway asks clients to slow down, honouring their Retry-After
+HTTP_BACKOFF_STATUSES = (429, 503)
+# Server errors the HTTP client retries itself before the scheduler sees them
+HTTP_ERROR_STATUSES = (500, 502, 504)
+# Longest Retry-After pause honoured, in seconds
+HTTP_MAX_RETRY_AFTER = 120
+# A request slower than this many times the usual latency of its endpoint signals congestion
+HTTP_LATENCY_TOLERANCE = 2.0
+# How quickly the usual latency of an endpoint follows slower answers (faster ones are taken at once)
+HTTP_LATENCY_DRIFT = 0.05
+# A request slower than this, in seconds, shrinks the harvest pages
+HTTP_SLOW_REQUEST_SECONDS = 30
+# Step by which fast answers grow the harvest pages back, as a share of the full page size
+HTTP_PAGE_SCALE_STEP = 0.125
+
+# Function to get the seconds a response asks to wait before the next request, if any
+def retry_after_seconds(response):
+    value = response.headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+        return max(0.0, (when - datetime.datetime.now(datetime.timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+# Function to get the endpoint a request's latency is compared within: its path without
+# record IDs or query, and its page size, as larger pages are naturally slower
+def endpoint_key(path, params=None):
+    endpoint, _, query = path.partition('?')
+    endpoint = re.sub(r'/[0-9a-fA-F-]{36}(?=/|$)', '/{id}', endpoint)
+    limit = (params or {}).get('limit')
+    if limit is None:
+        match = re.search(r'(?:^|&)limit=(\d+)', query)
+        limit = match.group(1) if match else None
+    return endpoint, str(limit)
+
+class RequestScheduler:
+    """
+    Paces the requests to one tenant, shared by every client, loader and session that
+    talks to it. The number of requests in flight follows AIMD: every answer at the
+    usual latency of its endpoint widens the window by 1/window (so by one request per
+    round trip), while a 429, a 5xx (for 500, 502 and 504 once the client's own
+    retries are spent), a request that got no answer (a connection error or a body
+    that broke off), or one slower than HTTP_LATENCY_TOLERANCE times the usual latency halves
+    it, at most once per round trip. The window stays between 1 and the tenant's ceiling. A Retry-After, or an
+    exponential backoff when the gateway gives none, pauses all requests to the tenant.
+    page_size() scales harvest pages the same way: halved by congestion or answers
+    slower than HTTP_SLOW_REQUEST_SECONDS, grown back step by step by fast ones.
+    """
+    def __init__(self, ceiling=HTTP_TENANT_MAX_CONCURRENCY):
+        self.ceiling = max(1, ceiling)
+        self.window = float(min(HTTP_INITIAL_CONCURRENCY, self.ceiling))
+        self.page_scale = 1.0
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self.backoffs = 0
+        self.last_decrease = 0.0
+        self.latency = {}
+        self.condition = threading.Condition()
 
-# Set page title and configuration
-st.set_page_config(
-    page_title="Medad Reporter",
-    page_icon="📚",
-    layout="wide",
-    initial_sidebar_state="expanded"
-)
+    def acquire(self):
+        with self.condition:
+            while True:
+                pause = self.paused_until - time.monotonic()
+                if pause <= 0 and self.in_flight < int(self.window):
+                    self.in_flight += 1
+                    return
+                self.condition.wait(pause if pause > 0 else None)
 
-# Create app header
-st.title("📚 Medad Reporter")
-st.markdown("Seamlessly integrate with Medad to harvest rich bibliographic insights and craft bespoke analytical reports")
+    def release(self, endpoint, elapsed, status=None, retry_after=None):
+        """Record how a request went; status is None when it got no answer."""
+        with self.condition:
+            self.in_flight -= 1
+            now = time.monotonic()
+            usual = self.latency.get(endpoint)
+            backoff = status in HTTP_BACKOFF_STATUSES
+            failed = status is None or status >= 500
+            slow = elapsed > HTTP_SLOW_REQUEST_SECONDS
+            congested = (failed or backoff or slow
+                         or (usual is not None and elapsed > HTTP_LATENCY_TOLERANCE * usual))
+
+            if backoff:
+                if retry_after is None:
+                    retry_after = HTTP_BACKOFF_FACTOR * 2 ** min(self.backoffs, 8)
+                self.backoffs += 1
+                self.paused_until = max(self.paused_until, now + min(retry_after, HTTP_MAX_RETRY_AFTER))
+            elif not failed:
+                self.backoffs = 0
+                if status < 500:
+                    self.latency[endpoint] = (elapsed if usual is None or elapsed < usual
+                                              else usual + (elapsed - usual) * HTTP_LATENCY_DRIFT)
+
+            if congested:
+                # The requests in flight saw the same congestion, so only the first one counts
+                if now - self.last_decrease > (usual or elapsed):
+                    self.window = max(1.0, self.window / 2)
+                    self.last_decrease = now
+                    if backoff or slow or failed:
+                        self.page_scale = max(HTTP_PAGE_SCALE_STEP, self.page_scale / 2)
+            else:
+                self.window = min(float(self.ceiling), self.window + 1 / self.window)
+                if elapsed < HTTP_SLOW_REQUEST_SECONDS / 2:
+                    self.page_scale = min(1.0, self.page_scale + HTTP_PAGE_SCALE_STEP)
+            self.condition.notify_all()
+
+    def page_size(self, page_size):
+        return max(1, int(page_size * self.page_scale))
+
+class OkapiClient:
+    """
+    HTTP client bound to one Okapi URL and set of tenant headers.
+    All requests go through a pooled keep-alive session that asks for gzip
+    responses and retries 5xx answers and dropped connections with backoff.
+    Requests are paced by the scheduler of the tenant (see RequestScheduler), which
+    also retries the answers by which the gateway asks to slow down.
+    """
+
+    def __init__(self, url, header_dict, scheduler=None):
+        self.url = url.rstrip('/')
+        self.scheduler = scheduler or RequestScheduler()
+        self.session = requests.Session()
+        self.session.headers.update(header_dict)
+        self.session.headers['Accept-Encoding'] = 'gzip, deflate'
+
+        retry = Retry(
+            total=HTTP_RETRIES,
+            backoff_factor=HTTP_BACKOFF_FACTOR,
+            status_forcelist=HTTP_ERROR_STATUSES,
+            allowed_methods=frozenset(['GET']),
+            raise_on_status=False
+        )
+        adapter = HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE, max_retries=retry)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    @contextlib.contextmanager
+    def open(self, method, path, **kwargs):
+        """
+        Send a request and yield its response, which keeps its place in the scheduler
+        until the block ends. A streamed response (stream=True) is read within the block,
+        so its latency covers the whole body, and a body that breaks off counts as a
+        request that got no answer. Answers asking to slow down are closed and retried.
+        """
+        endpoint = endpoint_key(path, kwargs.get('params'))
+        for attempt in range(HTTP_RETRIES + 1):
+            self.scheduler.acquire()
+            started = time.monotonic()
+            try:
+                response = self.session.request(method, self.url + path, **kwargs)
+            except requests.exceptions.RequestException:
+                self.scheduler.release(endpoint, time.monotonic() - started)
+                raise
+            if response.status_code not in HTTP_BACKOFF_STATUSES or attempt == HTTP_RETRIES:
+                break
+            self.scheduler.release(endpoint, time.monotonic() - started,
+                                   response.status_code, retry_after_seconds(response))
+            response.close()
+
+        status = response.status_code
+        try:
+            yield response
+        except requests.exceptions.RequestException as e:
+            # An HTTPError from raise_for_status() still got its answer; a body that broke off did not
+            if e.response is None:
+                status = None
+            raise
+        finally:
+            response.close()
+            self.scheduler.release(endpoint, time.monotonic() - started, status, retry_after_seconds(response))
+
+    def request(self, method, path, **kwargs):
+        # Without stream=True the body has been read by the time the response is returned
+        with self.open(method, path, **kwargs) as response:
+            return response
+
+    def get(self, path, params=None, **kwargs):
+        return self.request('GET', path, params=params, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request('POST', path, **kwargs)
+
+# Number of clients kept, one per Okapi URL and set of headers (so per login token)
+OKAPI_CLIENT_LIMIT = 32
+
+# Function to get the clients shared by all sessions, by Okapi URL and headers,
+# and the request schedulers they share, by Okapi URL and tenant
+@st.cache_resource(show_spinner=False)
+def okapi_clients():
+    return threading.Lock(), OrderedDict(), {}
+
+# Fetched once per script run, so loader threads never call into the Streamlit cache themselves.
+# Headless, st.cache_resource does not cache and the clients are those of this process.
+OKAPI_CLIENTS_LOCK, OKAPI_CLIENTS, OKAPI_SCHEDULERS = okapi_clients()
+
+# Function to get the shared client for an Okapi URL and set of headers
+def get_client(url, header_dict):
+    key = (url, tuple(sorted(header_dict.items())))
+    with OKAPI_CLIENTS_LOCK:
+        client = OKAPI_CLIENTS.get(key)
+        if client is None:
+            # Every login to a tenant shares its scheduler, so together they stay under its ceiling
+            tenant = (url.rstrip('/'), header_dict.get('x-okapi-tenant'))
+            scheduler = OKAPI_SCHEDULERS.setdefault(tenant, RequestScheduler())
+            client = OKAPI_CLIENTS[key] = OkapiClient(url, header_dict, scheduler)
+            # Forget the oldest clients, whose tokens later logins have replaced
+            while len(OKAPI_CLIENTS) > OKAPI_CLIENT_LIMIT:
+                OKAPI_CLIENTS.popitem(last=False)
+    return client
 
 # Function to login to tenant
 def tenant_login(okapi, tenant, username, password):
@@ -31,7 +399,7 @@ def tenant_login(okapi, tenant, username, password):
     data = json.dumps(myobj)
     header = {"x-okapi-tenant": tenant}
     try:
-        x = requests.post(okapi + "/authn/login", data=data, headers=header)
+        x = get_client(okapi, header).post("/authn/login", data=data)
         if "x-okapi-token" in x.headers:
             token = x.headers["x-okapi-token"]
             return token, True, "Connected successfully!"
@@ -40,132 +408,520 @@ def tenant_login(okapi, tenant, username, password):
     except Exception as e:
         return None, False, f"Connection error: {str(e)}"
 
+# Page size used when harvesting the large inventory collections
+HARVEST_PAGE_SIZE = 5000
+# Seconds to wait for a single harvest page before the client retries it
+HARVEST_PAGE_TIMEOUT = 120
+
+# Function to quote a value as a CQL string, escaping its quotes, backslashes and masking characters
+def cql_string(value):
+    return '"' + re.sub(r'([\\"*?^])', r'\\\1', str(value)) + '"'
+
+# Function to build a CQL query matching a field against any of the values
+def cql_any(field, values):
+    return f"{field}==(" + " or ".join(map(cql_string, values)) + ")"
+
+# Function to turn an optional CQL query into the query parameter appended to an offset-paged path
+def cql_param(query):
+    return f"&query={quote(query)}" if query else ""
+
+# Size of the pieces a streamed response is read in
+JSON_STREAM_CHUNK_SIZE = 1 << 16
+JSON_DECODER = json.JSONDecoder()
+JSON_WHITESPACE = re.compile(r'[ \t\n\r]*')
+# What may follow a number within the same number, as in "12", "1." or "1e-"
+JSON_NUMBER_TAIL = re.compile(r'[0-9.eE+-]*')
+
+class JsonStream:
+    """
+    The JSON text of a streamed response, read piece by piece. value() decodes the
+    next complete value with the json module's own decoder, reading more of the
+    response whenever the value does not end within the text read so far. Text before
+    the current position is dropped as more is read, so only about one piece and one
+    value are held at a time.
+    """
+    def __init__(self, response):
+        self.chunks = response.iter_content(JSON_STREAM_CHUNK_SIZE)
+        self.decoder = codecs.getincrementaldecoder('utf-8')()
+        self.text = ''
+        self.pos = 0
+        self.ended = False
+
+    def read(self):
+        if self.ended:
+            return False
+        chunk = next(self.chunks, None)
+        if chunk is None:
+            self.text += self.decoder.decode(b'', final=True)
+            self.ended = True
+        else:
+            self.text = self.text[self.pos:] + self.decoder.decode(chunk)
+            self.pos = 0
+        return True
+
+    def peek(self):
+        """Skip whitespace and return the next character, or '' at the end of the response."""
+        while True:
+            self.pos = JSON_WHITESPACE.match(self.text, self.pos).end()
+            if self.pos < len(self.text):
+                return self.text[self.pos]
+            if not self.read():
+                return ''
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError(f"Invalid JSON response: expected '{char}'")
+        self.pos += 1
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = JSON_DECODER.raw_decode(self.text, self.pos)
+            except json.JSONDecodeError:
+                if not self.read():
+                    raise
+                continue
+            # A value followed only by what could still belong to a number ("6" of "6.7",
+            # "1." of "1.5e3") may go on in the next piece
+            if JSON_NUMBER_TAIL.fullmatch(self.text, end) and self.read():
+                continue
+            self.pos = end
+            return value
+
+# Function to stream the records of a JSON response
+def iter_json_records(response, record_key, fields=None):
+    """
+    Yield the records of the record_key array of a JSON object response one at a
+    time, as they are read from the response stream, instead of decoding the whole
+    response first. When given, fields receives the object's other members, such as
+    totalRecords, once the generator is exhausted.
+    """
+    stream = JsonStream(response)
+    stream.expect('{')
+    if stream.peek() == '}':
+        return
+    while True:
+        key = stream.value()
+        stream.expect(':')
+        if key == record_key and stream.peek() == '[':
+            stream.pos += 1
+            if stream.peek() == ']':
+                stream.pos += 1
+            else:
+                while True:
+                    yield stream.value()
+                    if stream.peek() == ']':
+                        stream.pos += 1
+                        break
+                    stream.expect(',')
+        else:
+            value = stream.value()
+            if fields is not None:
+                fields[key] = value
+        if stream.peek() == '}':
+            return
+        stream.expect(',')
+
+# Function to harvest the records of a storage collection
+def harvest_records(url, header_dict, path, record_key, query=None, page_size=HARVEST_PAGE_SIZE):
+    """
+    Yield the records of a storage collection one at a time.
+    Pages are requested in id order and each page starts after the last id of the
+    previous one (keyset paging), so the server never has to skip over an offset
+    and a slow page only costs a retry of that page instead of the whole harvest.
+    Each page is streamed (see iter_json_records), so its records are yielded while
+    the rest of the page is still being read. A page that breaks off is requested
+    again from the last record read.
+    An optional CQL query restricts the harvest to the matching records.
+    """
+    client = get_client(url, header_dict)
+    last_id = None
+    fetched = 0
+    total = None
+    retries = 0
+    while True:
+        conditions = [f"({query})"] if query else []
+        if last_id is not None:
+            conditions.append(f'id>"{last_id}"')
+        if not conditions:
+            conditions.append("cql.allRecords=1")
+        query_page = " and ".join(conditions) + " sortBy id"
+        # The tenant's scheduler shrinks the pages while they are slow
+        limit = client.scheduler.page_size(page_size)
+        params = {"limit": limit, "query": query_page}
+
+        fields = {}
+        count = 0
+        try:
+            with client.open('GET', path, params=params, timeout=HARVEST_PAGE_TIMEOUT, stream=True) as response:
+                response.raise_for_status()
+                for record in iter_json_records(response, record_key, fields):
+                    count += 1
+                    last_id = record['id']
+                    yield record
+        except (requests.exceptions.ChunkedEncodingError, requests.exceptions.ConnectionError,
+                requests.exceptions.ReadTimeout):
+            # A read timeout in the middle of the body surfaces as a ConnectionError
+            retries += 1
+            if retries > HTTP_RETRIES:
+                raise
+            fetched += count
+            time.sleep(HTTP_BACKOFF_FACTOR * 2 ** retries)
+            continue
+        retries = 0
+
+        # The count of the first complete page covers the rest of the harvest
+        if total is None and 'totalRecords' in fields:
+            total = fetched + fields['totalRecords']
+            report_progress(total=total)
+        fetched += count
+        report_progress(done=fetched)
+        if count < limit:
+            break
+
+# Function to read a field from a record by its path, json_normalize style
+def record_field(record, path):
+    value = record
+    for part in path:
+        if not isinstance(value, dict) or part not in value:
+            return np.nan
+        value = value[part]
+    return value
+
+def harvest_dataframe(url, header_dict, path, record_key, query=None, flatten=None, columns=None,
+                      shared_columns=(), ids=None):
+    """
+    Harvest a storage collection into a DataFrame.
+    When given, flatten(record) is applied to every record first, to turn nested
+    fields into the scalar fields the reports use. With columns, each record's fields
+    are appended straight into one buffer per column as it is read from the response,
+    so no page of records is ever held as a whole. Nested fields are named by their
+    dotted path, as pd.json_normalize names them, and missing ones are NaN. Equal
+    values of the shared_columns, the low-cardinality ones, are kept as one object.
+    With ids, only the records with these IDs are harvested (see harvest_by_id).
+    """
+    if ids is not None:
+        return harvest_by_id(url, header_dict, path, record_key, ids, flatten=flatten, columns=columns,
+                             shared_columns=shared_columns)
+    records = harvest_records(url, header_dict, path, record_key, query)
+    if flatten is not None:
+        records = map(flatten, records)
+    if columns is None:
+        return pd.json_normalize(list(records))
+
+    buffers = {field: [] for field in columns}
+    readers = [(field, field.split('.') if '.' in field else None, buffers[field].append,
+                {} if field in shared_columns else None) for field in columns]
+    nan = np.nan
+    for record in records:
+        for field, nested, append, seen in readers:
+            value = record_field(record, nested) if nested else record.get(field, nan)
+            if seen is not None:
+                value = seen.setdefault(value, value)
+            append(value)
+    del readers
+    if not columns or not buffers[columns[0]]:
+        return pd.DataFrame()
+    # Each buffer is released as soon as its column is built
+    return pd.DataFrame({field: pd.Series(buffers.pop(field)) for field in columns}, columns=columns)
+
+# Number of record IDs matched by a single query when harvesting records by ID
+ID_BATCH_SIZE = 50
+
+# Function to harvest the records with the given IDs
+def harvest_by_id(url, header_dict, path, record_key, ids, **options):
+    """
+    Harvest the records with the given IDs into a DataFrame, with one id==(...) query
+    per ID_BATCH_SIZE IDs. The queries run concurrently, paced by the tenant's
+    scheduler, and the options are passed on to harvest_dataframe.
+    """
+    ids = sorted(ids)
+    batches = [ids[i:i + ID_BATCH_SIZE] for i in range(0, len(ids), ID_BATCH_SIZE)]
+    chunks = []
+    pool = ThreadPoolExecutor(max_workers=HTTP_MAX_WORKERS)
+    try:
+        futures = [pool.submit(harvest_dataframe, url, header_dict, path, record_key, cql_any('id', batch), **options)
+                   for batch in batches]
+        for number, future in enumerate(futures, 1):
+            chunks.append(future.result())
+            report_progress(done=min(number * ID_BATCH_SIZE, len(ids)), total=len(ids))
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+    chunks = [chunk for chunk in chunks if not chunk.empty]
+    if not chunks:
+        return pd.DataFrame()
+    return pd.concat(chunks, ignore_index=True)
+
+# Fields kept from each harvested record type, mapped to the column they become
+# in the joined inventory report. Everything else is dropped at harvest time.
+INSTANCE_FIELDS = {
+    'id': 'id_x',
+    'hrid': 'hrid_x',
+    'title': 'title',
+    'contributors': 'contributors',
+    'publisher': 'publisher',
+    'place': 'place',
+    'dateOfPublication': 'dateOfPublication',
+    'alternativeTitleExtracted': 'alternativeTitleExtracted',
+    'ISBN': 'ISBN',
+    'discoverySuppress': 'discoverySuppress_x',
+    'staffSuppress': 'staffSuppress',
+    'metadata.createdDate': 'metadata.createdDate_x',
+    'metadata.updatedDate': 'metadata.updatedDate_x',
+    'metadata.createdByUserId': 'metadata.createdByUserId_x',
+    'metadata.updatedByUserId': 'metadata.updatedByUserId_x'
+}
+
+HOLDINGS_FIELDS = {
+    'id': 'id_y',
+    'hrid': 'hrid_y',
+    'instanceId': 'instanceId',
+    'permanentLocationId': 'permanentLocationId_x',
+    'effectiveLocationId': 'effectiveLocationId_x',
+    'callNumber': 'callNumber',
+    'discoverySuppress': 'discoverySuppress_y',
+    'metadata.createdDate': 'metadata.createdDate_y',
+    'metadata.updatedDate': 'metadata.updatedDate_y',
+    'metadata.createdByUserId': 'metadata.createdByUserId_y',
+    'metadata.updatedByUserId': 'metadata.updatedByUserId_y'
+}
+
+ITEM_FIELDS = {
+    'id': 'id',
+    'hrid': 'hrid',
+    'holdingsRecordId': 'holdingsRecordId',
+    'barcode': 'barcode',
+    'itemLevelCallNumber': 'itemLevelCallNumber',
+    'copyNumber': 'copyNumber',
+    'volume': 'volume',
+    'status.name': 'status.name',
+    'materialTypeId': 'materialTypeId',
+    'permanentLoanTypeId': 'permanentLoanTypeId',
+    'permanentLocationId': 'permanentLocationId_y',
+    'effectiveLocationId': 'effectiveLocationId_y',
+    'discoverySuppress': 'discoverySuppress',
+    'statisticalCodeIds': 'statisticalCodeIds',
+    'itemNotes': 'itemNotes',
+    'tags.tagList': 'tags.tagList',
+    'lastCheckIn.dateTime': 'lastCheckIn.dateTime',
+    'metadata.createdDate': 'metadata.createdDate',
+    'metadata.updatedDate': 'metadata.updatedDate',
+    'metadata.createdByUserId': 'metadata.createdByUserId',
+    'metadata.updatedByUserId': 'metadata.updatedByUserId'
+}
+
+# UUID columns of each record type that get integer join keys, and the key they become.
+# A record's own id and the foreign keys pointing at it share the same key name.
+INSTANCE_KEYS = {'id': 'instance_key'}
+HOLDINGS_KEYS = {'id': 'holding_key', 'instanceId': 'instance_key'}
+ITEM_KEYS = {'id': 'item_key', 'holdingsRecordId': 'holding_key'}
+LOAN_KEYS = {'itemId': 'item_key', 'userId': 'user_key'}
+USER_KEYS = {'id': 'user_key'}
+
+# Low-cardinality fields stored as categoricals at harvest time
+INSTANCE_CATEGORY_FIELDS = ['metadata.createdByUserId', 'metadata.updatedByUserId']
+HOLDINGS_CATEGORY_FIELDS = ['permanentLocationId', 'effectiveLocationId',
+                            'metadata.createdByUserId', 'metadata.updatedByUserId']
+ITEM_CATEGORY_FIELDS = ['status.name', 'materialTypeId', 'permanentLoanTypeId', 'permanentLocationId',
+                        'effectiveLocationId', 'statisticalCodeIds',
+                        'metadata.createdByUserId', 'metadata.updatedByUserId']
+
+# Function to get the pair of columns holding an integer join key
+def key_columns(key):
+    return [f'_{key}_hi', f'_{key}_lo']
+
+# Function to turn UUID strings into compact integer keys
+def uuid_keys(values):
+    """
+    Convert a Series of UUID strings into two uint64 arrays holding the high and
+    low 64 bits of each UUID. Missing or malformed values become 0, 0 (the nil
+    UUID), which with_key() treats as no key.
+    """
+    hexes = values.astype(object).fillna('').astype(str).str.replace('-', '', regex=False)
+    valid = hexes.str.fullmatch('[0-9a-fA-F]{32}').to_numpy(dtype=bool)
+    hi = np.zeros(len(values), dtype=np.uint64)
+    lo = np.zeros(len(values), dtype=np.uint64)
+    if valid.any():
+        pairs = np.frombuffer(bytes.fromhex(''.join(hexes[valid])), dtype='>u8').reshape(-1, 2)
+        hi[valid] = pairs[:, 0]
+        lo[valid] = pairs[:, 1]
+    return hi, lo
+
+# Function to leave out the rows without a join key, which would otherwise all join to each other
+def with_key(df, key):
+    hi, lo = key_columns(key)
+    present = (df[hi].to_numpy() != 0) | (df[lo].to_numpy() != 0)
+    return df if present.all() else df[present]
+
+# Function to store columns as categoricals
+def categorize(df, columns):
+    for col in columns:
+        if col in df.columns and df[col].dtype != 'category':
+            df[col] = df[col].astype('category')
+    return df
+
+# Function to prepare a harvested table for joining
+def prepare_table(df, keys, category_columns=()):
+    """
+    Add the integer join keys of the table's UUID columns, as hidden _<key>_hi and
+    _<key>_lo columns, and store its low-cardinality columns as categoricals.
+    """
+    for col, key in keys.items():
+        if col in df.columns:
+            hi, lo = uuid_keys(df[col])
+        else:
+            hi, lo = np.zeros(len(df), dtype=np.uint64), np.zeros(len(df), dtype=np.uint64)
+        hi_col, lo_col = key_columns(key)
+        df[hi_col] = hi
+        df[lo_col] = lo
+    return categorize(df, category_columns)
+
+# Function to list the columns offered to the user, leaving out the hidden key columns
+def visible_columns(df):
+    return [col for col in df.columns if not col.startswith('_')]
+
 # Function to get instances data
-def get_instances(url, header_dict):
-    limit = "?limit=2000000"
-    with st.spinner('Fetching instances data...'):
-        response_instances = requests.get(url+"/instance-storage/instances"+limit, headers=header_dict).json()
-        df_instances = pd.json_normalize(response_instances, record_path='instances')
+def get_instances(url, header_dict, query=None, ids=None):
+    with status_spinner('Fetching instances data...'):
+        df_instances = harvest_dataframe(url, header_dict, "/instance-storage/instances", "instances", query,
+                                         flatten_instance, list(INSTANCE_FIELDS), INSTANCE_CATEGORY_FIELDS, ids)
+        df_instances = prepare_table(df_instances, INSTANCE_KEYS, INSTANCE_CATEGORY_FIELDS)
     return df_instances
 
 # Function to get holdings data
-def get_holdings(url, header_dict):
-    limit = "?limit=2000000"
-    with st.spinner('Fetching holdings data...'):
-        response_instances = requests.get(url+"/holdings-storage/holdings"+limit, headers=header_dict).json()
-        df_holdings = pd.json_normalize(response_instances, record_path='holdingsRecords')
+def get_holdings(url, header_dict, query=None, ids=None):
+    with status_spinner('Fetching holdings data...'):
+        df_holdings = harvest_dataframe(url, header_dict, "/holdings-storage/holdings", "holdingsRecords", query,
+                                        columns=list(HOLDINGS_FIELDS), shared_columns=HOLDINGS_CATEGORY_FIELDS, ids=ids)
+        df_holdings = prepare_table(df_holdings, HOLDINGS_KEYS, HOLDINGS_CATEGORY_FIELDS)
     return df_holdings
 
 # Function to get items data
-def get_items(url, header_dict):
-    limit = "?limit=2000000"
-    with st.spinner('Fetching items data...'):
-        response_instances = requests.get(url+"/item-storage/items"+limit, headers=header_dict).json()
-        df_items = pd.json_normalize(response_instances, record_path='items')
+def get_items(url, header_dict, query=None):
+    with status_spinner('Fetching items data...'):
+        df_items = harvest_dataframe(url, header_dict, "/item-storage/items", "items", query,
+                                     flatten_item, list(ITEM_FIELDS), ITEM_CATEGORY_FIELDS)
+        df_items = prepare_table(df_items, ITEM_KEYS, ITEM_CATEGORY_FIELDS)
     return df_items
 
 # Function to get locations
 def get_locations(url, header_dict):
     limit = "?limit=2000000"
-    with st.spinner('Fetching locations data...'):
-        response_instances = requests.get(url+"/locations"+limit, headers=header_dict).json()
+    with status_spinner('Fetching locations data...'):
+        response_instances = get_client(url, header_dict).get("/locations"+limit).json()
         df_location = pd.json_normalize(response_instances, record_path='locations')
     return df_location
 
 # Function to get material types
 def get_mtypes(url, header_dict):
     limit = "?limit=2000000"
-    with st.spinner('Fetching material types...'):
-        response_instances = requests.get(url+"/material-types"+limit, headers=header_dict).json()
+    with status_spinner('Fetching material types...'):
+        response_instances = get_client(url, header_dict).get("/material-types"+limit).json()
         df_mtypes = pd.json_normalize(response_instances, record_path='mtypes')
     return df_mtypes
 
 # Function to get statistical codes
 def get_statistical_codes(url, header_dict):
     limit = "?limit=2000"
-    with st.spinner('Fetching statistical codes...'):
-        response_instances = requests.get(url+"/statistical-codes"+limit, headers=header_dict).json()
+    with status_spinner('Fetching statistical codes...'):
+        response_instances = get_client(url, header_dict).get("/statistical-codes"+limit).json()
         df_statcode = pd.json_normalize(response_instances, record_path='statisticalCodes')
     return df_statcode
 
 # Function to get loan types
 def get_loan_types(url, header_dict):
     limit = "?limit=2000000"
-    with st.spinner('Fetching loan types...'):
-        response_instances = requests.get(url+"/loan-types"+limit, headers=header_dict).json()
+    with status_spinner('Fetching loan types...'):
+        response_instances = get_client(url, header_dict).get("/loan-types"+limit).json()
         df_loantypes = pd.json_normalize(response_instances, record_path='loantypes')
     return df_loantypes
 
-# Function to get user information by UUID
-def get_user_by_id(url, header_dict, user_id):
+# Number of user IDs resolved by a single /users query
+USER_BATCH_SIZE = 50
+
+# Metadata columns holding creator/updater IDs and the name columns derived from them
+USER_ID_COLUMNS = {
+    'instance_creator_name': 'metadata.createdByUserId_x',
+    'instance_updater_name': 'metadata.updatedByUserId_x',
+    'holding_creator_name': 'metadata.createdByUserId_y',
+    'holding_updater_name': 'metadata.updatedByUserId_y',
+    'item_creator_name': 'metadata.createdByUserId',
+    'item_updater_name': 'metadata.updatedByUserId'
+}
+
+# Function to build a display name from a user record
+def format_user_name(user_data, user_id):
     """
-    Fetch user information for a given user ID from the users endpoint.
-    Returns the username or the original ID if user not found.
+    Return the username of a user record, falling back to the personal name
+    and then to the user ID itself.
     """
-    if not user_id or user_id == '':
-        return "Unknown"
-    
-    # Cache for users to avoid repeated API calls for the same user
-    if 'user_cache' not in st.session_state:
-        st.session_state.user_cache = {}
-    
-    # Return from cache if available
-    if user_id in st.session_state.user_cache:
-        return st.session_state.user_cache[user_id]
-    
-    try:
-        response = requests.get(f"{url}/users/{user_id}", headers=header_dict)
-        if response.status_code == 200:
-            user_data = response.json()
-            username = user_data.get('username', '')
-            # If username is empty, try to get name from personal data
-            if not username:
-                personal = user_data.get('personal', {})
-                last_name = personal.get('lastName', '')
-                first_name = personal.get('firstName', '')
-                if last_name or first_name:
-                    username = f"{first_name} {last_name}".strip()
-                else:
-                    username = user_id  # Fall back to ID if no name found
-            
-            # Store in cache
-            st.session_state.user_cache[user_id] = username
-            return username
+    username = user_data.get('username', '')
+    # If username is empty, try to get name from personal data
+    if not username:
+        personal = user_data.get('personal', {})
+        last_name = personal.get('lastName', '')
+        first_name = personal.get('firstName', '')
+        if last_name or first_name:
+            username = f"{first_name} {last_name}".strip()
         else:
-            # User not found, store ID in cache to avoid repeated failed lookups
-            st.session_state.user_cache[user_id] = f"User {user_id[:8]}..."
-            return f"User {user_id[:8]}..."
-    except Exception as e:
-        # Error during API call, store error in cache
-        error_msg = f"Error: {str(e)[:20]}..."
-        st.session_state.user_cache[user_id] = error_msg
-        return error_msg
+            username = user_id  # Fall back to ID if no name found
+    return username
+
+# Function to fetch a batch of users with a single CQL query
+def fetch_user_batch(url, header_dict, user_ids):
+    response = get_client(url, header_dict).get("/users", params={"query": cql_any('id', user_ids), "limit": len(user_ids)})
+    response.raise_for_status()
+    return response.json().get('users', [])
+
+# Function to resolve many user IDs to names
+def resolve_user_names(url, header_dict, user_ids):
+    """
+    Resolve user IDs to display names.
+    IDs missing from the user cache are looked up in batches of USER_BATCH_SIZE,
+    with the batches queried concurrently. Returns a dictionary of ID to name.
+    """
+    user_cache = session_value('user_cache', dict)
+
+    missing = [user_id for user_id in user_ids if user_id not in user_cache]
+    batches = [missing[i:i + USER_BATCH_SIZE] for i in range(0, len(missing), USER_BATCH_SIZE)]
+
+    if batches:
+        with ThreadPoolExecutor(max_workers=HTTP_MAX_WORKERS) as pool:
+            futures = [(batch, pool.submit(fetch_user_batch, url, header_dict, batch)) for batch in batches]
+            for number, (batch, future) in enumerate(futures, 1):
+                try:
+                    users = {user['id']: format_user_name(user, user['id']) for user in future.result()}
+                except Exception as e:
+                    # Error during API call, store error in cache
+                    error_msg = f"Error: {str(e)[:20]}..."
+                    users = {user_id: error_msg for user_id in batch}
+                for user_id in batch:
+                    # Users that were not found are cached too, to avoid repeated failed lookups
+                    user_cache[user_id] = users.get(user_id, f"User {user_id[:8]}...")
+                report_progress(done=min(number * USER_BATCH_SIZE, len(missing)), total=len(missing))
+
+    return {user_id: user_cache[user_id] for user_id in user_ids}
 
 # Function to process user IDs in batch
 def process_user_ids(df, url, header_dict):
     """
     Process all user IDs in the dataframe and add username columns.
+    The unique IDs of all metadata columns are resolved together, then mapped
+    back onto each column.
     """
-    with st.spinner('Fetching user information...'):
+    with status_spinner('Fetching user information...'):
+        id_columns = {name_col: id_col for name_col, id_col in USER_ID_COLUMNS.items() if id_col in df.columns}
+        user_ids = set()
+        for id_col in id_columns.values():
+            user_ids.update(df[id_col].dropna().unique())
+        user_ids.discard('')
+
+        user_names = resolve_user_names(url, header_dict, sorted(user_ids))
+
         # Create new columns for usernames
-        df['instance_creator_name'] = df['metadata.createdByUserId_x'].apply(
-            lambda x: get_user_by_id(url, header_dict, x) if pd.notna(x) else "Unknown"
-        )
-        df['instance_updater_name'] = df['metadata.updatedByUserId_x'].apply(
-            lambda x: get_user_by_id(url, header_dict, x) if pd.notna(x) else "Unknown"
-        )
-        df['holding_creator_name'] = df['metadata.createdByUserId_y'].apply(
-            lambda x: get_user_by_id(url, header_dict, x) if pd.notna(x) else "Unknown"
-        )
-        df['holding_updater_name'] = df['metadata.updatedByUserId_y'].apply(
-            lambda x: get_user_by_id(url, header_dict, x) if pd.notna(x) else "Unknown"
-        )
-        df['item_creator_name'] = df['metadata.createdByUserId'].apply(
-            lambda x: get_user_by_id(url, header_dict, x) if pd.notna(x) else "Unknown"
-        )
-        df['item_updater_name'] = df['metadata.updatedByUserId'].apply(
-            lambda x: get_user_by_id(url, header_dict, x) if pd.notna(x) else "Unknown"
-        )
+        for name_col, id_col in id_columns.items():
+            df[name_col] = df[id_col].map(user_names).astype(object).fillna("Unknown")
     return df
 
 # Function to get patron groups
@@ -175,11 +931,8 @@ def get_patron_groups(url, header_dict):
     Returns a dictionary mapping patron group IDs to their names
     """
     try:
-        # Construct the URL for patron groups endpoint
-        groups_url = f"{url}/groups?limit=1000"
-        
-        # Make the API request
-        response = requests.get(groups_url, headers=header_dict)
+        # Make the API request to the patron groups endpoint
+        response = get_client(url, header_dict).get("/groups?limit=1000")
         response.raise_for_status()
         
         # Parse the response
@@ -194,9 +947,14 @@ def get_patron_groups(url, header_dict):
         
         return group_dict
     except Exception as e:
-        st.error(f"Error fetching patron groups: {str(e)}")
+        notify(f"Error fetching patron groups: {str(e)}", "error")
         return {}
 
+# Function to get patron groups as a table, as kept in the snapshot store
+def get_patron_groups_df(url, header_dict):
+    patron_groups = get_patron_groups(url, header_dict)
+    return pd.DataFrame({'id': list(patron_groups.keys()), 'group': list(patron_groups.values())})
+
 # Helper functions for data processing
 def extract_and_concatenate_notes(notes_list):
     """
@@ -221,212 +979,2199 @@ def safe_parse(x):
     Safely parse a string representation of a list of dictionaries into an actual list.
     If parsing fails, return an empty list.
     """
-    if isinstance(x, str):
-        try:
-            # Try to parse using ast.literal_eval
-            parsed = ast.literal_eval(x)
-            if isinstance(parsed, list):
-                return parsed
-        except (SyntaxError, ValueError):
-            pass
-    elif isinstance(x, list):
-        return x
-    return []
+    if isinstance(x, str):
+        try:
+            # Try to parse using ast.literal_eval
+            parsed = ast.literal_eval(x)
+            if isinstance(parsed, list):
+                return parsed
+        except (SyntaxError, ValueError):
+            pass
+    elif isinstance(x, list):
+        return x
+    return []
+
+def parse_publication_info_adaptive(publication_data):
+    """
+    Parse publication information from various formats and extract publisher, place, and date.
+    Handles both list and string representations. Returns a (publisher, place, date) tuple.
+    """
+    publisher = ''
+    place = ''
+    date = ''
+    
+    # Convert to list format if it's a string
+    publications = safe_parse(publication_data)
+    
+    if publications:
+        for pub in publications:
+            # Extract publisher
+            if 'publisher' in pub and pub['publisher']:
+                publisher = pub['publisher']
+                
+            # Extract place
+            if 'place' in pub and pub['place']:
+                place = pub['place']
+                
+            # Extract date of publication
+            if 'dateOfPublication' in pub and pub['dateOfPublication']:
+                date = pub['dateOfPublication']
+                
+            # If we have all three pieces of information, we can stop
+            if publisher and place and date:
+                break
+    
+    return publisher, place, date
+
+def extract_alternative_title(alt_titles):
+    """Extract the first alternative title from a list of alternative titles."""
+    alt_titles_list = safe_parse(alt_titles)
+    if alt_titles_list and len(alt_titles_list) > 0 and 'alternativeTitle' in alt_titles_list[0]:
+        return alt_titles_list[0]['alternativeTitle']
+    return np.nan
+
+def extract_vtls020(id_list):
+    """Extract ISBN from identifiers list."""
+    id_list = safe_parse(id_list)
+    for identifier in id_list:
+        if isinstance(identifier, dict) and identifier.get('identifierTypeId') == "8261054f-be78-422d-bd51-4ed9f33c3422":
+            return identifier.get('value', '')
+    return ''
+
+# Function to flatten a raw instance record
+def flatten_instance(record):
+    """
+    Replace the nested contributors, publication, alternativeTitles and identifiers
+    lists of an instance record with the scalar fields the reports show.
+    """
+    contributors = record.pop('contributors', None)
+    record['contributors'] = contributors[0].get('name', '') if isinstance(contributors, list) and contributors else ''
+    record['publisher'], record['place'], record['dateOfPublication'] = parse_publication_info_adaptive(record.pop('publication', None))
+    record['alternativeTitleExtracted'] = extract_alternative_title(record.pop('alternativeTitles', None))
+    record['ISBN'] = extract_vtls020(record.pop('identifiers', None))
+    return record
+
+# Function to flatten a raw item record
+def flatten_item(record):
+    """
+    Replace the nested notes and statisticalCodeIds lists of an item record with
+    pipe and comma separated text.
+    """
+    record['itemNotes'] = extract_and_concatenate_notes(record.pop('notes', None))
+    record['statisticalCodeIds'] = ','.join(map(str, record.get('statisticalCodeIds') or []))
+    return record
+
+# Page size used for the offset-paged circulation endpoints
+CIRCULATION_PAGE_SIZE = 1000
+
+# Function to fetch a single offset page
+def fetch_page(url, header_dict, path, record_key, limit, offset, query_param=""):
+    """
+    Fetch one page of an offset-paged endpoint.
+    Returns the records of the page and the totalRecords reported by the server.
+    """
+    paginated_path = f"{path}?limit={limit}&offset={offset}{query_param}"
+    response = get_client(url, header_dict).get(paginated_path)
+    response.raise_for_status()  # Check for HTTP errors
+    data = response.json()
+    return data.get(record_key, []), data.get('totalRecords')
+
+# Function to fetch all pages of an offset-paged endpoint concurrently
+def fetch_all_pages(url, header_dict, path, record_key, query_param="",
+                    limit=CIRCULATION_PAGE_SIZE, max_workers=HTTP_MAX_WORKERS):
+    """
+    Fetch every record of an offset-paged endpoint.
+    The first page tells us totalRecords, the remaining offsets are then fetched on a
+    bounded thread pool and the pages are put back in order. Should the server report
+    fewer records than it actually has, the remaining pages are fetched one by one.
+    On error, the records of the pages before the failing one are returned, along
+    with a flag telling whether the harvest completed.
+    """
+    all_records = []  # List to hold all records
+    try:
+        page, total = fetch_page(url, header_dict, path, record_key, limit, 0, query_param)
+        all_records.extend(page)
+        report_progress(done=len(all_records), total=total)
+        offset = limit
+
+        if len(page) == limit and total and total > limit:
+            offsets = list(range(limit, total, limit))
+            pool = ThreadPoolExecutor(max_workers=max_workers)
+            try:
+                futures = [pool.submit(fetch_page, url, header_dict, path, record_key, limit, o, query_param)
+                           for o in offsets]
+                for future in futures:
+                    page, _ = future.result()
+                    all_records.extend(page)
+                    report_progress(done=len(all_records), total=total)
+            finally:
+                pool.shutdown(wait=True, cancel_futures=True)
+            offset = offsets[-1] + limit
+
+        while len(page) == limit:
+            page, _ = fetch_page(url, header_dict, path, record_key, limit, offset, query_param)
+            all_records.extend(page)
+            report_progress(done=len(all_records))
+            offset += limit
+    except requests.exceptions.HTTPError as err:
+        notify(f"HTTP error occurred: {err}", "error")
+    except requests.exceptions.RequestException as e:
+        notify(f"Error making request: {e}", "error")
+    except ValueError as e:
+        notify(f"Error decoding JSON: {e}", "error")
+    else:
+        return all_records, True
+    return all_records, False
+
+# Function to get loan data
+def get_loans(url, header_dict, query_param=""):
+    with status_spinner('Fetching loan data...'):
+        all_loans, complete = fetch_all_pages(url, header_dict, "/circulation/loans", "loans", query_param)
+
+    # Once all data is fetched, convert it to a DataFrame
+    if all_loans:
+        df_loans = prepare_table(pd.json_normalize(all_loans), LOAN_KEYS)
+        df_loans.attrs['partial'] = not complete
+        return df_loans
+    else:
+        notify("No loans data found.", "warning")
+        return pd.DataFrame()
+
+# Function to get user data
+def get_users(url, header_dict, query_param=""):
+    with status_spinner('Fetching user data...'):
+        all_users, complete = fetch_all_pages(url, header_dict, "/users", "users", query_param)
+
+    # Once all data is fetched, convert it to a DataFrame
+    if all_users:
+        df_users = prepare_table(pd.json_normalize(all_users), USER_KEYS)
+        df_users.attrs['partial'] = not complete
+        return df_users
+    else:
+        notify("No users data found.", "warning")
+        return pd.DataFrame()
+
+# Function to get fines data
+def get_fines(url, header_dict):
+    with status_spinner('Fetching fines data...'):
+        all_fines, complete = fetch_all_pages(url, header_dict, "/accounts", "accounts")
+
+    # Once all data is fetched, convert it to a DataFrame
+    if all_fines:
+        df_fines = pd.json_normalize(all_fines)
+        df_fines.attrs['partial'] = not complete
+        return df_fines
+    else:
+        notify("No fines data found.", "warning")
+        return pd.DataFrame()
+
+# Function to get loan count data
+def get_loan_count_data(url, header_dict, query_param=""):
+    with status_spinner('Fetching loan count data...'):
+        all_loan_counts, complete = fetch_all_pages(url, header_dict, "/circulation/loans", "loans", query_param)
+
+    # Once all data is fetched, convert it to a DataFrame
+    if all_loan_counts:
+        df_loan_counts = prepare_table(pd.json_normalize(all_loan_counts), LOAN_KEYS)
+        df_loan_counts.attrs['partial'] = not complete
+        return df_loan_counts
+    else:
+        notify("No loan count data found.", "warning")
+        return pd.DataFrame()
+
+# Directory and default maximum age of the on-disk snapshots of harvested tables
+SNAPSHOT_DIR = os.environ.get("MEDAD_SNAPSHOT_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".snapshots"))
+SNAPSHOT_TTL_HOURS = float(os.environ.get("MEDAD_SNAPSHOT_TTL_HOURS", "24"))
+# Bumped whenever the layout of the stored tables changes, so older snapshots are ignored
+SNAPSHOT_VERSION = 4
+
+# Function to get the snapshot directory of a tenant
+def snapshot_dir(url, tenant):
+    key = hashlib.sha1(f"{url.rstrip('/')}|{tenant}".encode()).hexdigest()[:16]
+    return os.path.join(SNAPSHOT_DIR, key)
+
+# Function to read the manifest describing the stored tables of a tenant
+def read_snapshot_manifest(url, tenant):
+    path = os.path.join(snapshot_dir(url, tenant), "manifest.json")
+    try:
+        with open(path, encoding="utf-8") as f:
+            manifest = json.load(f)
+        if manifest.get('version') == SNAPSHOT_VERSION:
+            return manifest
+    except (OSError, ValueError):
+        pass
+    return {'version': SNAPSHOT_VERSION, 'okapi_url': url, 'tenant': tenant, 'tables': {}}
+
+def write_snapshot_manifest(url, tenant, manifest):
+    path = os.path.join(snapshot_dir(url, tenant), "manifest.json")
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(path + ".tmp", path)
+
+def encode_snapshot_columns(df):
+    """
+    Make a harvested table storable as Parquet.
+    Columns holding nested lists or dictionaries are stored as JSON text and other
+    mixed-type columns as strings. Returns the table and the JSON encoded columns.
+    """
+    df = df.copy(deep=False)
+    json_columns = []
+    for col in df.columns[df.dtypes == object]:
+        values = df[col]
+        if pd.api.types.infer_dtype(values, skipna=True) not in ('mixed', 'mixed-integer'):
+            continue
+        present = values.notna()
+        encoded = pd.Series(None, index=values.index, dtype=object)
+        if values[present].map(lambda v: isinstance(v, (list, dict))).any():
+            encoded[present] = values[present].map(json.dumps)
+            json_columns.append(col)
+        else:
+            encoded[present] = values[present].astype(str)
+        df[col] = encoded
+    return df, json_columns
+
+# Function to get the lock that serializes snapshot writes across sessions and background loads
+@st.cache_resource(show_spinner=False)
+def snapshot_lock():
+    return threading.Lock()
+
+# Fetched once per script run, like OKAPI_CLIENTS
+SNAPSHOT_LOCK = snapshot_lock()
+
+# Function to save a harvested table to the snapshot store
+def save_snapshot(url, tenant, name, df, harvested_at):
+    directory = snapshot_dir(url, tenant)
+    os.makedirs(directory, exist_ok=True)
+    stored_df, json_columns = encode_snapshot_columns(df)
+    path = os.path.join(directory, f"{name}.parquet")
+    # Background loads running side by side may store the same table and update the manifest at once
+    with SNAPSHOT_LOCK:
+        stored_df.to_parquet(path + ".tmp", compression="zstd", index=False)
+        os.replace(path + ".tmp", path)
+
+        manifest = read_snapshot_manifest(url, tenant)
+        manifest['tables'][name] = {
+            'harvested_at': harvested_at.isoformat(),
+            'rows': len(df),
+            'json_columns': json_columns
+        }
+        write_snapshot_manifest(url, tenant, manifest)
+
+# Function to load a harvested table from the snapshot store
+def load_snapshot(url, tenant, name, ttl_hours):
+    """
+    Return a stored table if it was harvested less than ttl_hours ago, otherwise None.
+    A ttl_hours of None accepts a stored table of any age.
+    """
+    entry = read_snapshot_manifest(url, tenant)['tables'].get(name)
+    if not entry:
+        return None
+    if ttl_hours is not None:
+        harvested_at = datetime.datetime.fromisoformat(entry['harvested_at'])
+        if ttl_hours <= 0 or datetime.datetime.now(datetime.timezone.utc) - harvested_at > datetime.timedelta(hours=ttl_hours):
+            return None
+    try:
+        df = pd.read_parquet(os.path.join(snapshot_dir(url, tenant), f"{name}.parquet"))
+    except (OSError, ValueError):
+        return None
+    for col in entry['json_columns']:
+        present = df[col].notna()
+        decoded = pd.Series(None, index=df.index, dtype=object)
+        decoded[present] = df.loc[present, col].map(json.loads)
+        df[col] = decoded
+    return df
+
+# Function to remove all snapshots of a tenant
+def clear_snapshots(url, tenant):
+    directory = snapshot_dir(url, tenant)
+    if os.path.isdir(directory):
+        for file_name in os.listdir(directory):
+            os.remove(os.path.join(directory, file_name))
+        os.rmdir(directory)
+
+# Function to load a table through the snapshot store
+def load_table(name, loader, url, header_dict, refresh=False):
+    """
+    Return the table called name from the snapshot store while it is fresh,
+    otherwise harvest it with loader(url, header_dict) and store it. With refresh,
+    the table is harvested even when its snapshot is fresh.
+    Empty or partially harvested tables are never stored.
+    """
+    tenant = header_dict["x-okapi-tenant"]
+    ttl_hours = session_value('snapshot_ttl_hours', lambda: SNAPSHOT_TTL_HOURS)
+    df = None if refresh else load_snapshot(url, tenant, name, ttl_hours)
+    if df is not None:
+        return df
+
+    harvested_at = datetime.datetime.now(datetime.timezone.utc)
+    df = loader(url, header_dict)
+    if not df.empty and not df.attrs.get('partial'):
+        try:
+            save_snapshot(url, tenant, name, df, harvested_at)
+        except Exception as e:
+            notify(f"Could not save {name} snapshot: {str(e)}", "warning")
+    return df
+
+# Coarse filters of a scoped load, by the name they are shown with. Their IDs are pushed
+# down to Medad as CQL, so only the matching records are downloaded.
+LOAD_SCOPE_FIELDS = {'locations': "Locations", 'material_types': "Material types", 'patron_groups': "Patron groups"}
+
+# Function to get the names the coarse filters of a scoped load are chosen by, each mapped to its ID
+def load_scope_options(url, header_dict):
+    tables = {'locations': (load_table("locations", get_locations, url, header_dict), 'name'),
+              'material_types': (load_table("mtypes", get_mtypes, url, header_dict), 'name'),
+              'patron_groups': (load_table("groups", get_patron_groups_df, url, header_dict), 'group')}
+    return {field: {name: record_id for name, record_id in zip(df.get(name_col, []), df.get('id', []))
+                    if isinstance(name, str)}
+            for field, (df, name_col) in tables.items()}
+
+# Function to build the scope of a load from the chosen names and loan period
+def build_load_scope(options, locations=(), material_types=(), patron_groups=(), loans_from=None, loans_to=None):
+    """
+    Return the scope as the IDs of the chosen locations, material types and patron
+    groups, their names for display, and the ISO dates of the loan period, or None
+    when nothing is chosen. Raises ValueError for a name the options do not have.
+    """
+    scope = {'names': {}}
+    for field, names in (('locations', locations), ('material_types', material_types), ('patron_groups', patron_groups)):
+        if not names:
+            continue
+        unknown = [name for name in names if name not in options[field]]
+        if unknown:
+            raise ValueError(f"Unknown {LOAD_SCOPE_FIELDS[field].lower()[:-1]} {unknown[0]!r}")
+        scope[field] = sorted(options[field][name] for name in names)
+        scope['names'][field] = sorted(names)
+    if loans_from:
+        scope['loans_from'] = loans_from.isoformat()
+    if loans_to:
+        scope['loans_to'] = loans_to.isoformat()
+    return scope if len(scope) > 1 else None
+
+# Function to describe the parts of a scope that apply to a report, or '' when none do
+def describe_scope(scope, fields, loans=False):
+    if not scope:
+        return ""
+    parts = [f"{LOAD_SCOPE_FIELDS[field]}: {', '.join(scope['names'][field])}" for field in fields if field in scope]
+    if loans and (scope.get('loans_from') or scope.get('loans_to')):
+        parts.append(f"Loans: {scope.get('loans_from', '...')} to {scope.get('loans_to', '...')}")
+    return "; ".join(parts)
+
+# Function to get the CQL query selecting the items of a scoped load, or None when items are not scoped
+def item_scope_query(scope):
+    scope = scope or {}
+    conditions = []
+    if scope.get('locations'):
+        conditions.append(cql_any('effectiveLocationId', scope['locations']))
+    if scope.get('material_types'):
+        conditions.append(cql_any('materialTypeId', scope['material_types']))
+    return " and ".join(conditions) or None
+
+# Function to get the CQL query selecting the loans of a scoped load, or None when loans are not scoped
+def loan_scope_query(scope, by_location=True):
+    scope = scope or {}
+    conditions = []
+    if scope.get('loans_from'):
+        conditions.append(f"loanDate>={cql_string(scope['loans_from'])}")
+    if scope.get('loans_to'):
+        # Loan dates are timestamps, so the last day ends where the next one starts
+        until = datetime.date.fromisoformat(scope['loans_to']) + datetime.timedelta(days=1)
+        conditions.append(f"loanDate<{cql_string(until.isoformat())}")
+    if by_location and scope.get('locations'):
+        conditions.append(cql_any('itemEffectiveLocationIdAtCheckOut', scope['locations']))
+    return " and ".join(conditions) or None
+
+# Function to get the CQL query selecting the users of a scoped load, or None when users are not scoped
+def user_scope_query(scope):
+    scope = scope or {}
+    return cql_any('patronGroup', scope['patron_groups']) if scope.get('patron_groups') else None
+
+# Function to get the snapshot name of a table harvested with a scope query, so each scope is stored apart
+def scoped_name(name, query):
+    if not query:
+        return name
+    return f"{name}-{hashlib.sha1(query.encode()).hexdigest()[:12]}"
+
+# Function to load the records a scoped table links to through the snapshot store
+def load_linked_table(name, loader, url, header_dict, ids, refresh=False):
+    """
+    Return the records with the given IDs, harvested with loader(url, header_dict, ids=...).
+    A fresh stored table is topped up with the linked records it lacks, such as those of
+    items that entered the scope since it was stored, and stored again.
+    """
+    tenant = header_dict["x-okapi-tenant"]
+    ids = set() if ids is None else set(pd.Series(ids).dropna())
+    ttl_hours = session_value('snapshot_ttl_hours', lambda: SNAPSHOT_TTL_HOURS)
+    df = None if refresh else load_snapshot(url, tenant, name, ttl_hours)
+    if df is None or df.empty:
+        harvested_at = datetime.datetime.now(datetime.timezone.utc)
+        df, missing = pd.DataFrame(), ids
+    else:
+        # Topping up keeps the age of the stored records
+        harvested_at = datetime.datetime.fromisoformat(read_snapshot_manifest(url, tenant)['tables'][name]['harvested_at'])
+        missing = ids - set(df['id'])
+    if not missing:
+        return df
+
+    fetched = loader(url, header_dict, ids=missing)
+    if fetched.empty:
+        return df
+    if not df.empty:
+        category_columns = df.columns[df.dtypes == 'category']
+        fetched = categorize(pd.concat([df, fetched], ignore_index=True), category_columns)
+    try:
+        save_snapshot(url, tenant, name, fetched, harvested_at)
+    except Exception as e:
+        notify(f"Could not save {name} snapshot: {str(e)}", "warning")
+    return fetched
+
+# User-friendly names of the bibliographic report columns
+BIBLIOGRAPHIC_COLUMN_RENAMES = {
+    'title': 'Title',
+    'contributors': 'Author',
+    'publisher': 'Publisher',
+    'place': 'Place of Publication',
+    'dateOfPublication': 'Publication Date',
+    'ISBN': 'ISBN',
+    'callNumber': 'Call Number',
+    'barcode': 'Barcode',
+    'status.name': 'Item Status',
+    'locationName': 'Location',
+    'materialTypeName': 'Material Type',
+    'loanTypeName': 'Loan Type',
+    'itemNotes': 'Notes',
+    'alternativeTitleExtracted': 'Alternative Title',
+    'instance_creator_name': 'Instance Creator',
+    'instance_updater_name': 'Instance Updater',
+    'holding_creator_name': 'Holding Creator',
+    'holding_updater_name': 'Holding Updater',
+    'item_creator_name': 'Item Creator',
+    'item_updater_name': 'Item Updater'
+}
+
+# Function to join and enrich the inventory tables into the bibliographic report
+def build_bibliographic_report(df_instances, df_holdings, df_items, df_location, df_mtypes, df_statcode, url, header_dict):
+    """
+    Merge instances, holdings and items into one row per item and add the location,
+    material type, statistical code and user name columns.
+    """
+    # Keep the declared fields and join keys of each table under their report column names
+    instance_key = key_columns('instance_key')
+    holding_key = key_columns('holding_key')
+    item_key = key_columns('item_key')
+    df_instances = df_instances.reindex(columns=list(INSTANCE_FIELDS) + instance_key).rename(columns=INSTANCE_FIELDS)
+    df_holdings = df_holdings.reindex(columns=list(HOLDINGS_FIELDS) + holding_key + instance_key).rename(columns=HOLDINGS_FIELDS)
+    df_items = df_items.reindex(columns=list(ITEM_FIELDS) + item_key + holding_key).rename(columns=ITEM_FIELDS)
+    
+    # First merge instances with holdings, on the integer instance key
+    merged_df = with_key(df_instances, 'instance_key').merge(with_key(df_holdings, 'instance_key'), on=instance_key, how='inner')
+    
+    # Then merge with items, on the integer holdings key
+    final_df = with_key(merged_df, 'holding_key').merge(with_key(df_items, 'holding_key'), on=holding_key, how='inner')
+    
+    # The foreign keys duplicate id_x and id_y; only the item key is needed from here on
+    final_df = final_df.drop(columns=instance_key + holding_key + ['instanceId', 'holdingsRecordId'])
+    
+    # Author, publication details, alternative title, ISBN and item notes were
+    # already flattened out of the raw records at harvest time
+    
+    # Map location, material type and statistical code IDs to names
+    location_name = df_location.set_index('id')['name']
+    final_df['holding_location_name'] = final_df['permanentLocationId_x'].map(location_name)
+    final_df['item_location_name'] = final_df['effectiveLocationId_y'].map(location_name)
+    
+    material_types = df_mtypes.set_index('id')['name']
+    final_df['Material_name'] = final_df['materialTypeId'].map(material_types)
+    
+    statistical_types = df_statcode.set_index('id')['name']
+    final_df['Statistical_code'] = final_df['statisticalCodeIds'].map(statistical_types)
+    
+    # Process user IDs to get usernames
+    final_df = process_user_ids(final_df, url, header_dict)
+    
+    # Apply column renames where the columns exist
+    renames = {old_name: new_name for old_name, new_name in BIBLIOGRAPHIC_COLUMN_RENAMES.items() if old_name in final_df.columns}
+    final_df = final_df.rename(columns=renames)
+    return apply_report_dtypes(final_df)
+
+# Low-cardinality report columns stored as pandas categoricals, and flags stored as booleans
+REPORT_CATEGORY_COLUMNS = [
+    'permanentLocationId_x', 'effectiveLocationId_x', 'permanentLocationId_y', 'effectiveLocationId_y',
+    'holding_location_name', 'item_location_name', 'materialTypeId', 'Material_name', 'permanentLoanTypeId',
+    'Item Status', 'statisticalCodeIds', 'Statistical_code',
+    'metadata.createdByUserId_x', 'metadata.updatedByUserId_x', 'metadata.createdByUserId_y',
+    'metadata.updatedByUserId_y', 'metadata.createdByUserId', 'metadata.updatedByUserId',
+    'Instance Creator', 'Instance Updater', 'Holding Creator', 'Holding Updater', 'Item Creator', 'Item Updater'
+]
+REPORT_BOOL_COLUMNS = ['discoverySuppress_x', 'discoverySuppress_y', 'discoverySuppress', 'staffSuppress']
+
+# Function to give the report columns their compact storage types
+def apply_report_dtypes(final_df):
+    """
+    Store the low-cardinality columns as categoricals and the suppress flags as
+    booleans (a missing flag counts as not suppressed). Also used after rows are
+    appended, since concatenating categoricals with different categories falls
+    back to plain objects.
+    """
+    final_df = categorize(final_df, REPORT_CATEGORY_COLUMNS)
+    for col in REPORT_BOOL_COLUMNS:
+        if col in final_df.columns and final_df[col].dtype != bool:
+            final_df[col] = final_df[col].fillna(False).astype(bool)
+    return final_df
+
+# Margin subtracted from the last harvest time when asking for changed records, to absorb clock skew
+DELTA_SYNC_OVERLAP = datetime.timedelta(minutes=5)
+
+# Function to bring a stored table up to date with the records changed since its harvest
+def refresh_table(name, loader, url, header_dict):
+    """
+    Fetch the records changed since the table was last harvested, using
+    metadata.updatedDate, and upsert them into the stored table by id.
+    Returns the updated table, the changed records and the harvest time to store
+    it with (see store_refreshed_tables). Without a stored table, the whole
+    collection is harvested and every record counts as changed.
+    Records deleted in Medad are only dropped by a full reload.
+    """
+    tenant = header_dict["x-okapi-tenant"]
+    entry = read_snapshot_manifest(url, tenant)['tables'].get(name)
+    df = load_snapshot(url, tenant, name, None) if entry else None
+
+    harvested_at = datetime.datetime.now(datetime.timezone.utc)
+    if df is None:
+        df = loader(url, header_dict)
+        changed = df
+    else:
+        since = datetime.datetime.fromisoformat(entry['harvested_at']) - DELTA_SYNC_OVERLAP
+        since = since.astimezone(datetime.timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.000+00:00')
+        changed = loader(url, header_dict, query=f'metadata.updatedDate>"{since}"')
+        if not changed.empty:
+            category_columns = df.columns[df.dtypes == 'category']
+            df = pd.concat([df[~df['id'].isin(changed['id'])], changed], ignore_index=True)
+            df = categorize(df, category_columns)
+    return df, changed, harvested_at
+
+# Function to store the tables of a refresh once the report has taken their changes in
+def store_refreshed_tables(url, header_dict, tables):
+    # Until then a cancelled or failed refresh leaves the snapshots as they were, so the next one fetches the same changes
+    tenant = header_dict["x-okapi-tenant"]
+    for name, (df, _, harvested_at) in tables.items():
+        if not df.empty:
+            save_snapshot(url, tenant, name, df, harvested_at)
+
+# Function to refresh the bibliographic report with the records changed since the last harvest
+def refresh_bibliographic_report(final_df, url, header_dict, scope=None):
+    """
+    Upsert changed instances, holdings and items into the stored tables and rebuild
+    only the report rows of the instances they touch. Returns the updated report
+    and the number of instances that were rebuilt. A report scoped to some items
+    is small enough to be harvested again as a whole instead.
+    """
+    if item_scope_query(scope) is not None:
+        reloaded = load_inventory(url, header_dict, scope, refresh=True)
+        if 'loan_count' in final_df.columns:
+            reloaded = attach_loan_counts(reloaded, load_counted_loans(url, header_dict, scope))
+        return reloaded, reloaded['id_x'].nunique()
+
+    tables = {"instances": refresh_table("instances", get_instances, url, header_dict),
+              "holdings": refresh_table("holdings", get_holdings, url, header_dict),
+              "items": refresh_table("items", get_items, url, header_dict)}
+    df_instances, changed_instances, _ = tables["instances"]
+    df_holdings, changed_holdings, _ = tables["holdings"]
+    df_items, changed_items, _ = tables["items"]
+    if changed_instances.empty and changed_holdings.empty and changed_items.empty:
+        store_refreshed_tables(url, header_dict, tables)
+        return final_df, 0
+
+    # Instances touched by a change, including the ones a holding or item was moved away from
+    affected = set(changed_instances.get('id', []))
+    affected.update(changed_holdings.get('instanceId', []))
+    changed_item_holdings = set(changed_items.get('holdingsRecordId', []))
+    affected.update(df_holdings.loc[df_holdings['id'].isin(changed_item_holdings), 'instanceId'])
+    moved = final_df['id_y'].isin(changed_holdings.get('id', [])) | final_df['id'].isin(changed_items.get('id', []))
+    affected.update(final_df.loc[moved, 'id_x'])
+
+    sub_instances = df_instances[df_instances['id'].isin(affected)]
+    sub_holdings = df_holdings[df_holdings['instanceId'].isin(affected)]
+    sub_items = df_items[df_items['holdingsRecordId'].isin(sub_holdings['id'])]
+
+    df_location = load_table("locations", get_locations, url, header_dict)
+    df_mtypes = load_table("mtypes", get_mtypes, url, header_dict)
+    df_statcode = load_table("statcodes", get_statistical_codes, url, header_dict)
+    rebuilt = build_bibliographic_report(sub_instances, sub_holdings, sub_items, df_location, df_mtypes, df_statcode, url, header_dict)
+
+    if 'loan_count' in final_df.columns:
+        rebuilt = attach_loan_counts(rebuilt, load_counted_loans(url, header_dict, scope))
+
+    final_df = pd.concat([final_df[~final_df['id_x'].isin(affected)], rebuilt], ignore_index=True)
+    store_refreshed_tables(url, header_dict, tables)
+    return apply_report_dtypes(final_df), len(affected)
+
+# Function to load the inventory shared by the bibliographic and loan count reports
+def load_inventory(url, header_dict, scope=None, refresh=False):
+    """
+    Load instances, holdings, items and the reference tables (from the snapshot
+    store when fresh) and build the bibliographic report that both the
+    Bibliographic and the Loan Count tabs work from. With a scope on locations or
+    material types, only the items in scope are harvested, followed by the holdings
+    and instances they belong to, by ID. With refresh, snapshots are not used.
+    """
+    query = item_scope_query(scope)
+    if query is None:
+        # Get instances, holdings, and items data
+        df_instances = load_table("instances", get_instances, url, header_dict, refresh)
+        notify("✅ Instances data loaded", "success")
+        
+        df_holdings = load_table("holdings", get_holdings, url, header_dict, refresh)
+        notify("✅ Holdings data loaded", "success")
+        
+        df_items = load_table("items", get_items, url, header_dict, refresh)
+        notify("✅ Items data loaded", "success")
+    else:
+        df_items = load_table(scoped_name("items", query), lambda url, header_dict: get_items(url, header_dict, query),
+                              url, header_dict, refresh)
+        notify("✅ Items data loaded", "success")
+        
+        df_holdings = load_linked_table(scoped_name("holdings", query), get_holdings, url, header_dict,
+                                        df_items.get('holdingsRecordId'), refresh)
+        notify("✅ Holdings data loaded", "success")
+        
+        df_instances = load_linked_table(scoped_name("instances", query), get_instances, url, header_dict,
+                                         df_holdings.get('instanceId'), refresh)
+        notify("✅ Instances data loaded", "success")
+    
+    # Get reference data
+    df_location = load_table("locations", get_locations, url, header_dict)
+    df_mtypes = load_table("mtypes", get_mtypes, url, header_dict)
+    df_statcode = load_table("statcodes", get_statistical_codes, url, header_dict)
+    
+    # Merge the data
+    with status_spinner("Merging data..."):
+        return build_bibliographic_report(df_instances, df_holdings, df_items, df_location, df_mtypes, df_statcode, url, header_dict)
+
+# Function to load the loans counted by the loan count report, those of the scope's loan period if any
+def load_counted_loans(url, header_dict, scope=None):
+    # The items are scoped by the inventory they are counted on, so only the loan period is pushed down
+    query = loan_scope_query(scope, by_location=False)
+    return load_table(scoped_name("loans", query),
+                      lambda url, header_dict: get_loan_count_data(url, header_dict, cql_param(query)),
+                      url, header_dict)
+
+# Function to add the number of loans of each item to the inventory
+def attach_loan_counts(final_df, df_loans):
+    """
+    Return the inventory with a loan_count column. The inventory itself is left as it
+    is, as a session may be reading it while a background load counts its loans; the
+    returned frame shares its other columns.
+    """
+    if df_loans.empty:
+        # If no loan data, just add a loan_count column with zeros
+        loan_count = np.zeros(len(final_df), dtype=int)
+    else:
+        # Count loans per item key, then look them up by the item key of each row
+        item_key = key_columns('item_key')
+        loan_counts = with_key(df_loans, 'item_key').groupby(item_key).size()
+        item_keys = pd.MultiIndex.from_arrays([final_df[col] for col in item_key])
+        loan_count = loan_counts.reindex(item_keys).fillna(0).astype(int).to_numpy()
+    counted = final_df.copy(deep=False)
+    counted['loan_count'] = loan_count
+    return counted
+
+# Function to load the loan count report: the shared inventory with the number of loans of each item
+def load_loan_counts(url, header_dict, final_df, scope=None):
+    df_loan_count = load_counted_loans(url, header_dict, scope)
+    notify("✅ Loan count data loaded", "success")
+    
+    with status_spinner("Counting loans..."):
+        return attach_loan_counts(final_df, df_loan_count)
+
+# Columns the loan count report shows and exports unless others are chosen
+LOAN_COUNT_DEFAULT_COLUMNS = ['Title', 'Call Number', 'Barcode', 'Material_name', 'Item Status',
+                              'Author', 'loan_count', 'lastCheckIn.dateTime', 'metadata.createdDate']
+
+# Timestamps the loan count report shows as plain dates
+LOAN_COUNT_DATE_COLUMNS = ['lastCheckIn.dateTime', 'metadata.createdDate']
+
+# Function to format the loan count columns for preview and export
+def format_loan_count_view(df):
+    df = df.copy()
+    for col in LOAN_COUNT_DATE_COLUMNS:
+        if col in df.columns:
+            df[col] = pd.to_datetime(df[col], errors='coerce').dt.strftime('%Y-%m-%d')
+    return df
+
+# Columns of the shared inventory report that the filter controls work on
+REPORT_FILTER_COLUMNS = ['holding_location_name', 'item_location_name', 'Material_name', 'Item Status',
+                         'Statistical_code', 'discoverySuppress_x', 'discoverySuppress_y', 'discoverySuppress',
+                         'Instance Creator', 'Instance Updater', 'Holding Creator', 'Holding Updater',
+                         'Item Creator', 'Item Updater', 'loan_count']
+
+# Function to turn a timestamp column into sortable UTC keys, missing dates becoming NaT
+def range_keys(column):
+    return pd.to_datetime(column, errors='coerce', utc=True).dt.tz_localize(None).to_numpy(dtype='datetime64[ns]')
+
+# Function to turn a timestamp into a key comparable with range_keys
+def range_key(value):
+    value = pd.Timestamp(value)
+    if value.tzinfo is not None:
+        value = value.tz_convert('UTC').tz_localize(None)
+    return value.to_datetime64()
+
+# Function to read the tags of a row, which may be a list or the string form of one
+def parse_tag_list(value):
+    if isinstance(value, list):
+        return value
+    if isinstance(value, str) and value.strip():
+        try:
+            parsed = ast.literal_eval(value)
+        except (ValueError, SyntaxError):
+            return [value]
+        return parsed if isinstance(parsed, list) else [value]
+    return []
+
+# Function to label a filter option with its number of records, e.g. "Main Library (12,403)"
+def facet_label(counts):
+    return lambda value: f"{value} ({counts[value]:,})" if value in counts else str(value)
+
+# Value index over the filter columns of a report
+class FilterIndex:
+    """
+    Built once per dataset. Each column is factorized into sorted value codes
+    (0 standing for a missing value), and a stable argsort of the codes keeps the
+    row positions of every value in one contiguous, ascending slice, so the rows
+    holding a value are found without scanning the column. The slice lengths are
+    the value counts of the whole dataset.
+
+    Range columns (timestamps) are kept as sorted keys with their row positions
+    instead, so a date range is two binary searches. Tag columns, holding a list
+    of tags per row, are exploded into (tag, row) pairs sorted by tag: an inverted
+    index giving the rows of every tag as one ascending slice.
+    """
+    def __init__(self, df, columns, range_columns=(), tag_columns=()):
+        # Identifies this dataset in cached filter results
+        self.version = os.urandom(8).hex()
+        self.size = len(df)
+        self.values = {}
+        self.codes = {}
+        self.order = {}
+        self.bounds = {}
+        self.keys = {}
+        self.sorted_keys = {}
+        for col in range_columns:
+            if col in df.columns:
+                keys = range_keys(df[col])
+                order = np.argsort(keys, kind='stable')
+                self.keys[col] = keys
+                self.order[col] = order
+                self.sorted_keys[col] = keys[order]
+        self.tag_values = {}
+        self.tag_codes = {}
+        self.tag_rows = {}
+        self.tag_bounds = {}
+        for col in tag_columns:
+            if col in df.columns:
+                # A tag repeated on a row is indexed once
+                tag_lists = df[col].map(lambda value: list(dict.fromkeys(parse_tag_list(value))))
+                rows = np.repeat(np.arange(self.size), tag_lists.map(len).to_numpy(dtype=np.int64))
+                codes, values = pd.factorize(pd.Series([tag for tags in tag_lists for tag in tags], dtype=object), sort=True)
+                order = np.argsort(codes, kind='stable')
+                self.tag_values[col] = pd.Index(np.asarray(values, dtype=object))
+                self.tag_codes[col] = codes[order]
+                self.tag_rows[col] = rows[order]
+                self.tag_bounds[col] = np.searchsorted(codes[order], np.arange(len(values) + 1))
+        for col in columns:
+            if col in df.columns:
+                column = df[col]
+                if column.dtype == 'category':
+                    # Categories keep the order they were first seen in, not the sort order
+                    column = column.cat.reorder_categories(column.cat.categories.sort_values())
+                codes, values = pd.factorize(column, sort=True)
+                codes = (codes + 1).astype(np.int32)
+                order = np.argsort(codes, kind='stable')
+                self.values[col] = pd.Index(np.asarray(values, dtype=object))
+                self.codes[col] = codes
+                self.order[col] = order
+                self.bounds[col] = np.searchsorted(codes[order], np.arange(len(values) + 2))
+
+    def __contains__(self, col):
+        return col in self.codes or col in self.keys or col in self.tag_rows
+
+    def tag_positions(self, col, tag):
+        code = self.tag_values[col].get_indexer([tag])[0]
+        if code < 0:
+            return np.empty(0, dtype=np.intp)
+        bounds = self.tag_bounds[col]
+        return self.tag_rows[col][bounds[code]:bounds[code + 1]]
+
+    def value_codes(self, col, values):
+        codes = self.values[col].get_indexer(list(values))
+        return codes[codes >= 0] + 1
+
+    def missing_codes(self, col):
+        # Missing values, plus the empty strings left behind by the original harvest
+        return np.concatenate([[0], self.value_codes(col, ['', 'nan'])]).astype(np.int32)
+
+    def code_range(self, col, low, high):
+        values = self.values[col]
+        return np.arange(values.searchsorted(low, side='left'), values.searchsorted(high, side='right')) + 1
+
+    def positions(self, col, codes):
+        order, bounds = self.order[col], self.bounds[col]
+        rows = [order[bounds[code]:bounds[code + 1]] for code in codes]
+        if not rows:
+            return np.empty(0, dtype=np.intp)
+        return rows[0] if len(rows) == 1 else np.sort(np.concatenate(rows))
+
+# Total size, and number, of the results kept by the filter result cache of a session.
+# Every session has its own cache, so the server holds up to this much per open session.
+FILTER_CACHE_BYTES = 64 * 1024 * 1024
+FILTER_CACHE_ENTRIES = 1024
+
+# Function to estimate the memory held by a cached filter result: a row selection or option counts
+def filter_result_bytes(value):
+    if hasattr(value, 'nbytes'):
+        return value.nbytes
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(sys.getsizeof(key) + sys.getsizeof(count) for key, count in value.items())
+    return sys.getsizeof(value)
+
+# LRU memo of filter results
+class FilterCache:
+    """
+    Keeps the row selections and option counts computed by FilterChain, keyed by
+    dataset version and the normalized sequence of filters that produced them.
+    The least recently used entries are evicted once the cached results exceed
+    max_bytes (see filter_result_bytes) or max_entries.
+    """
+    def __init__(self, max_bytes=FILTER_CACHE_BYTES, max_entries=FILTER_CACHE_ENTRIES):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.size = 0
+
+    def get(self, key):
+        if key not in self.entries:
+            return None
+        self.entries.move_to_end(key)
+        return self.entries[key][0]
+
+    def put(self, key, value):
+        if key in self.entries:
+            self.size -= self.entries.pop(key)[1]
+        nbytes = filter_result_bytes(value)
+        self.entries[key] = (value, nbytes)
+        self.size += nbytes
+        while (self.size > self.max_bytes or len(self.entries) > self.max_entries) and len(self.entries) > 1:
+            _, (_, evicted_bytes) = self.entries.popitem(last=False)
+            self.size -= evicted_bytes
+
+# Sequential filter over a FilterIndex
+class FilterChain:
+    """
+    Narrows the set of matching row positions one filter at a time, in the order the
+    controls are drawn. Only active filters do any work: the first one reads its rows
+    straight from the index, later ones look up the codes of the rows still selected.
+    Rows are materialized only for the preview and export.
+
+    With a FilterCache, every selection and option list is memoized under the index
+    version plus the filters applied so far, so a rerun with unchanged (or earlier)
+    filter settings reads its results back instead of recomputing them.
+    """
+    def __init__(self, index, cache=None):
+        self.index = index
+        self.cache = cache
+        self.rows = None
+        self.steps = ()
+
+    def count(self):
+        return self.index.size if self.rows is None else len(self.rows)
+
+    def current_codes(self, col):
+        codes = self.index.codes[col]
+        return codes if self.rows is None else codes[self.rows]
+
+    def memo(self, step, compute):
+        # Steps that cannot be described by a key end caching for the rest of the chain
+        if self.cache is None or self.steps is None or step is None:
+            return compute()
+        key = (self.index.version, self.steps, step)
+        value = self.cache.get(key)
+        if value is None:
+            value = compute()
+            self.cache.put(key, value)
+        return value
+
+    def narrow(self, step, select):
+        self.rows = self.memo(step, select)
+        self.steps = None if self.steps is None or step is None else self.steps + (step,)
+        return self
+
+    def facet(self, col):
+        """
+        Values of a column present in the selected rows, in sorted order, mapped to
+        their row counts. The counts of the whole dataset come straight from the
+        index; after filtering they are a bincount of the selected rows' codes.
+        """
+        def compute():
+            values = self.index.values[col]
+            if self.rows is None:
+                counts = np.diff(self.index.bounds[col])[1:]
+            else:
+                counts = np.bincount(self.current_codes(col), minlength=len(values) + 1)[1:]
+            present = counts > 0
+            return dict(zip(values[present].tolist(), counts[present].tolist()))
+        return self.memo(('facet', col), compute)
+
+    def options(self, col):
+        """Sorted values of a column present in the selected rows."""
+        return list(self.facet(col))
+
+    def extent(self, col):
+        """Smallest and largest key of a range column among the selected rows, or None."""
+        def compute():
+            if self.rows is None:
+                keys = self.index.sorted_keys[col]
+                keys = keys[~np.isnat(keys)]
+                return (keys[0], keys[-1]) if len(keys) else ()
+            keys = self.index.keys[col][self.rows]
+            keys = keys[~np.isnat(keys)]
+            return (keys.min(), keys.max()) if len(keys) else ()
+        return self.memo(('extent', col), compute) or None
+
+    def within(self, col, low, high):
+        """Keep the selected rows whose range column lies between low and high inclusive."""
+        low, high = range_key(low), range_key(high)
+        def select():
+            if self.rows is None:
+                sorted_keys = self.index.sorted_keys[col]
+                start = np.searchsorted(sorted_keys, low, side='left')
+                stop = np.searchsorted(sorted_keys, high, side='right')
+                return np.sort(self.index.order[col][start:stop])
+            keys = self.index.keys[col][self.rows]
+            return self.rows[(keys >= low) & (keys <= high)]
+        return self.narrow(('within', col, low, high), select)
+
+    def keep_codes(self, col, codes):
+        if self.rows is None:
+            return self.index.positions(col, codes)
+        wanted = np.zeros(len(self.index.values[col]) + 1, dtype=bool)
+        wanted[codes] = True
+        return self.rows[wanted[self.current_codes(col)]]
+
+    def isin(self, col, values):
+        values = sorted(set(values), key=repr)
+        return self.narrow(('isin', col, tuple(values)),
+                           lambda: self.keep_codes(col, self.index.value_codes(col, values)))
+
+    def equals(self, col, value):
+        return self.isin(col, [value])
+
+    def missing(self, col):
+        return self.narrow(('missing', col), lambda: self.keep_codes(col, self.index.missing_codes(col)))
+
+    def between(self, col, low, high):
+        return self.narrow(('between', col, low, high),
+                           lambda: self.keep_codes(col, self.index.code_range(col, low, high)))
+
+    def tag_facet(self, col):
+        """Tags present in the selected rows, in sorted order, mapped to their row counts."""
+        def compute():
+            values = self.index.tag_values[col]
+            if self.rows is None:
+                counts = np.diff(self.index.tag_bounds[col])
+            else:
+                selected = np.zeros(self.index.size, dtype=bool)
+                selected[self.rows] = True
+                codes = self.index.tag_codes[col][selected[self.index.tag_rows[col]]]
+                counts = np.bincount(codes, minlength=len(values))
+            present = counts > 0
+            return dict(zip(values[present].tolist(), counts[present].tolist()))
+        return self.memo(('tag_facet', col), compute)
+
+    def tagged(self, col, tags, match_all=False):
+        """Keep the selected rows carrying any (or, with match_all, every one) of the tags."""
+        tags = sorted(set(tags))
+        def select():
+            tag_rows = [self.index.tag_positions(col, tag) for tag in tags]
+            if match_all:
+                rows = tag_rows[0]
+                for more in tag_rows[1:]:
+                    rows = np.intersect1d(rows, more, assume_unique=True)
+            else:
+                rows = np.unique(np.concatenate(tag_rows))
+            return rows if self.rows is None else np.intersect1d(self.rows, rows, assume_unique=True)
+        return self.narrow(('tagged', col, tuple(tags), match_all), select)
+
+    def search(self, search_index, query, prefix=False):
+        """Keep the selected rows matching every word of a text search; a search without words keeps them all."""
+        terms = normalize_search_text(query)
+        if not terms:
+            return self
+        def select():
+            rows = search_index.search(query, prefix)
+            return rows if self.rows is None else np.intersect1d(self.rows, rows, assume_unique=True)
+        return self.narrow(('search', terms, prefix), select)
+
+    def restrict(self, rows, step=None):
+        """Keep the selected rows that are also in an ascending array of row positions."""
+        return self.narrow(step, lambda: rows if self.rows is None else np.intersect1d(self.rows, rows, assume_unique=True))
+
+    def mask(self, keep, step=None):
+        """
+        Keep the selected rows for which a boolean array over them is True. keep may
+        be a function returning the array, so a cached step skips computing it; a
+        mask without a step key is not cached and ends caching for the chain.
+        """
+        def select():
+            mask = np.asarray(keep() if callable(keep) else keep, dtype=bool)
+            return np.flatnonzero(mask) if self.rows is None else self.rows[mask]
+        return self.narrow(step, select)
+
+    def take(self, df, columns=None, limit=None):
+        rows = np.arange(self.index.size) if self.rows is None else self.rows
+        if limit is not None:
+            rows = rows[:limit]
+        columns = df.columns if columns is None else columns
+        return df.iloc[rows, df.columns.get_indexer(columns)]
+
+    def chunks(self, df, columns=None, size=None):
+        """Selected rows in chunks of at most size rows, always yielding at least one (possibly empty) frame."""
+        rows = np.arange(self.index.size) if self.rows is None else self.rows
+        size = size or EXPORT_CHUNK_ROWS
+        columns = df.columns if columns is None else columns
+        positions = df.columns.get_indexer(columns)
+        for start in range(0, max(len(rows), 1), size):
+            yield df.iloc[rows[start:start + size], positions]
+
+# Error raised for an advanced filter expression that cannot be parsed or run
+class FilterExpressionError(ValueError):
+    pass
+
+# Tokens of the advanced filter language: numbers, quoted strings, `quoted column names`,
+# operators and bare words (keywords and column names without spaces)
+FILTER_TOKEN_PATTERN = re.compile(r"""\s*(?:
+    (?P<number>-?\d+(?:\.\d+)?(?![\w.]))
+  | (?P<string>'(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*")
+  | (?P<column>`[^`]+`)
+  | (?P<op>==|!=|<=|>=|=|<|>|\(|\)|,)
+  | (?P<word>[^\W\d][\w.]*)
+)""", re.VERBOSE)
+FILTER_COMPARISONS = {'=': '==', '==': '==', '!=': '!=', '<': '<', '<=': '<=', '>': '>', '>=': '>='}
+FILTER_OPERATORS = {'==': operator.eq, '!=': operator.ne, '<': operator.lt, '<=': operator.le, '>': operator.gt, '>=': operator.ge}
+FILTER_TEXT_OPERATORS = ('contains', 'startswith', 'endswith')
+
+# Function to split an advanced filter expression into tokens
+def tokenize_filter(text):
+    tokens = []
+    text = text.strip()
+    pos = 0
+    while pos < len(text):
+        match = FILTER_TOKEN_PATTERN.match(text, pos)
+        if not match:
+            raise FilterExpressionError(f"Unexpected character {text[pos:].lstrip()[:1]!r} at position {pos + 1}")
+        kind = match.lastgroup
+        value = match.group(kind)
+        position = match.start(kind) + 1
+        if kind == 'string':
+            value = re.sub(r'\\(.)', r'\1', value[1:-1])
+        elif kind == 'column':
+            value = value[1:-1]
+        elif kind == 'number':
+            value = float(value) if '.' in value else int(value)
+        elif kind == 'word' and value.lower() in ('and', 'or', 'not', 'in', 'between', 'is', 'empty', 'date', 'true', 'false') + FILTER_TEXT_OPERATORS:
+            kind, value = 'keyword', value.lower()
+        elif kind == 'word':
+            kind = 'column'
+        tokens.append((kind, value, position))
+        pos = match.end()
+    return tokens
+
+# Recursive-descent parser of the advanced filter language
+class FilterParser:
+    """
+    Grammar, keywords being case-insensitive:
+
+        expression := term ('or' term)*
+        term       := factor ('and' factor)*
+        factor     := 'not' factor | '(' expression ')' | condition
+        condition  := column ('=' | '!=' | '<' | '<=' | '>' | '>=') value
+                    | column ('contains' | 'startswith' | 'endswith') string
+                    | column 'between' value 'and' value
+                    | column ['not'] 'in' '(' value (',' value)* ')'
+                    | column 'is' ['not'] 'empty'
+        value      := string | number | 'true' | 'false' | 'date' string
+
+    A missing value differs from every value: it fails '=', the ordering comparisons,
+    'between', 'in' and the text operators, so it passes '!=', 'not in' and 'not' of
+    any of them alike. A quoted value compared with a numeric column is read as a number.
+
+    Parsing yields a tree of tuples, e.g. ('and', ('cmp', 'Item Status', '==', 'Available'), ...).
+    """
+    def __init__(self, text):
+        self.tokens = tokenize_filter(text)
+        self.pos = 0
+
+    def peek(self, kind=None, value=None):
+        if self.pos >= len(self.tokens):
+            return None
+        token = self.tokens[self.pos]
+        if (kind is None or token[0] == kind) and (value is None or token[1] == value):
+            return token
+        return None
+
+    def accept(self, kind=None, value=None):
+        token = self.peek(kind, value)
+        if token:
+            self.pos += 1
+        return token
+
+    def expect(self, kind, value=None, description=None):
+        token = self.accept(kind, value)
+        if not token:
+            found = f"{self.tokens[self.pos][1]!r} at position {self.tokens[self.pos][2]}" if self.pos < len(self.tokens) else "end of expression"
+            raise FilterExpressionError(f"Expected {description or value or kind}, found {found}")
+        return token[1]
+
+    def parse(self):
+        if not self.tokens:
+            raise FilterExpressionError("The filter expression is empty")
+        node = self.expression()
+        if self.pos < len(self.tokens):
+            token = self.tokens[self.pos]
+            raise FilterExpressionError(f"Unexpected {token[1]!r} at position {token[2]}")
+        return node
+
+    def expression(self):
+        node = self.term()
+        while self.accept('keyword', 'or'):
+            node = ('or', node, self.term())
+        return node
+
+    def term(self):
+        node = self.factor()
+        while self.accept('keyword', 'and'):
+            node = ('and', node, self.factor())
+        return node
+
+    def factor(self):
+        if self.accept('keyword', 'not'):
+            return ('not', self.factor())
+        if self.accept('op', '('):
+            node = self.expression()
+            self.expect('op', ')')
+            return node
+        return self.condition()
+
+    def condition(self):
+        column = self.expect('column', description="a column name")
+        op = self.accept('op')
+        if op and op[1] in FILTER_COMPARISONS:
+            return ('cmp', column, FILTER_COMPARISONS[op[1]], self.value())
+        if op:
+            raise FilterExpressionError(f"Unexpected {op[1]!r} at position {op[2]}")
+        keyword = self.expect('keyword', description="an operator")
+        if keyword in FILTER_TEXT_OPERATORS:
+            return ('text', column, keyword, self.expect('string', description="a quoted text"))
+        if keyword == 'between':
+            low = self.value()
+            self.expect('keyword', 'and')
+            return ('between', column, low, self.value())
+        if keyword == 'not' and self.accept('keyword', 'in'):
+            return ('not', ('in', column, self.value_list()))
+        if keyword == 'in':
+            return ('in', column, self.value_list())
+        if keyword == 'is':
+            negate = self.accept('keyword', 'not')
+            self.expect('keyword', 'empty')
+            return ('not', ('empty', column)) if negate else ('empty', column)
+        raise FilterExpressionError(f"Unexpected {keyword!r} after column {column!r}")
+
+    def value(self):
+        if self.accept('keyword', 'date'):
+            text = self.expect('string', description="a quoted date")
+            try:
+                return ('date', pd.Timestamp(text).normalize())
+            except ValueError:
+                raise FilterExpressionError(f"Invalid date {text!r}")
+        if self.accept('keyword', 'true'):
+            return True
+        if self.accept('keyword', 'false'):
+            return False
+        token = self.accept('string') or self.accept('number')
+        if not token:
+            self.expect('value', description="a value")
+        return token[1]
+
+    def value_list(self):
+        self.expect('op', '(')
+        values = [self.value()]
+        while self.accept('op', ','):
+            values.append(self.value())
+        self.expect('op', ')')
+        return tuple(values)
+
+# Function to read a quoted value of the filter language as a number when its column holds numbers
+def coerce_filter_value(series, value):
+    if isinstance(value, str) and pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series):
+        try:
+            return float(value) if re.search(r'[.eE]', value) else int(value)
+        except ValueError:
+            raise FilterExpressionError(f"Column {series.name!r} holds numbers, but {value!r} is not a number")
+    return value
+
+# Function to compare a column with a value of the filter language, as a boolean array
+def compare_filter_column(series, op, value):
+    if isinstance(value, tuple):
+        # A date stands for its whole day, so times within the day compare as that day
+        keys = range_keys(series)
+        start = range_key(value[1])
+        end = range_key(value[1] + pd.Timedelta(days=1))
+        if op == '==':
+            return (keys >= start) & (keys < end)
+        if op == '!=':
+            return (keys < start) | (keys >= end) | np.isnat(keys)
+        if op in ('<', '>='):
+            return FILTER_OPERATORS[op](keys, start)
+        return keys < end if op == '<=' else keys >= end
+    value = coerce_filter_value(series, value)
+    if isinstance(value, bool):
+        values = series
+    elif isinstance(value, (int, float)):
+        values = series if pd.api.types.is_numeric_dtype(series) else pd.to_numeric(series.astype(object), errors='coerce')
+    elif op in ('==', '!='):
+        values = series
+    else:
+        values = series.astype('string')
+    result = FILTER_OPERATORS[op](values, value)
+    if op == '!=':
+        # A missing value differs from every value, as it does for 'not in' and 'not'
+        return (result.fillna(True) | series.isna()).to_numpy(dtype=bool)
+    return result.fillna(False).to_numpy(dtype=bool)
+
+# Function to turn a parsed filter expression into a function of the columns it reads
+def compile_filter_node(node):
+    kind = node[0]
+    if kind in ('and', 'or'):
+        left, right = compile_filter_node(node[1]), compile_filter_node(node[2])
+        if kind == 'and':
+            return lambda columns: left(columns) & right(columns)
+        return lambda columns: left(columns) | right(columns)
+    if kind == 'not':
+        inner = compile_filter_node(node[1])
+        return lambda columns: ~inner(columns)
+    column = node[1]
+    if kind == 'cmp':
+        _, _, op, value = node
+        return lambda columns: compare_filter_column(columns[column], op, value)
+    if kind == 'between':
+        _, _, low, high = node
+        return lambda columns: (compare_filter_column(columns[column], '>=', low)
+                                & compare_filter_column(columns[column], '<=', high))
+    if kind == 'in':
+        values = node[2]
+        if any(isinstance(value, tuple) for value in values):
+            return lambda columns: np.logical_or.reduce([compare_filter_column(columns[column], '==', value) for value in values])
+        def match_any(columns):
+            series = columns[column]
+            return series.isin([coerce_filter_value(series, value) for value in values]).to_numpy(dtype=bool)
+        return match_any
+    if kind == 'text':
+        _, _, method, text = node
+        def match(columns):
+            series = columns[column]
+            if series.dtype != 'category':
+                series = series.astype('string')
+            if method == 'contains':
+                result = series.str.contains(text, case=False, regex=False)
+            else:
+                result = getattr(series.str.lower().str, method)(text.lower())
+            return result.fillna(False).to_numpy(dtype=bool)
+        return match
+    if kind == 'empty':
+        return lambda columns: (columns[column].isna() | (columns[column].astype('string') == '')).fillna(True).to_numpy(dtype=bool)
+    raise FilterExpressionError(f"Unsupported filter {kind!r}")
+
+# Function to list the columns a parsed filter expression reads
+def filter_node_columns(node):
+    if node[0] in ('and', 'or'):
+        return filter_node_columns(node[1]) | filter_node_columns(node[2])
+    if node[0] == 'not':
+        return filter_node_columns(node[1])
+    return {node[1]}
+
+# Compiled advanced filter expression
+class FilterPlan:
+    """
+    Parsed and compiled once per expression text. key is the normalized form of the
+    expression, so differently spaced or cased spellings share cached results, and
+    columns lists the report columns it reads.
+    """
+    def __init__(self, text):
+        tree = FilterParser(text).parse()
+        self.key = repr(tree)
+        self.columns = sorted(filter_node_columns(tree))
+        self.evaluate = compile_filter_node(tree)
+
+    def check(self, columns):
+        unknown = [col for col in self.columns if col not in columns]
+        if unknown:
+            raise FilterExpressionError(f"Unknown column {unknown[0]!r}")
+
+    def mask(self, df):
+        """Boolean array over the rows of df, which must hold the plan's columns."""
+        return self.evaluate(df)
+
+# Function to get the compiled plan of an advanced filter expression
+@st.cache_resource(show_spinner=False, max_entries=64)
+def compile_filter_expression(text):
+    return FilterPlan(text)
+
+# Report columns covered by the text search of the Bibliographic tab
+SEARCH_COLUMNS = ['Title', 'Alternative Title', 'Author', 'Publisher', 'Call Number']
+
+# Diacritics dropped for search once NFKD has split them off: Latin accents, Arabic
+# harakat and the hamza/madda marks that NFKD separates from alef, waw and yeh
+SEARCH_MARKS = [mark for first, last in ((0x0300, 0x036f), (0x0610, 0x061a), (0x064b, 0x065f), (0x0670, 0x0670))
+                for mark in range(first, last + 1)]
+# Arabic letter variants NFKD leaves alone, tatweel, and Arabic-Indic digits
+SEARCH_FOLDING = str.maketrans({'\u0671': '\u0627', '\u0649': '\u064a', '\u0629': '\u0647', '\u0640': None,
+                                **{mark: None for mark in SEARCH_MARKS},
+                                **{0x0660 + digit: str(digit) for digit in range(10)},
+                                **{0x06f0 + digit: str(digit) for digit in range(10)}})
+SEARCH_WORD = re.compile(r'[^\W_]+')
+# Upper bound of every string starting with a given prefix
+SEARCH_PREFIX_END = '\U0010ffff'
+
+# Function to split a text into normalized search words: accents and Arabic letter forms folded, case folded
+def search_words(text):
+    return SEARCH_WORD.findall(unicodedata.normalize('NFKD', text).translate(SEARCH_FOLDING).casefold())
+
+# Function to normalize a search query into its words separated by single spaces
+def normalize_search_text(text):
+    return ' '.join(search_words(text))
+
+# Full-text index over the text columns of a report
+class SearchIndex:
+    """
+    Built once per dataset. Every distinct value of the searched columns is split
+    into words, each distinct word is normalized once, and each word of the sorted
+    vocabulary keeps the ids of the values containing it (a contiguous slice of
+    postings). Word prefixes are one binary search in the vocabulary; substrings go
+    through a trigram index over the vocabulary. Matching values are mapped back to
+    rows through the per-column value codes.
+    """
+    def __init__(self, df, columns):
+        self.size = len(df)
+        self.codes = []
+        texts = []
+        for col in columns:
+            if col in df.columns:
+                codes, uniques = pd.factorize(df[col])
+                self.codes.append(np.where(codes >= 0, codes + len(texts), -1).astype(np.int32))
+                texts.extend(str(text) for text in uniques)
+        self.text_count = len(texts)
+
+        # Raw whitespace-separated tokens of every value, and the value each comes from
+        token_counts = np.fromiter((len(text.split()) for text in texts), dtype=np.int64, count=len(texts))
+        tokens = np.empty(int(token_counts.sum()), dtype=object)
+        tokens[:] = ' '.join(texts).split()
+        token_texts = np.repeat(np.arange(len(texts)), token_counts)
+        token_codes, distinct_tokens = pd.factorize(tokens)
+
+        # Normalize each distinct token once; punctuation may split it into several words
+        token_words = [search_words(token) for token in distinct_tokens]
+        word_counts = np.fromiter(map(len, token_words), dtype=np.int64, count=len(token_words))
+        words = np.empty(int(word_counts.sum()), dtype=object)
+        words[:] = [word for token in token_words for word in token]
+        word_codes, vocabulary = pd.factorize(words, sort=True)
+        occurrences = word_counts[token_codes]
+        first_word = (np.cumsum(word_counts) - word_counts)[token_codes]
+        positions = np.repeat(first_word - np.cumsum(occurrences) + occurrences, occurrences) + np.arange(occurrences.sum())
+        word_codes = word_codes[positions]
+        word_texts = np.repeat(token_texts, occurrences)
+
+        # Word -> ids of the values containing it
+        order = np.argsort(word_codes, kind='stable')
+        self.vocabulary = pd.Index(np.asarray(vocabulary, dtype=object))
+        self.postings = word_texts[order].astype(np.int32)
+        self.bounds = np.searchsorted(word_codes[order], np.arange(len(vocabulary) + 1))
+
+        # Trigram -> words containing it
+        vocabulary = pd.Series(self.vocabulary)
+        lengths = vocabulary.str.len().to_numpy()
+        grams, gram_words = [], []
+        for start in range(max(lengths.max(initial=0) - 2, 0)):
+            has_gram = lengths >= start + 3
+            grams.append(vocabulary[has_gram].str[start:start + 3])
+            gram_words.append(np.flatnonzero(has_gram))
+        grams = pd.concat(grams, ignore_index=True) if grams else pd.Series([], dtype=object)
+        gram_codes, gram_values = pd.factorize(grams, sort=True)
+        order = np.argsort(gram_codes, kind='stable')
+        self.grams = pd.Index(np.asarray(gram_values, dtype=object))
+        self.gram_words = np.concatenate(gram_words)[order].astype(np.int32) if gram_words else np.empty(0, dtype=np.int32)
+        self.gram_bounds = np.searchsorted(gram_codes[order], np.arange(len(gram_values) + 1))
+
+    def matching_words(self, term, prefix=False):
+        """Vocabulary codes of the words starting with (or, without prefix, containing) a normalized term."""
+        if prefix:
+            start = self.vocabulary.searchsorted(term, side='left')
+            stop = self.vocabulary.searchsorted(term + SEARCH_PREFIX_END, side='left')
+            return np.arange(start, stop)
+        if len(term) < 3:
+            return np.flatnonzero(self.vocabulary.str.contains(term, regex=False))
+        candidates = None
+        for gram in {term[start:start + 3] for start in range(len(term) - 2)}:
+            code = self.grams.get_indexer([gram])[0]
+            if code < 0:
+                return np.empty(0, dtype=np.intp)
+            words = np.unique(self.gram_words[self.gram_bounds[code]:self.gram_bounds[code + 1]])
+            candidates = words if candidates is None else np.intersect1d(candidates, words, assume_unique=True)
+        # Trigrams can match out of order, so confirm the whole term
+        return candidates[self.vocabulary[candidates].str.contains(term, regex=False)]
+
+    def matching_texts(self, word_codes):
+        """Boolean array over the value ids holding any of the words, padded with a False for missing values."""
+        starts, stops = self.bounds[word_codes], self.bounds[word_codes + 1]
+        lengths = stops - starts
+        positions = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+        matched = np.zeros(self.text_count + 1, dtype=bool)
+        matched[self.postings[positions]] = True
+        return matched
+
+    def search(self, query, prefix=False):
+        """
+        Sorted positions of the rows matching every word of the query in any searched
+        column, or None for a query without words (only punctuation), which is no search.
+        """
+        terms = normalize_search_text(query).split()
+        if not terms:
+            return None
+        rows = np.ones(self.size, dtype=bool)
+        for term in terms:
+            matched = self.matching_texts(self.matching_words(term, prefix))
+            term_rows = np.zeros(self.size, dtype=bool)
+            for codes in self.codes:
+                term_rows |= matched[codes]
+            rows &= term_rows
+        return np.flatnonzero(rows)
+
+# Report columns a pasted or uploaded list of identifiers can be matched against
+LOOKUP_COLUMNS = ['Barcode', 'ISBN', 'Call Number']
+# Label written before an ISBN, as in "ISBN 978..." or "ISBN-13: 978..."
+LOOKUP_ISBN_PREFIX = re.compile(r'^ISBN(?:[- ]?1[03])?[:\s]*', re.IGNORECASE)
+# Encodings an uploaded list is read with, in order; Latin-1 reads any file
+LOOKUP_FILE_ENCODINGS = ['utf-8-sig', 'cp1256', 'latin-1']
+
+# Function to normalize identifiers the same way on the report and on a pasted list
+def normalize_lookup_keys(col, values):
+    codes, uniques = pd.factorize(values)
+    keys = pd.Series(np.asarray(uniques, dtype=object)).astype(str).str.strip()
+    if col == 'ISBN':
+        # Keep the digits and check character of the number, dropping a prefix like "ISBN-13:",
+        # hyphens and qualifiers like "(pbk.)"
+        keys = keys.str.replace(LOOKUP_ISBN_PREFIX, '', regex=True)
+        keys = keys.str.split().str[0].fillna('').str.replace(r'[^0-9Xx]', '', regex=True).str.upper()
+    elif col == 'Call Number':
+        keys = keys.str.replace(r'\s+', ' ', regex=True).str.casefold()
+    # Code -1 (a missing value) picks the None appended at the end
+    keys = np.append(keys.where(keys != '').to_numpy(dtype=object), None)
+    return pd.Series(keys[codes], index=getattr(values, 'index', None), dtype=object)
+
+# Function to split pasted or uploaded identifiers into a list
+def parse_lookup_list(text, col):
+    # Call numbers contain spaces, so they come one per line
+    separator = r'[\r\n]+' if col == 'Call Number' else r'[\s,;]+'
+    return [value.strip() for value in re.split(separator, text) if value.strip()]
+
+# Function to read the identifiers of an uploaded text or CSV file into a list
+def read_lookup_file(data, file_name, col):
+    """
+    Decode the file by its byte order mark, as Excel writes UTF-16 "Unicode Text",
+    or else with the first of LOOKUP_FILE_ENCODINGS that fits it. A text file is
+    split like a pasted list; of a CSV file only the first column is read, skipping
+    a header row naming the identifier.
+    """
+    if data.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        text = data.decode('utf-16', errors='replace')
+    elif data.startswith(codecs.BOM_UTF8):
+        text = data.decode('utf-8-sig', errors='replace')
+    else:
+        for encoding in LOOKUP_FILE_ENCODINGS:
+            try:
+                text = data.decode(encoding)
+                break
+            except UnicodeDecodeError:
+                continue
+    if not file_name.lower().endswith('.csv'):
+        return parse_lookup_list(text, col)
+    try:
+        dialect = csv.Sniffer().sniff(text[:4096], delimiters=',;\t')
+    except csv.Error:
+        dialect = csv.excel
+    values = [row[0].strip() for row in csv.reader(io.StringIO(text), dialect) if row and row[0].strip()]
+    header = col.replace(' ', '').casefold()
+    if values and header in re.sub(r'\W', '', values[0]).casefold():
+        values = values[1:]
+    return values
+
+# Hash index over the identifier columns of a report
+class LookupIndex:
+    """
+    Built once per dataset over the normalized identifiers. A list of identifiers is
+    matched with one hash lookup per distinct identifier, so the cost follows the
+    length of the list and the rows it matches rather than the size of the catalogue.
+    """
+    def __init__(self, df, columns):
+        keys = pd.DataFrame({col: normalize_lookup_keys(col, df[col]) for col in columns if col in df.columns})
+        self.index = FilterIndex(keys, keys.columns)
+
+    def __contains__(self, col):
+        return col in self.index
+
+    def lookup(self, col, values):
+        """
+        Sorted positions of the rows matching a list of identifiers, and the identifiers
+        not found as they were given, including those that are not identifiers at all.
+        """
+        values = pd.Series(values, dtype=object)
+        keys = normalize_lookup_keys(col, values)
+        wanted = pd.unique(keys.dropna())
+        codes = self.index.values[col].get_indexer(wanted)
+        rows = self.index.positions(col, codes[codes >= 0] + 1)
+        return rows, pd.unique(values[~keys.isin(wanted[codes >= 0])]).tolist()
+
+# Columns holding a list of tags per row, in every report
+TAG_COLUMNS = ['tags.tagList']
+
+# Function to build the session values of the shared inventory report: the report and its filter,
+# search and lookup indexes
+def report_state(final_df, reindex_text=True):
+    state = {'final_df': final_df,
+             'report_index': FilterIndex(final_df, REPORT_FILTER_COLUMNS, tag_columns=TAG_COLUMNS)}
+    if reindex_text:
+        state['search_index'] = SearchIndex(final_df, SEARCH_COLUMNS)
+        state['lookup_index'] = LookupIndex(final_df, LOOKUP_COLUMNS)
+    return state
+
+# Columns of the circulation report and of the fines that the filter controls work on
+CIRCULATION_FILTER_COLUMNS = ['action', 'status.name', 'materialType.name', 'patronGroupName', 'location.name']
+CIRCULATION_DATE_COLUMNS = ['loanDate', 'returnDate']
+FINES_FILTER_COLUMNS = ['feeFineOwner', 'paymentStatus.name']
+
+# Columns the circulation report shows and exports unless others are chosen
+CIRCULATION_DEFAULT_COLUMNS = ['loanDate', 'returnDate', 'action', 'status.name',
+                               'patronGroupName', 'materialType.name', 'location.name',
+                               'tags.tagList']
+
+# Function to load the circulation report, loans joined with their users, and the fines
+def load_circulation(url, header_dict, scope=None):
+    """
+    Load loans, users, fines and patron groups (from the snapshot store when fresh)
+    and join loans to users. Returns the circulation report, the fines and the
+    patron group names by ID. A scope limits the loans to its loan period and to
+    items checked out at its locations, and the users to its patron groups.
+    """
+    # Get loans data
+    loan_query = loan_scope_query(scope)
+    df_loans = load_table(scoped_name("loans", loan_query),
+                          lambda url, header_dict: get_loans(url, header_dict, cql_param(loan_query)),
+                          url, header_dict)
+    notify("✅ Loans data loaded", "success")
+    
+    # Get users data
+    user_query = user_scope_query(scope)
+    df_users = load_table(scoped_name("users", user_query),
+                          lambda url, header_dict: get_users(url, header_dict, cql_param(user_query)),
+                          url, header_dict)
+    notify("✅ Users data loaded", "success")
+    
+    # Get fines data
+    df_fines = load_table("accounts", get_fines, url, header_dict)
+    notify("✅ Fines data loaded", "success")
+    
+    # Get patron groups
+    df_groups = load_table("groups", get_patron_groups_df, url, header_dict)
+    patron_groups = dict(zip(df_groups['id'], df_groups['group']))
+    notify("✅ Patron groups loaded", "success")
+    
+    # Merge loans with users
+    if not df_loans.empty and not df_users.empty:
+        merged_df = with_key(df_loans, 'user_key').merge(with_key(df_users, 'user_key'), how='inner',
+                                                          on=key_columns('user_key'), suffixes=('_Loans', '_Users'))
+        notify("✅ Merged loans and users data", "success")
+        
+        # Add patron group names
+        if patron_groups and 'patronGroup' in merged_df.columns:
+            # Create a new column with patron group names
+            merged_df['patronGroupName'] = merged_df['patronGroup'].map(patron_groups)
+            # For any missing mappings, keep the original ID
+            merged_df['patronGroupName'] = merged_df['patronGroupName'].fillna(merged_df['patronGroup'])
+    else:
+        notify("Could not merge loans and users data due to empty dataframes", "warning")
+        merged_df = pd.DataFrame()
+    
+    # Parse the loan timestamps once instead of on every rerun
+    for col in CIRCULATION_DATE_COLUMNS:
+        if col in merged_df.columns:
+            merged_df[col] = pd.to_datetime(merged_df[col], errors='coerce', utc=True)
+    return merged_df, df_fines, patron_groups
+
+# Function to build the session values of the circulation report: the report, the fines and their filter indexes
+def circulation_state(circulation_df, fines_df):
+    return {'circulation_df': circulation_df,
+            'circulation_index': FilterIndex(circulation_df, CIRCULATION_FILTER_COLUMNS, CIRCULATION_DATE_COLUMNS, TAG_COLUMNS),
+            'fines_df': fines_df,
+            'fines_index': FilterIndex(fines_df, FINES_FILTER_COLUMNS)}
+
+# Exports are written here and served by Streamlit's static file server (server.enableStaticServing)
+EXPORT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static', 'exports')
+EXPORT_URL = 'app/static/exports'
+# Rows converted and written per step, which bounds the memory an export needs
+EXPORT_CHUNK_ROWS = 100000
+# Exported files older than this are removed
+EXPORT_MAX_AGE_HOURS = 6
+# Largest file Streamlit's static file server serves (MAX_APP_STATIC_FILE_SIZE); it answers 404 beyond
+EXPORT_STATIC_MAX_BYTES = 200 * 1024 * 1024
+# Export formats offered for every report and the extensions of their files
+EXPORT_EXTENSIONS = {"CSV": ".csv", "Excel": ".xlsx", "Parquet": ".parquet", "Feather": ".feather"}
+
+# Function to remove exported files that are old enough to have been downloaded
+def cleanup_exports(max_age_hours=EXPORT_MAX_AGE_HOURS):
+    if not os.path.isdir(EXPORT_DIR):
+        return
+    cutoff = time.time() - max_age_hours * 3600
+    for name in os.listdir(EXPORT_DIR):
+        path = os.path.join(EXPORT_DIR, name)
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+        except OSError:
+            pass
+
+# Rows an Excel sheet holds, the header included; longer exports continue on numbered sheets
+EXCEL_MAX_ROWS = 1048576
+EXCEL_MAX_COLUMN_WIDTH = 60
+EXCEL_SHEET_NAME_LENGTH = 31
+
+# Function to pick the xlsxwriter cell writer for a column and list its values, missing values as None
+def excel_cells(series):
+    kind = series.dtype
+    if isinstance(kind, pd.CategoricalDtype):
+        # Typed by the categories, but read as objects: numeric and flag categories cannot
+        # take their own dtype while a value is missing
+        kind = kind.categories.dtype if len(kind.categories) else np.dtype(object)
+        series = series.astype(object).where(series.notna(), None)
+    if pd.api.types.is_datetime64_any_dtype(kind):
+        series = pd.to_datetime(series)
+        # Excel has no time zones, so aware timestamps are written in UTC
+        if series.dt.tz is not None:
+            series = series.dt.tz_convert('UTC').dt.tz_localize(None)
+        method = 'write_datetime'
+    elif pd.api.types.is_bool_dtype(kind):
+        method = 'write_boolean'
+    elif pd.api.types.is_numeric_dtype(kind):
+        method = 'write_number'
+    else:
+        series = series.astype(str).where(series.notna())
+        method = 'write_string'
+    return method, series.astype(object).where(series.notna(), None).tolist()
+
+# Function to size a column from its header and the first chunk of its values
+def excel_column_width(name, values):
+    sample = [len(str(value)) for value in values[:1000] if value is not None]
+    return min(max([len(str(name))] + sample) + 2, EXCEL_MAX_COLUMN_WIDTH)
+
+# Function to stream chunks of rows into an xlsx file, starting a new sheet whenever one is full
+def write_excel_export(path, chunks, sheet_name):
+    """
+    Rows are written in constant_memory mode, so xlsxwriter flushes each row to disk
+    once the next one starts and the workbook never sits in memory. Column types and
+    widths are taken from the first chunk and applied while writing.
+    """
+    workbook = xlsxwriter.Workbook(path, {'constant_memory': True, 'strings_to_urls': False, 'nan_inf_to_errors': True,
+                                          'default_date_format': 'yyyy-mm-dd hh:mm:ss'})
+    header_format = workbook.add_format({'bold': True})
+    columns, widths, methods = None, None, None
+    worksheet, sheet_number, row = None, 0, EXCEL_MAX_ROWS
+    try:
+        for chunk in chunks:
+            cells = [excel_cells(chunk[col]) for col in chunk.columns]
+            if columns is None:
+                columns = list(chunk.columns)
+                methods = [method for method, _ in cells]
+                widths = [excel_column_width(col, values) for col, (_, values) in zip(columns, cells)]
+            values = [column_values for _, column_values in cells]
+            for record in zip(*values):
+                if row == EXCEL_MAX_ROWS:
+                    sheet_number += 1
+                    suffix = f" {sheet_number}" if sheet_number > 1 else ""
+                    worksheet = workbook.add_worksheet(sheet_name[:EXCEL_SHEET_NAME_LENGTH - len(suffix)] + suffix)
+                    for number, width in enumerate(widths):
+                        worksheet.set_column(number, number, width)
+                    worksheet.write_row(0, 0, [str(col) for col in columns], header_format)
+                    writers = [getattr(worksheet, method) for method in methods]
+                    row = 1
+                for number, value in enumerate(record):
+                    if value is not None:
+                        writers[number](row, number, value)
+                row += 1
+        if worksheet is None:
+            # An empty export still gets a sheet with the header
+            worksheet = workbook.add_worksheet(sheet_name[:EXCEL_SHEET_NAME_LENGTH])
+            worksheet.write_row(0, 0, [str(col) for col in columns or []], header_format)
+    finally:
+        workbook.close()
+
+# Function to turn a value of a mixed object column into text, keeping missing values missing
+def arrow_text(value):
+    if value is None or isinstance(value, str):
+        return value
+    if isinstance(value, float) and value != value:
+        return None
+    return str(value)
+
+# Function to turn a list, or the string form of one, into a list of text, keeping missing values missing
+def arrow_list(value):
+    if value is None or (isinstance(value, float) and value != value):
+        return None
+    return [arrow_text(item) for item in parse_tag_list(value)]
+
+# Function to derive the Arrow schema of an export from its first chunk
+def arrow_schema(chunk):
+    # Types come from the dtypes, not the values, so every chunk maps onto the same schema;
+    # object columns are text, except the tag columns and columns of lists, which are lists of text
+    schema = pa.Schema.from_pandas(chunk.iloc[:0], preserve_index=False)
+    for number, field in enumerate(schema):
+        series = chunk[field.name]
+        if series.dtype == object:
+            first = series.dropna().iloc[:1].tolist()
+            listed = field.name in TAG_COLUMNS or (first and isinstance(first[0], list))
+            schema = schema.set(number, field.with_type(pa.list_(pa.string()) if listed else pa.string()))
+    return schema
+
+# Function to convert a chunk of a report to an Arrow table, keeping numbers, dates and categories typed
+def arrow_table(chunk, schema):
+    arrays = []
+    for field in schema:
+        series = chunk[field.name]
+        if pa.types.is_list(field.type):
+            arrays.append(pa.array(series.map(arrow_list), type=field.type, from_pandas=True))
+            continue
+        try:
+            arrays.append(pa.array(series, type=field.type, from_pandas=True))
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            # Object columns holding lists or numbers next to text are written as text
+            arrays.append(pa.array(series.map(arrow_text), type=field.type, from_pandas=True))
+    return pa.Table.from_arrays(arrays, schema=schema)
+
+# Function to stream chunks of rows into a zstd-compressed Parquet or Arrow IPC (Feather) file
+def write_arrow_export(path, chunks, export_format):
+    writer = None
+    try:
+        for chunk in chunks:
+            if writer is None:
+                schema = arrow_schema(chunk)
+                if export_format == "Parquet":
+                    # Every chunk becomes a row group
+                    writer = pq.ParquetWriter(path, schema, compression='zstd')
+                else:
+                    writer = pa.ipc.new_file(path, schema, options=pa.ipc.IpcWriteOptions(compression='zstd'))
+            writer.write_table(arrow_table(chunk, schema))
+    finally:
+        if writer is not None:
+            writer.close()
+
+# Function to write the selected rows of a report to a file in the export directory
+def export_report(chain, df, columns, export_format, base_name, sheet_name, csv_delimiter=",", compress=False, transform=None):
+    """
+    Write the rows selected by a FilterChain chunk by chunk, so memory stays flat
+    whatever the number of rows. transform is applied to every chunk before it is
+    written. Returns the stored file name and the name offered for download.
+    """
+    cleanup_exports()
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+    extension = EXPORT_EXTENSIONS[export_format]
+    if export_format == "CSV" and compress:
+        extension += ".gz"
+    stamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
+    # Static files are served to anyone with the URL, so the name carries an unguessable token
+    file_name = f"{base_name}_{stamp}_{secrets.token_urlsafe(16)}{extension}"
+    chunks = (transform(chunk) if transform else chunk for chunk in chain.chunks(df, columns))
+    write_export(os.path.join(EXPORT_DIR, file_name), chunks, export_format, sheet_name, csv_delimiter, compress)
+    return file_name, f"{base_name}{extension}"
 
-def parse_publication_info_adaptive(publication_data):
+# Function to write chunks of rows to a file in one of the export formats
+def write_export(path, chunks, export_format, sheet_name, csv_delimiter=",", compress=False):
+    # Write to a temporary name so a half-written file is never served
+    temp_path = os.path.join(os.path.dirname(path), f".partial_{os.path.basename(path)}")
+    try:
+        if export_format == "CSV":
+            opener = gzip.open if compress else open
+            with opener(temp_path, 'wt', encoding='utf-8', newline='') as handle:
+                for number, chunk in enumerate(chunks):
+                    chunk.to_csv(handle, index=False, sep=csv_delimiter, header=number == 0)
+        elif export_format == "Excel":
+            write_excel_export(temp_path, chunks, sheet_name)
+        else:
+            write_arrow_export(temp_path, chunks, export_format)
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+# Function to build the download link of an exported file
+def export_link(file_name, download_name, label):
+    return f'<a href="{EXPORT_URL}/{file_name}" download="{download_name}">{label}</a>'
+
+# Function to show the last export of a report tab, which stays on the page across reruns
+def show_last_export(name, key):
+    export = st.session_state.get(name)
+    if export is not None:
+        file_name, download_name, export_format, count = export
+        show_export(file_name, download_name, f"Download {export_format} File", key)
+        st.success(f"Export complete! {count} records exported.")
+
+# Function to offer an exported file for download
+def show_export(file_name, download_name, label, key):
     """
-    Parse publication information from various formats and extract publisher, place, and date.
-    Handles both list and string representations.
+    Link to the file through the static file server while it is small enough to be
+    served there. A larger file goes through a download button of this session
+    instead. The button holds the file in server memory and would read it again on
+    every rerun, so it is only drawn in the run after the user asks for it.
     """
-    publisher = ''
-    place = ''
-    date = ''
-    
-    # Convert to list format if it's a string
-    publications = safe_parse(publication_data)
-    
-    if publications:
-        for pub in publications:
-            # Extract publisher
-            if 'publisher' in pub and pub['publisher']:
-                publisher = pub['publisher']
-                
-            # Extract place
-            if 'place' in pub and pub['place']:
-                place = pub['place']
-                
-            # Extract date of publication
-            if 'dateOfPublication' in pub and pub['dateOfPublication']:
-                date = pub['dateOfPublication']
-                
-            # If we have all three pieces of information, we can stop
-            if publisher and place and date:
-                break
-    
-    return pd.Series([publisher, place, date])
+    path = os.path.join(EXPORT_DIR, file_name)
+    if not os.path.exists(path):
+        st.warning("The export file has been removed. Please export again.")
+        return
+    size = os.path.getsize(path)
+    if size <= EXPORT_STATIC_MAX_BYTES:
+        st.markdown(export_link(file_name, download_name, label), unsafe_allow_html=True)
+    elif st.button(f"Prepare {label} ({size / 1024 / 1024:,.0f} MB)", key=f"{key}_prepare"):
+        with open(path, 'rb') as handle:
+            st.download_button(label, handle, file_name=download_name, key=key)
+        # Keeps the progress polling from rerunning the button away before it is clicked
+        st.session_state.download_prepared = True
 
-def extract_alternative_title(alt_titles):
-    """Extract the first alternative title from a list of alternative titles."""
-    alt_titles_list = safe_parse(alt_titles)
-    if alt_titles_list and len(alt_titles_list) > 0 and 'alternativeTitle' in alt_titles_list[0]:
-        return alt_titles_list[0]['alternativeTitle']
-    return np.nan
+# Reports that load in the background, in the order finished loads are handed to the session:
+# a refresh and a loan count load carry the inventory, so they are applied after a bibliographic one
+LOAD_REPORTS = ['bibliographic', 'refresh', 'loan_count', 'circulation']
+# Seconds between the reruns that refresh the progress of running loads
+LOAD_JOB_POLL_SECONDS = 1
+# Hours a finished load is kept for its session to collect, before its results are dropped
+LOAD_JOB_TTL_HOURS = 1
 
-def extract_vtls020(id_list):
-    """Extract ISBN from identifiers list."""
-    id_list = safe_parse(id_list)
-    for identifier in id_list:
-        if isinstance(identifier, dict) and identifier.get('identifierTypeId') == "8261054f-be78-422d-bd51-4ed9f33c3422":
-            return identifier.get('value', '')
-    return ''
+# Function to get the background loads of this server process, which outlive reruns and sessions
+@st.cache_resource(show_spinner=False)
+def load_jobs():
+    return {}
 
-# Function to get loan data
-def get_loans(url, header_dict, query_param=""):
-    offset = 0
-    limit = 1000  # Adjust based on what the server can handle efficiently
-    all_loans = []  # List to hold all records
+# Function to get the id of this browser session's loads, kept in the page URL so that
+# a browser refresh finds them again while other sessions of the same login do not
+def load_session_id():
+    if 'load_session_id' not in st.session_state:
+        params = st.experimental_get_query_params()
+        session_id = params.get('session', [''])[0]
+        if not re.fullmatch(r'[\w-]{22}', session_id):
+            session_id = secrets.token_urlsafe(16)
+            params['session'] = [session_id]
+            st.experimental_set_query_params(**params)
+        st.session_state.load_session_id = session_id
+    return st.session_state.load_session_id
 
-    with st.spinner('Fetching loan data...'):
-        while True:
-            # Modify the request URL to include offset and limit for pagination
-            paginated_url = f"{url}/circulation/loans?limit={limit}&offset={offset}{query_param}"
-            response = requests.get(paginated_url, headers=header_dict)
-            try:
-                response.raise_for_status()  # Check for HTTP errors
-                data = response.json()
-                loans = data.get('loans', [])
-                if not loans:
-                    break  # Exit loop if no more data is returned
-                all_loans.extend(loans)
-                offset += limit  # Increase offset for next batch
-            except requests.exceptions.HTTPError as err:
-                st.error(f"HTTP error occurred: {err}")
-                break
-            except requests.exceptions.RequestException as e:
-                st.error(f"Error making request: {e}")
-                break
-            except ValueError as e:
-                st.error(f"Error decoding JSON: {e}")
-                break
+# Function to get the key of a report load of this browser session
+def load_job_key(report):
+    return (st.session_state.okapi_url, st.session_state.tenant, load_session_id(), report)
 
-    # Once all data is fetched, convert it to a DataFrame
-    if all_loans:
-        df_loans = pd.json_normalize(all_loans)
-        return df_loans
-    else:
-        st.warning("No loans data found.")
-        return pd.DataFrame()
+# Function to get the background load of a report for the logged in user, if any
+def find_load_job(report):
+    return load_jobs().get(load_job_key(report))
 
-# Function to get user data
-def get_users(url, header_dict):
-    offset = 0
-    limit = 1000  # Adjust based on what the server can handle efficiently
-    all_users = []  # List to hold all records
+# Function to start loading a report in the background, replacing a finished load of it
+def start_load_job(report, label, work):
+    # Copied from the session, as a job thread cannot read st.session_state
+    state = {'user_cache': session_value('user_cache', dict),
+             'snapshot_ttl_hours': st.session_state.get('snapshot_ttl_hours', SNAPSHOT_TTL_HOURS)}
+    job = LoadJob(label, work, state)
+    prune_load_jobs()
+    load_jobs()[load_job_key(report)] = job
+    job.thread.start()
+    return job
 
-    with st.spinner('Fetching user data...'):
-        while True:
-            # Modify the request URL to include offset and limit for pagination
-            paginated_url = f"{url}/users?limit={limit}&offset={offset}"
-            response = requests.get(paginated_url, headers=header_dict)
-            try:
-                response.raise_for_status()  # Check for HTTP errors
-                data = response.json()
-                users = data.get('users', [])
-                if not users:
-                    break  # Exit loop if no more data is returned
-                all_users.extend(users)
-                offset += limit  # Increase offset for next batch
-            except requests.exceptions.HTTPError as err:
-                st.error(f"HTTP error occurred: {err}")
-                break
-            except requests.exceptions.RequestException as e:
-                st.error(f"Error making request: {e}")
-                break
-            except ValueError as e:
-                st.error(f"Error decoding JSON: {e}")
-                break
+# Function to start loading the bibliographic report in the background
+def start_bibliographic_load(url, header_dict, scope=None):
+    # A running loan count load harvesting the same inventory hands it over instead of a second harvest
+    inventory_job = find_load_job('loan_count')
+    if not (inventory_job is not None and inventory_job.running
+            and 'inventory_scope' in inventory_job.shared and inventory_job.shared['inventory_scope'] == scope):
+        inventory_job = None
 
-    # Once all data is fetched, convert it to a DataFrame
-    if all_users:
-        df_users = pd.json_normalize(all_users)
-        return df_users
-    else:
-        st.warning("No users data found.")
-        return pd.DataFrame()
+    def work():
+        final_df = None
+        if inventory_job is not None:
+            with status_spinner("Waiting for the inventory of the loan count load..."):
+                while inventory_job.running and 'inventory' not in inventory_job.shared:
+                    report_progress()
+                    inventory_job.thread.join(LOAD_JOB_POLL_SECONDS)
+            final_df = inventory_job.shared.get('inventory')
+        if final_df is None:
+            final_df = load_inventory(url, header_dict, scope)
+        with status_spinner("Indexing report..."):
+            state = report_state(final_df)
+        state['report_scope'] = scope
+        return state
+    return start_load_job('bibliographic', "Bibliographic data", work)
 
-# Function to get fines data
-def get_fines(url, header_dict):
-    offset = 0
-    limit = 1000  # Adjust based on what the server can handle efficiently
-    all_fines = []  # List to hold all records
+# Function to refresh the records of the bibliographic report changed since the last harvest, in the background
+def start_refresh_load(url, header_dict, final_df, scope=None):
+    def work():
+        refreshed_df, rebuilt_count = refresh_bibliographic_report(final_df, url, header_dict, scope)
+        with status_spinner("Indexing report..."):
+            state = report_state(refreshed_df)
+        state['refreshed_instances'] = rebuilt_count
+        return state
+    return start_load_job('refresh', "Refreshing changed records", work)
 
-    with st.spinner('Fetching fines data...'):
-        while True:
-            # Modify the request URL to include offset and limit for pagination
-            paginated_url = f"{url}/accounts?limit={limit}&offset={offset}"
-            response = requests.get(paginated_url, headers=header_dict)
-            try:
-                response.raise_for_status()  # Check for HTTP errors
-                data = response.json()
-                fines = data.get('accounts', [])
-                if not fines:
-                    break  # Exit loop if no more data is returned
-                all_fines.extend(fines)
-                offset += limit  # Increase offset for next batch
-            except requests.exceptions.HTTPError as err:
-                st.error(f"HTTP error occurred: {err}")
-                break
-            except requests.exceptions.RequestException as e:
-                st.error(f"Error making request: {e}")
-                break
-            except ValueError as e:
-                st.error(f"Error decoding JSON: {e}")
-                break
+# Function to start loading the loan count report in the background
+def start_loan_count_load(url, header_dict, scope=None):
+    # The inventory is taken from the session, or from a bibliographic load still running
+    final_df = st.session_state.final_df if st.session_state.data_loaded else None
+    inventory_job = find_load_job('bibliographic') if final_df is None else None
+    reindex_text = st.session_state.get('search_index') is None
 
-    # Once all data is fetched, convert it to a DataFrame
-    if all_fines:
-        df_fines = pd.json_normalize(all_fines)
-        return df_fines
-    else:
-        st.warning("No fines data found.")
-        return pd.DataFrame()
+    def work():
+        df, reindex = final_df, reindex_text
+        if df is None and inventory_job is not None:
+            with status_spinner("Waiting for the bibliographic data..."):
+                while inventory_job.running:
+                    report_progress()
+                    inventory_job.thread.join(LOAD_JOB_POLL_SECONDS)
+            if inventory_job.status == "done":
+                # Its search index reaches the session before this load's results (see collect_load_jobs)
+                df, reindex = inventory_job.result['final_df'], False
+        state = {}
+        if df is None:
+            df, reindex = load_inventory(url, header_dict, scope), True
+            state['report_scope'] = scope
+            current_job().shared['inventory'] = df
+        counted = load_loan_counts(url, header_dict, df, scope)
+        with status_spinner("Indexing report..."):
+            state.update(report_state(counted, reindex_text=reindex))
+        state['loan_count_scope'] = scope
+        return state
+    job = start_load_job('loan_count', "Loan count data", work)
+    if final_df is None and inventory_job is None:
+        # Tells a bibliographic load started meanwhile that this one harvests the inventory
+        job.shared['inventory_scope'] = scope
+    return job
 
-# Function to get loan count data
-def get_loan_count_data(url, header_dict):
-    offset = 0
-    limit = 1000  # Adjust based on what the server can handle efficiently
-    all_loan_counts = []  # List to hold all records
+# Function to start loading the circulation report in the background
+def start_circulation_load(url, header_dict, scope=None):
+    def work():
+        merged_df, df_fines, patron_groups = load_circulation(url, header_dict, scope)
+        with status_spinner("Indexing report..."):
+            state = circulation_state(merged_df, df_fines)
+        state['patron_groups'] = patron_groups
+        state['circulation_scope'] = scope
+        return state
+    return start_load_job('circulation', "Circulation data", work)
 
-    with st.spinner('Fetching loan count data...'):
-        while True:
-            # Modify the request URL to include offset and limit for pagination
-            paginated_url = f"{url}/circulation/loans?limit={limit}&offset={offset}"
-            response = requests.get(paginated_url, headers=header_dict)
-            try:
-                response.raise_for_status()  # Check for HTTP errors
-                data = response.json()
-                loan_counts = data.get('loans', [])
-                if not loan_counts:
-                    break  # Exit loop if no more data is returned
-                all_loan_counts.extend(loan_counts)
-                offset += limit  # Increase offset for next batch
-            except requests.exceptions.HTTPError as err:
-                st.error(f"HTTP error occurred: {err}")
-                break
-            except requests.exceptions.RequestException as e:
-                st.error(f"Error making request: {e}")
-                break
-            except ValueError as e:
-                st.error(f"Error decoding JSON: {e}")
-                break
+# Function to hand the results of finished background loads over to the session.
+# Returns whether loads are still running.
+def collect_load_jobs():
+    prune_load_jobs()
+    for report in LOAD_REPORTS:
+        job = find_load_job(report)
+        if job is None or job.status != "done":
+            continue
+        if report == 'loan_count' and load_job_running('bibliographic'):
+            # A bibliographic load taking its inventory would replace the counts, so it goes first
+            continue
+        del load_jobs()[load_job_key(report)]
+        result = dict(job.result)
+        refreshed_instances = result.pop('refreshed_instances', None)
+        st.session_state.update(result)
+        for level, message in job.messages:
+            if level in ("warning", "error"):
+                getattr(st, level)(message)
+        if report == 'circulation':
+            st.session_state.circulation_data_loaded = True
+            continue
+        if report == 'refresh':
+            # The refreshed report keeps its columns, and its loan counts if it had them
+            st.success(f"Refresh complete! {refreshed_instances} instances updated.")
+            continue
+        st.session_state.data_loaded = True
+        # Loan counts belong to the inventory they were counted on, which a bibliographic load replaces
+        st.session_state.loan_count_data_loaded = report == 'loan_count'
+        if report == 'bibliographic' or not st.session_state.get('display_columns'):
+            # Select columns to display by default
+            final_df = st.session_state.final_df
+            st.session_state.display_columns = [col for col in BIBLIOGRAPHIC_COLUMN_RENAMES.values() if col in final_df.columns]
+    return load_jobs_running()
 
-    # Once all data is fetched, convert it to a DataFrame
-    if all_loan_counts:
-        df_loan_counts = pd.json_normalize(all_loan_counts)
-        return df_loan_counts
+# Function to drop the finished loads of any session that have not been collected in time
+def prune_load_jobs():
+    jobs = load_jobs()
+    cutoff = time.time() - LOAD_JOB_TTL_HOURS * 3600
+    for key, job in list(jobs.items()):
+        if not job.running and job.finished is not None and job.finished < cutoff:
+            jobs.pop(key, None)
+
+# Function to tell whether the load of a report of this session is still running
+def load_job_running(report):
+    job = find_load_job(report)
+    return job is not None and job.running
+
+# Function to tell whether any load of this session is still running
+def load_jobs_running():
+    return any(map(load_job_running, LOAD_REPORTS))
+
+# Function to cancel and forget the background loads of this session
+def drop_load_jobs():
+    for report in LOAD_REPORTS:
+        job = load_jobs().pop(load_job_key(report), None)
+        if job is not None:
+            job.cancel()
+
+# Function to show a report load running in the background, with a button to cancel it
+def show_load_job(job, key):
+    st.progress(job.fraction(), text=job.describe())
+    for level, message in job.messages:
+        if level in ("warning", "error"):
+            getattr(st, level)(message)
+    if st.button("Cancel", key=key, disabled=job.cancelled.is_set()):
+        job.cancel()
+        st.experimental_rerun()
+
+# Function to show how the last background load of a report ended, when it did not succeed
+def show_load_job_outcome(job, failure):
+    if job is not None and job.status == "failed":
+        st.error(f"{failure}: {job.error}")
+    elif job is not None and job.status == "cancelled":
+        st.info("Loading was cancelled.")
+
+# Reports the command line runner can build
+CLI_REPORTS = ['bibliographic', 'circulation', 'loan-count']
+
+# Function to tell the export format of an output file from its extension
+def export_format_for(path):
+    name = path.lower()
+    compress = name.endswith('.gz')
+    if compress:
+        name = name[:-3]
+    for export_format, extension in EXPORT_EXTENSIONS.items():
+        if name.endswith(extension) and (export_format == "CSV" or not compress):
+            return export_format, compress
+    return None, compress
+
+# Function to build a report from the command line, without the Streamlit interface
+def run_cli(argv=None):
+    """
+    Log in, load one report through the snapshot store, apply an optional advanced
+    filter expression and write the chosen columns to a file, e.g.
+
+        python app.py bibliographic --filter "`Item Status` == 'Available'" --output items.parquet
+
+    The Okapi URL, tenant and username may come from MEDAD_URL, MEDAD_TENANT and
+    MEDAD_USERNAME; the password is only read from MEDAD_PASSWORD, so it stays out of
+    the process list and crontab. The --location, --material-type, --patron-group and
+    --loans-from/--loans-to options make it a scoped load (see build_load_scope).
+    Returns the process exit code.
+    """
+    parser = argparse.ArgumentParser(prog="app.py", description="Build a Medad report and write it to a file.")
+    parser.add_argument("report", choices=CLI_REPORTS)
+    parser.add_argument("-o", "--output", required=True,
+                        help="File to write; the format follows the extension (.csv, .csv.gz, .xlsx, .parquet, .feather)")
+    parser.add_argument("--format", choices=list(EXPORT_EXTENSIONS), help="Export format, overriding the output extension")
+    parser.add_argument("--filter", default="", help="Advanced filter expression, as typed in the Advanced Filtering box")
+    parser.add_argument("--columns", help="Comma-separated columns to export, or 'all'; defaults to the columns the report tab shows")
+    parser.add_argument("--delimiter", default=",", help="CSV delimiter")
+    parser.add_argument("--snapshot-ttl", type=float, default=SNAPSHOT_TTL_HOURS,
+                        help="Use harvested data younger than this many hours from the snapshot store; 0 always harvests")
+    parser.add_argument("--location", action="append", default=[],
+                        help="Scoped load: only items at this location, and loans of items checked out there (repeatable)")
+    parser.add_argument("--material-type", action="append", default=[],
+                        help="Scoped load: only items of this material type (repeatable)")
+    parser.add_argument("--patron-group", action="append", default=[],
+                        help="Scoped load: only the circulation of users in this patron group (repeatable)")
+    parser.add_argument("--loans-from", type=datetime.date.fromisoformat, metavar="YYYY-MM-DD",
+                        help="Scoped load: only loans made on or after this date")
+    parser.add_argument("--loans-to", type=datetime.date.fromisoformat, metavar="YYYY-MM-DD",
+                        help="Scoped load: only loans made on or before this date")
+    parser.add_argument("--url", default=os.environ.get("MEDAD_URL"), help="Okapi URL")
+    parser.add_argument("--tenant", default=os.environ.get("MEDAD_TENANT"))
+    parser.add_argument("--username", default=os.environ.get("MEDAD_USERNAME"))
+    args = parser.parse_args(argv)
+
+    password = os.environ.get("MEDAD_PASSWORD")
+    if not (args.url and args.tenant and args.username and password):
+        parser.error("the Okapi URL, tenant and username (options or MEDAD_* variables) and MEDAD_PASSWORD are required")
+    export_format, compress = export_format_for(args.output)
+    export_format = args.format or export_format
+    if export_format is None:
+        parser.error(f"cannot tell the export format of {args.output}; use --format")
+    # Check the expression before spending time on the harvest
+    try:
+        plan = FilterPlan(args.filter) if args.filter.strip() else None
+    except FilterExpressionError as e:
+        parser.error(f"invalid filter: {e}")
+
+    token, success, message = tenant_login(args.url, args.tenant, args.username, password)
+    if not success:
+        print(message, file=sys.stderr)
+        return 1
+    header_dict = {"x-okapi-tenant": args.tenant, "x-okapi-token": token}
+    HEADLESS_STATE['snapshot_ttl_hours'] = args.snapshot_ttl
+
+    scope = None
+    if args.location or args.material_type or args.patron_group or args.loans_from or args.loans_to:
+        try:
+            scope = build_load_scope(load_scope_options(args.url, header_dict), args.location, args.material_type,
+                                     args.patron_group, args.loans_from, args.loans_to)
+        except ValueError as e:
+            print(e, file=sys.stderr)
+            return 2
+
+    transform = None
+    if args.report == "circulation":
+        df = load_circulation(args.url, header_dict, scope)[0]
+        default_columns, sheet_name = CIRCULATION_DEFAULT_COLUMNS, "Circulation Report"
     else:
-        st.warning("No loan count data found.")
-        return pd.DataFrame()
+        df = load_inventory(args.url, header_dict, scope)
+        if args.report == "loan-count":
+            df = load_loan_counts(args.url, header_dict, df, scope)
+            default_columns, sheet_name = LOAN_COUNT_DEFAULT_COLUMNS, "Loan Count Report"
+            transform = format_loan_count_view
+        else:
+            default_columns, sheet_name = list(BIBLIOGRAPHIC_COLUMN_RENAMES.values()), "Bibliographic Report"
+
+    all_columns = visible_columns(df)
+    if args.columns == "all":
+        columns = all_columns
+    elif args.columns:
+        columns = [col.strip() for col in args.columns.split(",") if col.strip()]
+        unknown = [col for col in columns if col not in all_columns]
+        if unknown:
+            print(f"Unknown column {unknown[0]!r}", file=sys.stderr)
+            return 2
+    else:
+        columns = [col for col in default_columns if col in all_columns]
+
+    chain = FilterChain(FilterIndex(df, []))
+    if plan is not None:
+        try:
+            plan.check(all_columns)
+            chain.mask(lambda: plan.mask(chain.take(df, plan.columns)))
+        except FilterExpressionError as e:
+            print(f"Invalid filter: {e}", file=sys.stderr)
+            return 2
+
+    with status_spinner(f"Writing {chain.count()} of {len(df)} records to {args.output}..."):
+        chunks = (transform(chunk) if transform else chunk for chunk in chain.chunks(df, columns))
+        write_export(os.path.abspath(args.output), chunks, export_format, sheet_name, args.delimiter, compress)
+    return 0
+
+# Run as a command line tool when started with `python app.py ...` rather than `streamlit run`
+if __name__ == "__main__" and not st.runtime.exists():
+    sys.exit(run_cli())
 
 # Create sidebar for login form
 st.sidebar.title("Medad Login")
@@ -449,6 +3194,7 @@ if st.sidebar.button("Connect to Medad", key="login_button"):
                 st.session_state.token = token
                 st.session_state.okapi_url = okapi_url
                 st.session_state.tenant = tenant
+                st.session_state.username = username
                 st.session_state.logged_in = True
             else:
                 st.sidebar.error(message)
@@ -461,12 +3207,22 @@ if 'data_loaded' not in st.session_state:
     st.session_state.data_loaded = False
 if 'final_df' not in st.session_state:
     st.session_state.final_df = None
+if 'report_index' not in st.session_state:
+    st.session_state.report_index = None
+if 'search_index' not in st.session_state:
+    st.session_state.search_index = None
+if 'lookup_index' not in st.session_state:
+    st.session_state.lookup_index = None
+if 'filter_cache' not in st.session_state:
+    st.session_state.filter_cache = FilterCache()
 if 'loan_count_data_loaded' not in st.session_state:
     st.session_state.loan_count_data_loaded = False
-if 'loan_count_df' not in st.session_state:
-    st.session_state.loan_count_df = None
 if 'circulation_data_loaded' not in st.session_state:
     st.session_state.circulation_data_loaded = False
+if 'load_scope' not in st.session_state:
+    st.session_state.load_scope = None
+# Put the id of this session's loads into the page URL from the first run
+load_session_id()
 
 # Add a Reset All Data button to the sidebar if user is logged in
 if st.session_state.logged_in:
@@ -474,29 +3230,101 @@ if st.session_state.logged_in:
     
     # Button to reset all data
     if st.sidebar.button("Reset All Data", key="reset_all_button"):
+        # Stop the loads still running in the background
+        drop_load_jobs()
+        
         # Reset all data-related session state variables
         st.session_state.data_loaded = False
         st.session_state.circulation_data_loaded = False
         st.session_state.loan_count_data_loaded = False
         st.session_state.final_df = None
+        st.session_state.report_index = None
+        st.session_state.search_index = None
+        st.session_state.lookup_index = None
         st.session_state.circulation_df = None
-        st.session_state.loan_count_df = None
+        st.session_state.circulation_index = None
         st.session_state.fines_df = None
+        st.session_state.fines_index = None
+        st.session_state.filter_cache = FilterCache()
         st.session_state.patron_groups = None
+        st.session_state.scope_options = None
+        st.session_state.bibliographic_export = None
+        st.session_state.circulation_export = None
+        st.session_state.loan_count_export = None
         if 'user_cache' in st.session_state:
             st.session_state.user_cache = {}
         st.sidebar.success("All data has been reset!")
         st.experimental_rerun()
 
+    # Snapshot settings: harvested tables younger than this are loaded from disk
+    st.session_state.snapshot_ttl_hours = st.sidebar.number_input(
+        "Snapshot max age (hours)",
+        min_value=0.0,
+        value=SNAPSHOT_TTL_HOURS,
+        step=1.0,
+        help="Harvested data younger than this is loaded from the local snapshot instead of Medad. Set to 0 to always harvest.",
+        key="snapshot_ttl_input"
+    )
+
+    # Button to drop the stored snapshots of this tenant
+    if st.sidebar.button("Clear Snapshots", key="clear_snapshots_button"):
+        clear_snapshots(st.session_state.okapi_url, st.session_state.tenant)
+        st.sidebar.success("Snapshots have been cleared!")
+
+    # Scoped loads: coarse filters that Medad applies itself, so only the matching records are downloaded
+    st.sidebar.markdown("---")
+    if st.sidebar.checkbox("Scoped load", key="scope_enabled",
+                           help="Choose locations, material types, a loan period or patron groups before loading, to download only the matching records instead of whole collections."):
+        if st.session_state.get('scope_options') is None:
+            header_dict = {
+                "x-okapi-tenant": st.session_state.tenant,
+                "x-okapi-token": st.session_state.token
+            }
+            try:
+                with st.spinner("Fetching locations, material types and patron groups..."):
+                    st.session_state.scope_options = load_scope_options(st.session_state.okapi_url, header_dict)
+            except Exception as e:
+                st.sidebar.error(f"Error fetching the scope choices: {str(e)}")
+        scope_options = st.session_state.get('scope_options') or {field: {} for field in LOAD_SCOPE_FIELDS}
+        
+        scope_locations = st.sidebar.multiselect("Item locations", sorted(scope_options['locations']), key="scope_locations",
+                                                 help="Items at these locations; circulation loans of items checked out at them.")
+        scope_material_types = st.sidebar.multiselect("Material types", sorted(scope_options['material_types']), key="scope_material_types",
+                                                      help="Bibliographic and Loan Count reports only.")
+        scope_patron_groups = st.sidebar.multiselect("Patron groups", sorted(scope_options['patron_groups']), key="scope_patron_groups",
+                                                     help="Circulation report only.")
+        loans_from = loans_to = None
+        if st.sidebar.checkbox("Limit loans to a period", key="scope_loan_period_enabled"):
+            today = datetime.date.today()
+            loan_period = st.sidebar.date_input("Loan period", value=(today - datetime.timedelta(days=365), today),
+                                                key="scope_loan_period")
+            # The range has a single date while its end is being picked
+            if isinstance(loan_period, tuple) and len(loan_period) == 2:
+                loans_from, loans_to = loan_period
+        
+        st.session_state.load_scope = build_load_scope(scope_options, scope_locations, scope_material_types,
+                                                       scope_patron_groups, loans_from, loans_to)
+        st.sidebar.caption("Applies to the next load. Reports already loaded keep the scope they were loaded with.")
+    else:
+        st.session_state.load_scope = None
+
 # Main content area - only show if logged in
 if st.session_state.logged_in:
+    # Take over the results of loads that finished in the background
+    loads_running = collect_load_jobs()
+    
     # Create tabs for different reports
     tabs = st.tabs(["Bibliographic Report", "Circulation Report", "Loan Count"])
     
     with tabs[0]:  # Bibliographic Report Tab
         if not st.session_state.data_loaded:
-            if st.button("Load Bibliographic Data", key="bibliographic_load_button"):
-                try:
+            job = find_load_job('bibliographic')
+            if job is not None and job.running:
+                # Loading runs in the background, so the other tabs stay usable
+                show_load_job(job, "bibliographic_cancel_button")
+            else:
+                show_load_job_outcome(job, "Error loading data")
+                if st.button("Load Bibliographic Data", key="bibliographic_load_button"):
                     # Set up header for API calls
                     header_dict = {
                         "x-okapi-tenant": st.session_state.tenant,
@@ -504,152 +3332,36 @@ if st.session_state.logged_in:
                     }
                     
                     # Fetch all the required data
-                    with st.spinner("Loading data from Medad..."):
-                        # Get instances, holdings, and items data
-                        df_instances = get_instances(st.session_state.okapi_url, header_dict)
-                        st.success("✅ Instances data loaded")
-                        
-                        df_holdings = get_holdings(st.session_state.okapi_url, header_dict)
-                        st.success("✅ Holdings data loaded")
-                        
-                        df_items = get_items(st.session_state.okapi_url, header_dict)
-                        st.success("✅ Items data loaded")
-                        
-                        # Get reference data
-                        df_location = get_locations(st.session_state.okapi_url, header_dict)
-                        df_mtypes = get_mtypes(st.session_state.okapi_url, header_dict)
-                        df_loantypes = get_loan_types(st.session_state.okapi_url, header_dict)
-                        df_statcode = get_statistical_codes(st.session_state.okapi_url, header_dict)
-                        
-                        # Merge the data
-                        with st.spinner("Merging data..."):
-                            # First merge instances with holdings
-                            merged_df = df_instances.merge(df_holdings, left_on='id', right_on='instanceId', how='inner')
-                            
-                            # Then merge with items
-                            final_df = merged_df.merge(df_items, left_on='id_y', right_on='holdingsRecordId', how='inner')
-                            
-                            # Process the contributors field
-                            final_df['contributors'] = final_df['contributors'].apply(lambda x: x[0]['name'] if isinstance(x, list) and x else '')
-                            
-                            # Process publication data
-                            final_df['publisher'] = ''
-                            final_df['place'] = ''
-                            final_df['dateOfPublication'] = ''
-                            
-                            for idx, row in final_df.iterrows():
-                                pub_info = parse_publication_info_adaptive(row['publication'])
-                                final_df.at[idx, 'publisher'] = pub_info[0]
-                                final_df.at[idx, 'place'] = pub_info[1]
-                                final_df.at[idx, 'dateOfPublication'] = pub_info[2]
-                            
-                            # Extract alternative title
-                            final_df["alternativeTitleExtracted"] = final_df["alternativeTitles"].apply(extract_alternative_title)
-                            
-                            # Extract ISBN
-                            final_df["ISBN"] = final_df["identifiers"].apply(extract_vtls020)
-                            
-                            # Extract and process notes
-                            final_df["itemNotes"] = final_df["notes"].apply(extract_and_concatenate_notes)
-                            
-                            location_name = df_location.set_index('id')['name']
-
-
-                            # In[31]:
-
-
-                            final_df['holding_location_name'] = final_df['permanentLocationId_x'].map(location_name)
-
-
-                            # In[32]:
-
-
-                            final_df['item_location_name'] = final_df['effectiveLocationId_y'].map(location_name)
-
-
-                            # In[33]:
-
-
-                            material_types = df_mtypes.set_index('id')['name']
-
-
-                            # In[34]:
-
-
-                            final_df['Material_name'] = final_df['materialTypeId'].map(material_types)
-
-
-                            # In[35]:
-
-
-                            statistical_types = df_statcode.set_index('id')['name']
-
-
-                            # In[36]:
-
-
-                            final_df['statisticalCodeIds'] = final_df['statisticalCodeIds'].apply(lambda x: ','.join(map(str, x)))
-
-
-                            # In[37]:
-
-
-                            final_df['Statistical_code'] = final_df['statisticalCodeIds'].map(statistical_types)
-
-                            
-                            # Process user IDs to get usernames
-                            final_df = process_user_ids(final_df, st.session_state.okapi_url, header_dict)
-                            
-                            # Rename columns to user-friendly names
-                            column_renames = {
-                                'title': 'Title',
-                                'contributors': 'Author',
-                                'publisher': 'Publisher',
-                                'place': 'Place of Publication',
-                                'dateOfPublication': 'Publication Date',
-                                'ISBN': 'ISBN',
-                                'callNumber': 'Call Number',
-                                'barcode': 'Barcode',
-                                'status.name': 'Item Status',
-                                'locationName': 'Location',
-                                'materialTypeName': 'Material Type',
-                                'loanTypeName': 'Loan Type',
-                                'itemNotes': 'Notes',
-                                'alternativeTitleExtracted': 'Alternative Title',
-                                'instance_creator_name': 'Instance Creator',
-                                'instance_updater_name': 'Instance Updater',
-                                'holding_creator_name': 'Holding Creator',
-                                'holding_updater_name': 'Holding Updater',
-                                'item_creator_name': 'Item Creator',
-                                'item_updater_name': 'Item Updater'
-                            }
-                            
-                            # Apply column renames where the columns exist
-                            for old_name, new_name in column_renames.items():
-                                if old_name in final_df.columns:
-                                    final_df.rename(columns={old_name: new_name}, inplace=True)
-                            
-                            # Store the final dataframe in session state
-                            st.session_state.final_df = final_df
-                            st.session_state.data_loaded = True
-                            
-                            # Select columns to display by default
-                            display_columns = [col for col in column_renames.values() if col in final_df.columns]
-                            st.session_state.display_columns = display_columns
-                            st.success("Data successfully loaded and processed!")
-                            st.experimental_rerun()
-                
-                except Exception as e:
-                    st.error(f"Error loading data: {str(e)}")
+                    start_bibliographic_load(st.session_state.okapi_url, header_dict, st.session_state.load_scope)
+                    st.experimental_rerun()
         else:
             # Data is loaded, display the DataFrame with filter controls
             st.subheader("Bibliographic Data")
+            scope_text = describe_scope(st.session_state.get('report_scope'), ['locations', 'material_types'])
+            if scope_text:
+                st.caption(f"Scoped load: {scope_text}")
+            
+            # Refresh only the records changed in Medad since the last harvest, in the background
+            refresh_job = find_load_job('refresh')
+            if refresh_job is not None and refresh_job.running:
+                show_load_job(refresh_job, "bibliographic_refresh_cancel_button")
+            else:
+                show_load_job_outcome(refresh_job, "Error refreshing data")
+                if st.button("Refresh Changed Records", key="bibliographic_refresh_button",
+                             help="Fetch only the instances, holdings and items updated since the last harvest. Deleted records are removed by Reset All Data with a cleared snapshot."):
+                    header_dict = {
+                        "x-okapi-tenant": st.session_state.tenant,
+                        "x-okapi-token": st.session_state.token
+                    }
+                    start_refresh_load(st.session_state.okapi_url, header_dict, st.session_state.final_df,
+                                       st.session_state.get('report_scope'))
+                    st.experimental_rerun()
             
             # Get the DataFrame from session state
             df = st.session_state.final_df
             
             # Select columns to display
-            all_columns = df.columns.tolist()
+            all_columns = visible_columns(df)
             
             with st.expander("Select columns to display", expanded=False):
                 selected_columns = st.multiselect(
@@ -661,8 +3373,61 @@ if st.session_state.logged_in:
             # Filter controls
             st.subheader("Bibliographic Report Filters")
             
-            # Create a filtered copy of the DataFrame to preserve the original
-            filtered_df = df.copy()
+            # Narrow the matching rows through the filter index instead of copying the DataFrame
+            index = st.session_state.report_index
+            chain = FilterChain(index, st.session_state.filter_cache)
+            
+            # Text search over titles, authors, publishers and call numbers
+            search_col1, search_col2 = st.columns([3, 1])
+            with search_col1:
+                search_query = st.text_input(
+                    "Search",
+                    placeholder="Title, alternative title, author, publisher or call number",
+                    key="bibliographic_search"
+                )
+            with search_col2:
+                search_mode = st.radio("Match words", ["Containing", "Starting with"], key="bibliographic_search_mode")
+            if normalize_search_text(search_query):
+                chain.search(st.session_state.search_index, search_query, prefix=search_mode == "Starting with")
+                st.caption(f"{chain.count():,} records match the search.")
+            
+            # Bulk lookup of pasted or uploaded barcodes, ISBNs or call numbers
+            with st.expander("Bulk Lookup", expanded=False):
+                lookup_col1, lookup_col2 = st.columns([1, 3])
+                with lookup_col1:
+                    lookup_column = st.radio("Match against", LOOKUP_COLUMNS, key="bulk_lookup_column")
+                with lookup_col2:
+                    lookup_text = st.text_area("Paste identifiers", height=100, key="bulk_lookup_text",
+                                               help="Barcodes and ISBNs may be separated by new lines, spaces, commas or semicolons; call numbers go one per line.")
+                    lookup_file = st.file_uploader("Or upload a text or CSV file", type=["txt", "csv"], key="bulk_lookup_file")
+                
+                lookup_apply_col, lookup_clear_col = st.columns([1, 3])
+                with lookup_apply_col:
+                    lookup_button = st.button("Look Up", key="bulk_lookup_button")
+                with lookup_clear_col:
+                    lookup_clear_button = st.button("Clear Lookup", key="bulk_lookup_clear_button")
+                
+                # The applied list stays in effect until it is cleared or replaced
+                if lookup_button:
+                    if lookup_file is not None:
+                        lookup_values = read_lookup_file(lookup_file.getvalue(), lookup_file.name, lookup_column)
+                    else:
+                        lookup_values = parse_lookup_list(lookup_text, lookup_column)
+                    st.session_state.bulk_lookup = (lookup_column, tuple(lookup_values))
+                if lookup_clear_button:
+                    st.session_state.bulk_lookup = None
+                
+                if st.session_state.get('bulk_lookup') and st.session_state.bulk_lookup[0] in st.session_state.lookup_index:
+                    lookup_column, lookup_values = st.session_state.bulk_lookup
+                    lookup_rows, not_found = st.session_state.lookup_index.lookup(lookup_column, lookup_values)
+                    lookup_digest = hashlib.sha1('\n'.join(lookup_values).encode('utf-8')).hexdigest()
+                    chain.restrict(lookup_rows, step=('lookup', lookup_column, lookup_digest))
+                    st.success(f"{len(lookup_rows):,} records match the {len(lookup_values):,} identifiers looked up.")
+                    if not_found:
+                        st.warning(f"{len(not_found):,} identifiers were not found.")
+                        st.dataframe(pd.DataFrame({lookup_column: not_found}), use_container_width=True, height=200)
+                        st.download_button("Download Not Found List", '\n'.join(not_found),
+                                           file_name="not_found.txt", mime="text/plain", key="bulk_lookup_not_found")
             
             # Location and Material Type Filters
             with st.expander("Location & Material Filters", expanded=True):
@@ -671,51 +3436,55 @@ if st.session_state.logged_in:
                 
                 with loc_col1:
                     # Holding location filter
-                    if 'holding_location_name' in filtered_df.columns:
+                    if 'holding_location_name' in index:
                         location_col = 'holding_location_name'
-                        holding_locations = sorted(filtered_df[location_col].dropna().unique().tolist())
+                        holding_locations = chain.facet(location_col)
                         selected_holding_location = st.selectbox(
                             "Holding Location",
-                            options=["All"] + holding_locations,
+                            options=["All"] + list(holding_locations),
+                            format_func=facet_label(holding_locations),
                             key="filter_holding_location"
                         )
                         if selected_holding_location != "All":
-                            filtered_df = filtered_df[filtered_df[location_col] == selected_holding_location]
+                            chain.equals(location_col, selected_holding_location)
                     
                     # Item location filter (if different from holding location)
-                    if 'item_location_name' in filtered_df.columns:
+                    if 'item_location_name' in index:
                         item_location_col = 'item_location_name'
-                        item_locations = sorted(filtered_df[item_location_col].dropna().unique().tolist())
+                        item_locations = chain.facet(item_location_col)
                         selected_item_location = st.selectbox(
                             "Item Location",
-                            options=["All"] + item_locations,
+                            options=["All"] + list(item_locations),
+                            format_func=facet_label(item_locations),
                             key="filter_item_location"
                         )
                         if selected_item_location != "All":
-                            filtered_df = filtered_df[filtered_df[item_location_col] == selected_item_location]
+                            chain.equals(item_location_col, selected_item_location)
                 
                 with loc_col2:
                     # Material name filter
-                    if 'Material_name' in filtered_df.columns:
-                        material_types = sorted(filtered_df['Material_name'].dropna().unique().tolist())
+                    if 'Material_name' in index:
+                        material_types = chain.facet('Material_name')
                         selected_material = st.selectbox(
                             "Material Type",
-                            options=["All"] + material_types,
+                            options=["All"] + list(material_types),
+                            format_func=facet_label(material_types),
                             key="filter_material_type"
                         )
                         if selected_material != "All":
-                            filtered_df = filtered_df[filtered_df['Material_name'] == selected_material]
+                            chain.equals('Material_name', selected_material)
                     
                     # Item status filter
-                    if 'Item Status' in filtered_df.columns:
-                        item_statuses = sorted(filtered_df['Item Status'].dropna().unique().tolist())
+                    if 'Item Status' in index:
+                        item_statuses = chain.facet('Item Status')
                         selected_status = st.selectbox(
                             "Item Status",
-                            options=["All"] + item_statuses,
+                            options=["All"] + list(item_statuses),
+                            format_func=facet_label(item_statuses),
                             key="filter_item_status"
                         )
                         if selected_status != "All":
-                            filtered_df = filtered_df[filtered_df['status.name'] == selected_status]
+                            chain.equals('Item Status', selected_status)
             
             # Statistical Codes and Discovery Settings
             with st.expander("Statistical Codes & Discovery Settings", expanded=True):
@@ -724,27 +3493,26 @@ if st.session_state.logged_in:
                 
                 with code_col1:
                     # Statistical code filter
-                    if 'Statistical_code' in filtered_df.columns:
+                    if 'Statistical_code' in index:
                         # Get unique values for the statistical code
-                        stat_codes = sorted(filtered_df['Statistical_code'].dropna().unique().tolist())
+                        stat_codes = chain.facet('Statistical_code')
                         
                         # Add options for All and No Value
-                        filter_options = ["All", "No Statistical Code"] + stat_codes
+                        filter_options = ["All", "No Statistical Code"] + list(stat_codes)
                         
                         selected_stat_code = st.selectbox(
                             "Statistical Code",
                             options=filter_options,
+                            format_func=facet_label(stat_codes),
                             key="filter_stat_code"
                         )
                         
                         if selected_stat_code == "No Statistical Code":
                             # Filter for empty or null values
-                            filtered_df = filtered_df[filtered_df['Statistical_code'].isna() | 
-                                                   (filtered_df['Statistical_code'] == '') | 
-                                                   (filtered_df['Statistical_code'].astype(str) == 'nan')]
+                            chain.missing('Statistical_code')
                         elif selected_stat_code != "All":
                             # Simple direct filter
-                            filtered_df = filtered_df[filtered_df['Statistical_code'] == selected_stat_code]
+                            chain.equals('Statistical_code', selected_stat_code)
                 
                 with code_col2:
                     # Discovery suppress filters
@@ -753,32 +3521,32 @@ if st.session_state.logged_in:
                     
                     with suppress_col1:
                         # Discovery suppress from instance filter
-                        if 'discoverySuppress_x' in filtered_df.columns:
+                        if 'discoverySuppress_x' in index:
                             discovery_suppress_instance = st.checkbox(
                                 "Suppress - Instance",
                                 key="filter_discovery_suppress_instance"
                             )
                             if discovery_suppress_instance:
-                                filtered_df = filtered_df[filtered_df['discoverySuppress_x'] == True]
+                                chain.equals('discoverySuppress_x', True)
                         
                         # Discovery suppress from holding filter
-                        if 'discoverySuppress_y' in filtered_df.columns:
+                        if 'discoverySuppress_y' in index:
                             discovery_suppress_holding = st.checkbox(
                                 "Suppress - Holdings",
                                 key="filter_discovery_suppress_holding"
                             )
                             if discovery_suppress_holding:
-                                filtered_df = filtered_df[filtered_df['discoverySuppress_y'] == True]
+                                chain.equals('discoverySuppress_y', True)
                     
                     with suppress_col2:
                         # Discovery suppress from item filter
-                        if 'discoverySuppress' in filtered_df.columns:
+                        if 'discoverySuppress' in index:
                             discovery_suppress_item = st.checkbox(
                                 "Suppress - Item",
                                 key="filter_discovery_suppress_item"
                             )
                             if discovery_suppress_item:
-                                filtered_df = filtered_df[filtered_df['discoverySuppress'] == True]
+                                chain.equals('discoverySuppress', True)
             
             # User Activity Filters
             with st.expander("User Activity Filters", expanded=False):
@@ -790,27 +3558,29 @@ if st.session_state.logged_in:
                 
                 with instance_col1:
                     # Instance Creator filter
-                    if 'Instance Creator' in filtered_df.columns:
-                        creators = sorted(filtered_df['Instance Creator'].dropna().unique().tolist())
+                    if 'Instance Creator' in index:
+                        creators = chain.facet('Instance Creator')
                         selected_creator = st.selectbox(
                             "Created By",
-                            options=["All"] + creators,
+                            options=["All"] + list(creators),
+                            format_func=facet_label(creators),
                             key="filter_instance_creator"
                         )
                         if selected_creator != "All":
-                            filtered_df = filtered_df[filtered_df['Instance Creator'] == selected_creator]
+                            chain.equals('Instance Creator', selected_creator)
                 
                 with instance_col2:
                     # Instance Updater filter
-                    if 'Instance Updater' in filtered_df.columns:
-                        updaters = sorted(filtered_df['Instance Updater'].dropna().unique().tolist())
+                    if 'Instance Updater' in index:
+                        updaters = chain.facet('Instance Updater')
                         selected_updater = st.selectbox(
                             "Updated By",
-                            options=["All"] + updaters,
+                            options=["All"] + list(updaters),
+                            format_func=facet_label(updaters),
                             key="filter_instance_updater"
                         )
                         if selected_updater != "All":
-                            filtered_df = filtered_df[filtered_df['Instance Updater'] == selected_updater]
+                            chain.equals('Instance Updater', selected_updater)
                 
                 # Holdings creators/updaters
                 st.markdown("#### Holdings")
@@ -818,27 +3588,29 @@ if st.session_state.logged_in:
                 
                 with holdings_col1:
                     # Holding Creator filter
-                    if 'Holding Creator' in filtered_df.columns:
-                        h_creators = sorted(filtered_df['Holding Creator'].dropna().unique().tolist())
+                    if 'Holding Creator' in index:
+                        h_creators = chain.facet('Holding Creator')
                         selected_h_creator = st.selectbox(
                             "Created By",
-                            options=["All"] + h_creators,
+                            options=["All"] + list(h_creators),
+                            format_func=facet_label(h_creators),
                             key="filter_holding_creator"
                         )
                         if selected_h_creator != "All":
-                            filtered_df = filtered_df[filtered_df['Holding Creator'] == selected_h_creator]
+                            chain.equals('Holding Creator', selected_h_creator)
                 
                 with holdings_col2:
                     # Holding Updater filter
-                    if 'Holding Updater' in filtered_df.columns:
-                        h_updaters = sorted(filtered_df['Holding Updater'].dropna().unique().tolist())
+                    if 'Holding Updater' in index:
+                        h_updaters = chain.facet('Holding Updater')
                         selected_h_updater = st.selectbox(
                             "Updated By",
-                            options=["All"] + h_updaters,
+                            options=["All"] + list(h_updaters),
+                            format_func=facet_label(h_updaters),
                             key="filter_holding_updater"
                         )
                         if selected_h_updater != "All":
-                            filtered_df = filtered_df[filtered_df['Holding Updater'] == selected_h_updater]
+                            chain.equals('Holding Updater', selected_h_updater)
                 
                 # Item creators/updaters
                 st.markdown("#### Item")
@@ -846,27 +3618,29 @@ if st.session_state.logged_in:
                 
                 with item_col1:
                     # Item Creator filter
-                    if 'Item Creator' in filtered_df.columns:
-                        i_creators = sorted(filtered_df['Item Creator'].dropna().unique().tolist())
+                    if 'Item Creator' in index:
+                        i_creators = chain.facet('Item Creator')
                         selected_i_creator = st.selectbox(
                             "Created By",
-                            options=["All"] + i_creators,
+                            options=["All"] + list(i_creators),
+                            format_func=facet_label(i_creators),
                             key="filter_item_creator"
                         )
                         if selected_i_creator != "All":
-                            filtered_df = filtered_df[filtered_df['Item Creator'] == selected_i_creator]
+                            chain.equals('Item Creator', selected_i_creator)
                 
                 with item_col2:
                     # Item Updater filter
-                    if 'Item Updater' in filtered_df.columns:
-                        i_updaters = sorted(filtered_df['Item Updater'].dropna().unique().tolist())
+                    if 'Item Updater' in index:
+                        i_updaters = chain.facet('Item Updater')
                         selected_i_updater = st.selectbox(
                             "Updated By",
-                            options=["All"] + i_updaters,
+                            options=["All"] + list(i_updaters),
+                            format_func=facet_label(i_updaters),
                             key="filter_item_updater"
                         )
                         if selected_i_updater != "All":
-                            filtered_df = filtered_df[filtered_df['Item Updater'] == selected_i_updater]
+                            chain.equals('Item Updater', selected_i_updater)
             
 
 
@@ -878,124 +3652,85 @@ if st.session_state.logged_in:
                 st.markdown("### Advanced Filtering")
                 
                 st.info("""
-                Enter Python code to filter the dataframe. Your code should be a condition that would go inside df[] brackets.
+                Enter a filter expression on the report columns. Column names with spaces go in backticks.
                 
-                **Available variables:**
-                - `df`: The current filtered dataframe
+                **Operators:** `=` `!=` `<` `<=` `>` `>=`, `contains`, `startswith`, `endswith` (case-insensitive),
+                `between ... and ...`, `in (...)`, `not in (...)`, `is empty`, `is not empty`, combined with `and`, `or`, `not` and parentheses.
+                Dates are written `date '2023-01-31'` and cover the whole day.
                 
                 **Examples:**
-                - `df['Title'].str.contains('Python')`
-                - `(df['Publication Date'] > '2010') & (df['Item Status'] == 'Available')`
-                - `df['Barcode'].str.startswith('123')`
+                - `Title contains 'Python'`
+                - `` `Publication Date` > '2010' and `Item Status` = 'Available' ``
+                - `Barcode startswith '123'`
+                - `` `metadata.createdDate` between date '2023-01-01' and date '2023-06-30' ``
                 """)
                 
-                code_filter = st.text_area("Python Filter Code", 
-                                           placeholder="Example: df['Title'].str.contains('Python', case=False)",
+                code_filter = st.text_area("Filter Expression", 
+                                           placeholder="Example: Title contains 'Python'",
                                            height=100,
                                            key="advanced_filter_code")
                 
                 apply_col1, apply_col2 = st.columns([1, 3])
                 with apply_col1:
                     apply_button = st.button("Apply Filter", key="advanced_filter_button")
+                with apply_col2:
+                    clear_button = st.button("Clear Filter", key="advanced_filter_clear_button")
                 
-                if apply_button and code_filter.strip():
+                # The applied expression stays in effect until it is cleared or replaced
+                if apply_button:
+                    st.session_state.advanced_filter = code_filter.strip()
+                if clear_button:
+                    st.session_state.advanced_filter = ""
+                
+                if st.session_state.get('advanced_filter'):
                     try:
-                        # Create a local copy of the filtered dataframe for the variable name to work
-                        df_for_eval = filtered_df.copy()
-                        
-                        # Execute the filter code
-                        filter_result = eval(code_filter)
-                        
-                        # Check if result is a valid boolean Series or mask
-                        if isinstance(filter_result, pd.Series) and filter_result.dtype == bool:
-                            # Apply the filter
-                            filtered_df = filtered_df[filter_result]
-                            st.success(f"Advanced filter applied successfully. {len(filtered_df)} records match.")
-                        else:
-                            st.error("Filter code must return a boolean Series (condition that can go inside df[])")
+                        # Compiled once per expression; only the columns it reads are materialized
+                        plan = compile_filter_expression(st.session_state.advanced_filter)
+                        plan.check(visible_columns(df))
+                        chain.mask(lambda: plan.mask(chain.take(df, plan.columns)), step=('expression', plan.key))
+                        st.success(f"Advanced filter applied successfully. {chain.count()} records match.")
                     except Exception as e:
-                        st.error(f"Error in filter code: {str(e)}")
+                        st.error(f"Error in filter expression: {str(e)}")
             
             # Tags filter
-            if 'tags.tagList' in filtered_df.columns:
-                # Extract all unique tags from the tagList columns which might contain lists
-                all_tags = []
-                for tags in filtered_df['tags.tagList'].dropna():
-                    if isinstance(tags, list):
-                        all_tags.extend(tags)
-                    elif isinstance(tags, str):
-                        # Handle case where tags might be a string representation of a list
-                        try:
-                            tag_list = ast.literal_eval(tags)
-                            if isinstance(tag_list, list):
-                                all_tags.extend(tag_list)
-                        except (ValueError, SyntaxError):
-                            # If not a valid list representation, treat as a single tag
-                            all_tags.append(tags)
-                
-                unique_tags = sorted(set(all_tags))
-                selected_tags = st.multiselect("Tags", unique_tags)
+            if 'tags.tagList' in index:
+                # Tags present in the selected rows, read from the inverted tag index
+                tag_counts = chain.tag_facet('tags.tagList')
+                selected_tags = st.multiselect("Tags", list(tag_counts), format_func=facet_label(tag_counts))
+                tag_match = st.radio("Match", ["Any selected tag", "All selected tags"], horizontal=True, key="tag_match")
                 
                 if selected_tags:
-                    # Filter rows where any of the selected tags are present
-                    def check_tags(x):
-                        # Handle NaN values
-                        if x is None or (hasattr(x, 'isna') and x.isna().any()):
-                            return False
-                        
-                        tag_list = []
-                        try:
-                            if isinstance(x, list):
-                                tag_list = x
-                            elif isinstance(x, str) and x.strip():
-                                try:
-                                    parsed = ast.literal_eval(x)
-                                    if isinstance(parsed, list):
-                                        tag_list = parsed
-                                    else:
-                                        tag_list = [x]
-                                except (ValueError, SyntaxError):
-                                    tag_list = [x]
-                            
-                            return any(tag in tag_list for tag in selected_tags)
-                        except:
-                            # If any error occurs, assume no match
-                            return False
-                        
-                    filtered_df = filtered_df[filtered_df['tags.tagList'].apply(check_tags)]
+                    # Filter rows carrying any (or all) of the selected tags
+                    chain.tagged('tags.tagList', selected_tags, match_all=tag_match == "All selected tags")
             
             # Show a sample of the filtered dataframe (10 records)
             st.subheader("Data Preview (Sample)")
-            st.dataframe(filtered_df[selected_columns].head(10), use_container_width=True)
-            st.info(f"Showing 10 records as sample. Total filtered records: {len(filtered_df)} out of {len(df)} total records")
+            st.dataframe(chain.take(df, selected_columns, limit=10), use_container_width=True)
+            st.info(f"Showing 10 records as sample. Total filtered records: {chain.count()} out of {len(df)} total records")
             
             # Export options
             st.subheader("Export Data")
             
-            export_format = st.radio("Export format", ["CSV", "Excel"], key="export_format")
+            export_format = st.radio("Export format", list(EXPORT_EXTENSIONS), key="export_format")
             
             if export_format == "CSV":
                 # Add delimiter option for CSV
                 csv_delimiter = st.text_input("CSV Delimiter", value=",", max_chars=1, key="csv_delimiter")
                 if not csv_delimiter:  # Default to comma if empty
                     csv_delimiter = ","
+                compress_export = st.checkbox("Compress (gzip)", key="csv_gzip")
             
             if st.button("Export", key="export_button"):
-                if export_format == "CSV":
-                    csv = filtered_df[selected_columns].to_csv(index=False, sep=csv_delimiter)
-                    b64 = base64.b64encode(csv.encode()).decode()
-                    href = f'<a href="data:file/csv;base64,{b64}" download="bibliographic_report.csv">Download CSV File</a>'
-                    st.markdown(href, unsafe_allow_html=True)
-                else:  # Excel
-                    output = io.BytesIO()
-                    with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-                        filtered_df[selected_columns].to_excel(writer, index=False, sheet_name='Bibliographic Report')
-                    excel_data = output.getvalue()
-                    b64 = base64.b64encode(excel_data).decode()
-                    href = f'<a href="data:application/vnd.openxmlformats-officedocument.spreadsheetml.sheet;base64,{b64}" download="bibliographic_report.xlsx">Download Excel File</a>'
-                    st.markdown(href, unsafe_allow_html=True)
-                
-                st.success(f"Export complete! {len(filtered_df)} records exported.")
+                # Written chunk by chunk to a file served for download, instead of an in-page data URI
+                with st.spinner("Writing export file..."):
+                    file_name, download_name = export_report(
+                        chain, df, selected_columns, export_format, "bibliographic_report", "Bibliographic Report",
+                        csv_delimiter=csv_delimiter if export_format == "CSV" else ",",
+                        compress=export_format == "CSV" and compress_export
+                    )
+                # Kept in the session, so the link outlives the reruns that follow
+                st.session_state.bibliographic_export = (file_name, download_name, export_format, chain.count())
+            show_last_export("bibliographic_export", "export_download")
             
             # Export data section ends here
     
@@ -1007,61 +3742,32 @@ if st.session_state.logged_in:
             st.session_state.circulation_data_loaded = False
         
         if not st.session_state.circulation_data_loaded:
-            if st.button("Load Circulation Data", key="circulation_load_button"):
-                try:
+            job = find_load_job('circulation')
+            if job is not None and job.running:
+                show_load_job(job, "circulation_cancel_button")
+            else:
+                show_load_job_outcome(job, "Error loading circulation data")
+                if st.button("Load Circulation Data", key="circulation_load_button"):
                     # Set up header for API calls
                     header_dict = {
                         "x-okapi-tenant": st.session_state.tenant,
                         "x-okapi-token": st.session_state.token
                     }
                     
-                    with st.spinner("Loading circulation data from Medad..."):
-                        # Get loans data
-                        df_loans = get_loans(st.session_state.okapi_url, header_dict)
-                        st.success("✅ Loans data loaded")
-                        
-                        # Get users data
-                        df_users = get_users(st.session_state.okapi_url, header_dict)
-                        st.success("✅ Users data loaded")
-                        
-                        # Get fines data
-                        df_fines = get_fines(st.session_state.okapi_url, header_dict)
-                        st.success("✅ Fines data loaded")
-                        
-                        # Get patron groups
-                        patron_groups = get_patron_groups(st.session_state.okapi_url, header_dict)
-                        st.success("✅ Patron groups loaded")
-                        
-                        # Merge loans with users
-                        if not df_loans.empty and not df_users.empty:
-                            merged_df = df_loans.merge(df_users, how='inner', left_on='userId', right_on='id', suffixes=('_Loans', '_Users'))
-                            st.success("✅ Merged loans and users data")
-                            
-                            # Add patron group names
-                            if patron_groups and 'patronGroup' in merged_df.columns:
-                                # Create a new column with patron group names
-                                merged_df['patronGroupName'] = merged_df['patronGroup'].map(patron_groups)
-                                # For any missing mappings, keep the original ID
-                                merged_df['patronGroupName'] = merged_df['patronGroupName'].fillna(merged_df['patronGroup'])
-                        else:
-                            st.warning("Could not merge loans and users data due to empty dataframes")
-                            merged_df = pd.DataFrame()
-                        
-                        # Store data in session state
-                        st.session_state.circulation_df = merged_df
-                        st.session_state.fines_df = df_fines
-                        st.session_state.patron_groups = patron_groups  # Store for later use
-                        st.session_state.circulation_data_loaded = True
-                    st.success("Circulation data successfully loaded and processed!")
+                    # Loans joined with their users, the fines and the patron group names
+                    start_circulation_load(st.session_state.okapi_url, header_dict, st.session_state.load_scope)
                     st.experimental_rerun()
-                    
-                except Exception as e:
-                    st.error(f"Error loading circulation data: {str(e)}")
         else:
             # Data is loaded, display the DataFrame with filter controls
             if 'circulation_df' in st.session_state and not st.session_state.circulation_df.empty:
-                # Get the DataFrame from session state
-                filtered_df = st.session_state.circulation_df.copy()
+                # Get the DataFrame and its filter index from session state
+                df = st.session_state.circulation_df
+                index = st.session_state.circulation_index
+                chain = FilterChain(index, st.session_state.filter_cache)
+                
+                scope_text = describe_scope(st.session_state.get('circulation_scope'), ['locations', 'patron_groups'], loans=True)
+                if scope_text:
+                    st.caption(f"Scoped load: {scope_text}")
                 
                 st.subheader("Circulation Report Filters")
                 
@@ -1072,14 +3778,11 @@ if st.session_state.logged_in:
                     
                     # Display date range filters
                     with date_col1:
-                        if 'loanDate' in filtered_df.columns:
-                            # Convert to datetime if not already, and handle timezone information
-                            if filtered_df['loanDate'].dtype != 'datetime64[ns]':
-                                filtered_df['loanDate'] = pd.to_datetime(filtered_df['loanDate'], errors='coerce', utc=True)
-                            
+                        if 'loanDate' in index:
                             # Get min and max dates
-                            min_date = filtered_df['loanDate'].min().date() if not filtered_df['loanDate'].isna().all() else datetime.date.today()
-                            max_date = filtered_df['loanDate'].max().date() if not filtered_df['loanDate'].isna().all() else datetime.date.today()
+                            loan_dates = chain.extent('loanDate')
+                            min_date = pd.Timestamp(loan_dates[0]).date() if loan_dates else datetime.date.today()
+                            max_date = pd.Timestamp(loan_dates[1]).date() if loan_dates else datetime.date.today()
                             
                             # Date range picker
                             loan_date_range = st.date_input(
@@ -1096,20 +3799,16 @@ if st.session_state.logged_in:
                                 start_date = pd.Timestamp(start_date).tz_localize('UTC')
                                 end_date = (pd.Timestamp(end_date) + pd.Timedelta(days=1) - pd.Timedelta(seconds=1)).tz_localize('UTC')
                                 # Apply filter
-                                filtered_df = filtered_df[(filtered_df['loanDate'] >= start_date) & 
-                                                       (filtered_df['loanDate'] <= end_date)]
+                                chain.within('loanDate', start_date, end_date)
                     
                     with date_col2:
-                        if 'returnDate' in filtered_df.columns:
-                            # Convert to datetime if not already, and handle timezone information
-                            if filtered_df['returnDate'].dtype != 'datetime64[ns]':
-                                filtered_df['returnDate'] = pd.to_datetime(filtered_df['returnDate'], errors='coerce', utc=True)
-                            
+                        if 'returnDate' in index:
                             # Only proceed if there are valid dates
-                            if not filtered_df['returnDate'].isna().all():
+                            return_dates = chain.extent('returnDate')
+                            if return_dates:
                                 # Get min and max dates
-                                min_date = filtered_df['returnDate'].min().date()
-                                max_date = filtered_df['returnDate'].max().date()
+                                min_date = pd.Timestamp(return_dates[0]).date()
+                                max_date = pd.Timestamp(return_dates[1]).date()
                                 
                                 # Date range picker
                                 checkin_date_range = st.date_input(
@@ -1126,8 +3825,7 @@ if st.session_state.logged_in:
                                     start_date = pd.Timestamp(start_date).tz_localize('UTC')
                                     end_date = (pd.Timestamp(end_date) + pd.Timedelta(days=1) - pd.Timedelta(seconds=1)).tz_localize('UTC')
                                     # Apply filter
-                                    filtered_df = filtered_df[(filtered_df['returnDate'] >= start_date) & 
-                                                            (filtered_df['returnDate'] <= end_date)]
+                                    chain.within('returnDate', start_date, end_date)
                 
                 # Create collapsible section for item and circulation filters
                 with st.expander("Item & Circulation Filters", expanded=True):
@@ -1136,27 +3834,27 @@ if st.session_state.logged_in:
                     
                     with circ_col1:
                         # Circulation Action filter
-                        if 'action' in filtered_df.columns:
-                            action_values = sorted(filtered_df['action'].dropna().unique().tolist())
-                            selected_action = st.multiselect("Circulation Action", action_values)
+                        if 'action' in index:
+                            action_values = chain.facet('action')
+                            selected_action = st.multiselect("Circulation Action", list(action_values), format_func=facet_label(action_values))
                             if selected_action:
-                                filtered_df = filtered_df[filtered_df['action'].isin(selected_action)]
+                                chain.isin('action', selected_action)
                     
                     with circ_col2:
                         # Circulation Status filter
-                        if 'status.name' in filtered_df.columns:
-                            status_values = sorted(filtered_df['status.name'].dropna().unique().tolist())
-                            selected_status = st.multiselect("Circulation Status", status_values)
+                        if 'status.name' in index:
+                            status_values = chain.facet('status.name')
+                            selected_status = st.multiselect("Circulation Status", list(status_values), format_func=facet_label(status_values))
                             if selected_status:
-                                filtered_df = filtered_df[filtered_df['status.name'].isin(selected_status)]
+                                chain.isin('status.name', selected_status)
                     
                     with circ_col3:
                         # Material Type filter
-                        if 'materialType.name' in filtered_df.columns:
-                            material_values = sorted(filtered_df['materialType.name'].dropna().unique().tolist())
-                            selected_material = st.multiselect("Material Type", material_values)
+                        if 'materialType.name' in index:
+                            material_values = chain.facet('materialType.name')
+                            selected_material = st.multiselect("Material Type", list(material_values), format_func=facet_label(material_values))
                             if selected_material:
-                                filtered_df = filtered_df[filtered_df['materialType.name'].isin(selected_material)]
+                                chain.isin('materialType.name', selected_material)
                 
                 # Create collapsible section for patron and location filters
                 with st.expander("Patron & Location Filters", expanded=True):
@@ -1165,19 +3863,19 @@ if st.session_state.logged_in:
                     
                     with patron_col1:
                         # Patron Group filter
-                        if 'patronGroupName' in filtered_df.columns:
-                            patron_values = sorted(filtered_df['patronGroupName'].dropna().unique().tolist())
-                            selected_patron = st.multiselect("Patron Group", patron_values)
+                        if 'patronGroupName' in index:
+                            patron_values = chain.facet('patronGroupName')
+                            selected_patron = st.multiselect("Patron Group", list(patron_values), format_func=facet_label(patron_values))
                             if selected_patron:
-                                filtered_df = filtered_df[filtered_df['patronGroupName'].isin(selected_patron)]
+                                chain.isin('patronGroupName', selected_patron)
                     
                     with patron_col2:
                         # Item Location filter
-                        if 'location.name' in filtered_df.columns:
-                            location_values = sorted(filtered_df['location.name'].dropna().unique().tolist())
-                            selected_location = st.multiselect("Item Location", location_values)
+                        if 'location.name' in index:
+                            location_values = chain.facet('location.name')
+                            selected_location = st.multiselect("Item Location", list(location_values), format_func=facet_label(location_values))
                             if selected_location:
-                                filtered_df = filtered_df[filtered_df['location.name'].isin(selected_location)]
+                                chain.isin('location.name', selected_location)
                 
                 # Create collapsible section for financial filters
                 with st.expander("Financial Filters", expanded=False):
@@ -1188,10 +3886,10 @@ if st.session_state.logged_in:
                         # Fine Status filter
                         # Using fines data from session state
                         if 'fines_df' in st.session_state and not st.session_state.fines_df.empty:
-                            if 'feeFineOwner' in st.session_state.fines_df:
-                                fine_values = sorted(st.session_state.fines_df['feeFineOwner'].dropna().unique().tolist())
-                                selected_fine = st.multiselect("Fine Status", fine_values)
-                                if selected_fine and 'id_Loans' in filtered_df.columns:
+                            if 'feeFineOwner' in st.session_state.fines_index:
+                                fine_values = FilterChain(st.session_state.fines_index, st.session_state.filter_cache).facet('feeFineOwner')
+                                selected_fine = st.multiselect("Fine Status", list(fine_values), format_func=facet_label(fine_values))
+                                if selected_fine and 'id_Loans' in df.columns:
                                     # This would require joining with fines data, simplified for now
                                     pass
                     
@@ -1199,71 +3897,31 @@ if st.session_state.logged_in:
                         # Payment Status filter
                         # Using fines data from session state
                         if 'fines_df' in st.session_state and not st.session_state.fines_df.empty:
-                            if 'paymentStatus.name' in st.session_state.fines_df:
-                                payment_values = sorted(st.session_state.fines_df['paymentStatus.name'].dropna().unique().tolist())
-                                selected_payment = st.multiselect("Payment Status", payment_values)
-                                if selected_payment and 'id_Loans' in filtered_df.columns:
+                            if 'paymentStatus.name' in st.session_state.fines_index:
+                                payment_values = FilterChain(st.session_state.fines_index, st.session_state.filter_cache).facet('paymentStatus.name')
+                                selected_payment = st.multiselect("Payment Status", list(payment_values), format_func=facet_label(payment_values))
+                                if selected_payment and 'id_Loans' in df.columns:
                                     # This would require joining with fines data, simplified for now
                                     pass
                 
                 # Create collapsible section for tags filter
                 with st.expander("Tags Filter", expanded=False):
                     # Tags filter
-                    if 'tags.tagList' in filtered_df.columns:
-                        # Extract all unique tags from the tagList columns which might contain lists
-                        all_tags = []
-                        for tags in filtered_df['tags.tagList'].dropna():
-                            if isinstance(tags, list):
-                                all_tags.extend(tags)
-                            elif isinstance(tags, str):
-                                # Handle case where tags might be a string representation of a list
-                                try:
-                                    tag_list = ast.literal_eval(tags)
-                                    if isinstance(tag_list, list):
-                                        all_tags.extend(tag_list)
-                                except (ValueError, SyntaxError):
-                                    # If not a valid list representation, treat as a single tag
-                                    all_tags.append(tags)
-                        
-                        unique_tags = sorted(set(all_tags))
-                        selected_tags = st.multiselect("Tags", unique_tags)
+                    if 'tags.tagList' in index:
+                        # Tags present in the selected rows, read from the inverted tag index
+                        tag_counts = chain.tag_facet('tags.tagList')
+                        selected_tags = st.multiselect("Tags", list(tag_counts), format_func=facet_label(tag_counts))
+                        tag_match = st.radio("Match", ["Any selected tag", "All selected tags"], horizontal=True, key="circ_tag_match")
                         
                         if selected_tags:
-                            # Filter rows where any of the selected tags are present
-                            def check_tags(x):
-                                # Handle NaN values
-                                if x is None or (hasattr(x, 'isna') and x.isna().any()):
-                                    return False
-                                
-                                tag_list = []
-                                try:
-                                    if isinstance(x, list):
-                                        tag_list = x
-                                    elif isinstance(x, str) and x.strip():
-                                        try:
-                                            parsed = ast.literal_eval(x)
-                                            if isinstance(parsed, list):
-                                                tag_list = parsed
-                                            else:
-                                                tag_list = [x]
-                                        except (ValueError, SyntaxError):
-                                            tag_list = [x]
-                                    
-                                    return any(tag in tag_list for tag in selected_tags)
-                                except:
-                                    # If any error occurs, assume no match
-                                    return False
-                            
-                            filtered_df = filtered_df[filtered_df['tags.tagList'].apply(check_tags)]
+                            # Filter rows carrying any (or all) of the selected tags
+                            chain.tagged('tags.tagList', selected_tags, match_all=tag_match == "All selected tags")
                 
                 st.markdown("---")
                 
                 # Column selection
-                all_columns = filtered_df.columns.tolist()
-                default_columns = ['loanDate', 'returnDate', 'action', 'status.name', 
-                                  'patronGroupName', 'materialType.name', 'location.name', 
-                                  'tags.tagList']
-                default_columns = [col for col in default_columns if col in all_columns]
+                all_columns = visible_columns(df)
+                default_columns = [col for col in CIRCULATION_DEFAULT_COLUMNS if col in all_columns]
                 
                 selected_columns = st.multiselect(
                     "Select columns to display",
@@ -1274,35 +3932,32 @@ if st.session_state.logged_in:
                 if selected_columns:
                     # Display only a sample of the filtered dataframe (10 records)
                     st.subheader("Data Preview (Sample)")
-                    st.dataframe(filtered_df[selected_columns].head(10))
-                    st.info(f"Showing 10 records as sample. Total filtered records: {len(filtered_df)} out of {len(st.session_state.circulation_df)} total records")
+                    st.dataframe(chain.take(df, selected_columns, limit=10))
+                    st.info(f"Showing 10 records as sample. Total filtered records: {chain.count()} out of {len(df)} total records")
                     
                     # Export functionality
                     st.subheader("Export Data")
                     
-                    export_format = st.radio("Export format", ["CSV", "Excel"], key="circ_export_format")
+                    export_format = st.radio("Export format", list(EXPORT_EXTENSIONS), key="circ_export_format")
                     
                     if export_format == "CSV":
                         # Add delimiter option for CSV
                         csv_delimiter = st.text_input("CSV Delimiter", value=",", max_chars=1, key="circ_csv_delimiter")
                         if not csv_delimiter:  # Default to comma if empty
                             csv_delimiter = ","
+                        compress_export = st.checkbox("Compress (gzip)", key="circ_csv_gzip")
                     
                     if st.button("Export", key="circ_export_button"):
-                        if export_format == "CSV":
-                            csv = filtered_df[selected_columns].to_csv(index=False, sep=csv_delimiter)
-                            b64 = base64.b64encode(csv.encode()).decode()
-                            href = f'<a href="data:file/csv;base64,{b64}" download="circulation_report.csv">Download CSV File</a>'
-                            st.markdown(href, unsafe_allow_html=True)
-                        else:  # Excel
-                            output = io.BytesIO()
-                            with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-                                filtered_df[selected_columns].to_excel(writer, sheet_name='Circulation Report', index=False)
-                            b64 = base64.b64encode(output.getvalue()).decode()
-                            href = f'<a href="data:application/vnd.openxmlformats-officedocument.spreadsheetml.sheet;base64,{b64}" download="circulation_report.xlsx">Download Excel File</a>'
-                            st.markdown(href, unsafe_allow_html=True)
-                        
-                        st.success(f"Export complete! {len(filtered_df)} records exported.")
+                        # Written chunk by chunk to a file served for download, instead of an in-page data URI
+                        with st.spinner("Writing export file..."):
+                            file_name, download_name = export_report(
+                                chain, df, selected_columns, export_format, "circulation_report", "Circulation Report",
+                                csv_delimiter=csv_delimiter if export_format == "CSV" else ",",
+                                compress=export_format == "CSV" and compress_export
+                            )
+                        # Kept in the session, so the link outlives the reruns that follow
+                        st.session_state.circulation_export = (file_name, download_name, export_format, chain.count())
+                    show_last_export("circulation_export", "circ_export_download")
                 else:
                     st.warning("Please select at least one column to display")
                     
@@ -1317,124 +3972,52 @@ if st.session_state.logged_in:
     
     with tabs[2]:  # Loan Count Tab
         if not st.session_state.loan_count_data_loaded:
-            if st.button("Load Loan Count Data", key="loan_count_load_button"):
-                try:
+            job = find_load_job('loan_count')
+            if job is not None and job.running:
+                show_load_job(job, "loan_count_cancel_button")
+            else:
+                show_load_job_outcome(job, "Error loading loan count data")
+                if st.button("Load Loan Count Data", key="loan_count_load_button"):
                     # Set up header for API calls
                     header_dict = {
                         "x-okapi-tenant": st.session_state.tenant,
                         "x-okapi-token": st.session_state.token
                     }
                     
-                    with st.spinner("Loading comprehensive loan count data from Medad..."):
-                        # Get instances, holdings, and items data
-                        df_instances = get_instances(st.session_state.okapi_url, header_dict)
-                        st.success("✅ Instances data loaded")
-                        
-                        df_holdings = get_holdings(st.session_state.okapi_url, header_dict)
-                        st.success("✅ Holdings data loaded")
-                        
-                        df_items = get_items(st.session_state.okapi_url, header_dict)
-                        st.success("✅ Items data loaded")
-                        
-                        # Get material types data
-                        df_mtypes = get_mtypes(st.session_state.okapi_url, header_dict)
-                        st.success("✅ Material types data loaded")
-                        
-                        # Get loan count data
-                        df_loan_count = get_loan_count_data(st.session_state.okapi_url, header_dict)
-                        st.success("✅ Loan count data loaded")
-                        
-                        # Create a dictionary mapping material type IDs to names
-                        material_types = df_mtypes.set_index('id')['name'].to_dict()
-                        
-                        # Process data for merging
-                        with st.spinner("Merging data..."):
-                            # First merge instances with holdings
-                            # Use explicit suffixes to avoid duplicate column issues
-                            merged_df = df_instances.merge(
-                                df_holdings, 
-                                left_on='id', 
-                                right_on='instanceId', 
-                                how='inner',
-                                suffixes=('_instance', '_holdings')
-                            )
-                            
-                            # Then merge with items
-                            merged_df = merged_df.merge(
-                                df_items, 
-                                left_on='id_holdings', 
-                                right_on='holdingsRecordId', 
-                                how='inner',
-                                suffixes=('', '_item')
-                            )
-                            
-                            # Process contributor data if it exists
-                            if 'contributors' in merged_df.columns:
-                                merged_df['contributors'] = merged_df['contributors'].apply(
-                                    lambda x: x[0]['name'] if isinstance(x, list) and len(x) > 0 else '')
-                            
-                            # Add material type names
-                            merged_df['materialTypeName'] = merged_df['materialTypeId'].map(material_types)
-                            
-                            # Format dates if present
-                            date_columns = ['lastCheckIn.dateTime', 'metadata.createdDate']
-                            for col in date_columns:
-                                if col in merged_df.columns:
-                                    merged_df[col] = pd.to_datetime(merged_df[col], errors='coerce').dt.strftime('%Y-%m-%d')
-                            
-                            # Get loan counts per item
-                            if not df_loan_count.empty:
-                                # Group by itemId and count loans
-                                loan_counts = df_loan_count.groupby('itemId').size().reset_index(name='loan_count')
-                                
-                                # Finally, merge with loan counts
-                                # Use the item's id column to match with itemId in loan_counts
-                                final_df = pd.merge(
-                                    merged_df, 
-                                    loan_counts, 
-                                    left_on='id', 
-                                    right_on='itemId', 
-                                    how='left'
-                                )
-                            else:
-                                # If no loan data, just add a loan_count column with zeros
-                                final_df = merged_df.copy()
-                                final_df['loan_count'] = 0
-                            
-                            # Fill NaN loan counts with 0 and convert to integer
-                            final_df['loan_count'] = final_df['loan_count'].fillna(0).astype(int)
-                        
-                        # Store the final dataframe in session state
-                        st.session_state.loan_count_df = final_df
-                        st.session_state.loan_count_data_loaded = True
-                    
-                    st.success("Loan count data successfully loaded and processed!")
+                    # Instances, holdings and items are shared with the Bibliographic Report
+                    start_loan_count_load(st.session_state.okapi_url, header_dict, st.session_state.load_scope)
                     st.experimental_rerun()
-                    
-                except Exception as e:
-                    st.error(f"Error loading loan count data: {str(e)}")
         else:
             # Data is loaded, display the DataFrame with filter controls
-            if 'loan_count_df' in st.session_state and not st.session_state.loan_count_df.empty:
-                # Get the DataFrame from session state
-                filtered_df = st.session_state.loan_count_df.copy()
+            if st.session_state.final_df is not None and not st.session_state.final_df.empty:
+                # Get the shared inventory DataFrame and its filter index from session state
+                df = st.session_state.final_df
+                index = st.session_state.report_index
+                chain = FilterChain(index, st.session_state.filter_cache)
+                
+                scope_text = "; ".join(filter(None, [
+                    describe_scope(st.session_state.get('report_scope'), ['locations', 'material_types']),
+                    describe_scope(st.session_state.get('loan_count_scope'), [], loans=True)]))
+                if scope_text:
+                    st.caption(f"Scoped load: {scope_text}")
                 
                 # Create filter columns for main filtering options
                 col1, col2, col3 = st.columns(3)
                 
                 # Display material type filter
                 with col1:
-                    if 'materialTypeName' in filtered_df.columns:
-                        material_types = sorted(filtered_df['materialTypeName'].dropna().unique().tolist())
-                        selected_material = st.multiselect("Material Type", material_types, key="loan_count_material_type")
+                    if 'Material_name' in index:
+                        material_types = chain.facet('Material_name')
+                        selected_material = st.multiselect("Material Type", list(material_types), format_func=facet_label(material_types), key="loan_count_material_type")
                         if selected_material:
-                            filtered_df = filtered_df[filtered_df['materialTypeName'].isin(selected_material)]
+                            chain.isin('Material_name', selected_material)
                 
                 # Display loan count range filter
                 with col2:
-                    if 'loan_count' in filtered_df.columns:
-                        min_loans = int(filtered_df['loan_count'].min())
-                        max_loans = int(filtered_df['loan_count'].max())
+                    if 'loan_count' in index and chain.count():
+                        loan_counts = chain.options('loan_count')
+                        min_loans = int(loan_counts[0])
+                        max_loans = int(loan_counts[-1])
                         
                         # Handle the case where min and max are equal
                         if min_loans == max_loans:
@@ -1453,24 +4036,19 @@ if st.session_state.logged_in:
                                 key="loan_count_range"
                             )
                         
-                        filtered_df = filtered_df[
-                            (filtered_df['loan_count'] >= loan_count_range[0]) & 
-                            (filtered_df['loan_count'] <= loan_count_range[1])
-                        ]
+                        chain.between('loan_count', loan_count_range[0], loan_count_range[1])
                 
                 # Display item status filter
                 with col3:
-                    if 'status.name' in filtered_df.columns:
-                        status_values = sorted(filtered_df['status.name'].dropna().unique().tolist())
-                        selected_status = st.multiselect("Item Status", status_values, key="loan_count_status")
+                    if 'Item Status' in index:
+                        status_values = chain.facet('Item Status')
+                        selected_status = st.multiselect("Item Status", list(status_values), format_func=facet_label(status_values), key="loan_count_status")
                         if selected_status:
-                            filtered_df = filtered_df[filtered_df['status.name'].isin(selected_status)]
+                            chain.isin('Item Status', selected_status)
                 
                 # Column selection
-                all_columns = filtered_df.columns.tolist()
-                default_columns = ['title', 'callNumber', 'barcode', 'materialTypeName', 'status.name', 
-                                  'contributors', 'loan_count', 'lastCheckIn.dateTime', 'metadata.createdDate']
-                default_columns = [col for col in default_columns if col in all_columns]
+                all_columns = visible_columns(df)
+                default_columns = [col for col in LOAN_COUNT_DEFAULT_COLUMNS if col in all_columns]
                 
                 selected_columns = st.multiselect(
                     "Select columns to display",
@@ -1482,35 +4060,33 @@ if st.session_state.logged_in:
                 if selected_columns:
                     # Display only a sample of the filtered dataframe (10 records)
                     st.subheader("Data Preview (Sample)")
-                    st.dataframe(filtered_df[selected_columns].head(10))
-                    st.info(f"Showing 10 records as sample. Total filtered records: {len(filtered_df)} out of {len(st.session_state.loan_count_df)} total records")
+                    st.dataframe(format_loan_count_view(chain.take(df, selected_columns, limit=10)))
+                    st.info(f"Showing 10 records as sample. Total filtered records: {chain.count()} out of {len(df)} total records")
                     
                     # Export functionality
                     st.subheader("Export Data")
                     
-                    export_format = st.radio("Export format", ["CSV", "Excel"], key="loan_count_export_format")
+                    export_format = st.radio("Export format", list(EXPORT_EXTENSIONS), key="loan_count_export_format")
                     
                     if export_format == "CSV":
                         # Add delimiter option for CSV
                         csv_delimiter = st.text_input("CSV Delimiter", value=",", max_chars=1, key="loan_count_csv_delimiter")
                         if not csv_delimiter:  # Default to comma if empty
                             csv_delimiter = ","
+                        compress_export = st.checkbox("Compress (gzip)", key="loan_count_csv_gzip")
                     
                     if st.button("Export", key="loan_count_export_button"):
-                        if export_format == "CSV":
-                            csv = filtered_df[selected_columns].to_csv(index=False, sep=csv_delimiter)
-                            b64 = base64.b64encode(csv.encode()).decode()
-                            href = f'<a href="data:file/csv;base64,{b64}" download="loan_count_report.csv">Download CSV File</a>'
-                            st.markdown(href, unsafe_allow_html=True)
-                        else:  # Excel
-                            output = io.BytesIO()
-                            with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-                                filtered_df[selected_columns].to_excel(writer, sheet_name='Loan Count Report', index=False)
-                            b64 = base64.b64encode(output.getvalue()).decode()
-                            href = f'<a href="data:application/vnd.openxmlformats-officedocument.spreadsheetml.sheet;base64,{b64}" download="loan_count_report.xlsx">Download Excel File</a>'
-                            st.markdown(href, unsafe_allow_html=True)
-                        
-                        st.success(f"Export complete! {len(filtered_df)} records exported.")
+                        # Written chunk by chunk to a file served for download, instead of an in-page data URI
+                        with st.spinner("Writing export file..."):
+                            file_name, download_name = export_report(
+                                chain, df, selected_columns, export_format, "loan_count_report", "Loan Count Report",
+                                csv_delimiter=csv_delimiter if export_format == "CSV" else ",",
+                                compress=export_format == "CSV" and compress_export,
+                                transform=format_loan_count_view
+                            )
+                        # Kept in the session, so the link outlives the reruns that follow
+                        st.session_state.loan_count_export = (file_name, download_name, export_format, chain.count())
+                    show_last_export("loan_count_export", "loan_count_export_download")
                 else:
                     st.warning("Please select at least one column to display")
                     
@@ -1531,3 +4107,11 @@ else:
     
     To get started, enter your Medad credentials in the sidebar.
     """)
+
+# While loads of this user run in the background, rerun regularly to refresh their progress.
+# A load that ends during this run is picked up by one more rerun. A run showing a prepared
+# download waits for the user instead, whose next click reruns the page anyway.
+download_prepared = st.session_state.pop('download_prepared', False)
+if st.session_state.logged_in and (loads_running or load_jobs_running()) and not download_prepared:
+    time.sleep(LOAD_JOB_POLL_SECONDS)
+    st.experimental_rerun()
@@ -0,0 +1,21 @@
+import os
+import sys
+import types
+
+import pytest
+
+APP_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app.py")
+# app.py is a Streamlit script: its definitions end where the page itself is drawn
+PAGE_START = "# Create sidebar for login form"
+
+
+# Fixture loading the definitions of app.py without drawing the page
+@pytest.fixture(scope="session")
+def app():
+    with open(APP_PATH, encoding="utf-8") as handle:
+        source = handle.read()
+    module = types.ModuleType("app")
+    module.__file__ = APP_PATH
+    sys.modules["app"] = module
+    exec(compile(source[:source.index(PAGE_START)], APP_PATH, "exec"), module.__dict__)
+    return module
@@ -0,0 +1,61 @@
+import json
+
+import numpy as np
+import pandas as pd
+
+
+# A scoped load that matches no items yields a report without rows
+def test_empty_report_builds_indexes_and_filters(app):
+    columns = list(app.BIBLIOGRAPHIC_COLUMN_RENAMES.values()) + app.TAG_COLUMNS
+    final_df = app.apply_report_dtypes(pd.DataFrame(columns=columns))
+
+    state = app.report_state(final_df)
+    chain = app.FilterChain(state['report_index'], app.FilterCache())
+
+    assert chain.count() == 0
+    assert chain.facet('Item Status') == {}
+    assert chain.tag_facet('tags.tagList') == {}
+    assert chain.tagged('tags.tagList', ['a']).count() == 0
+    assert len(state['search_index'].search('title')) == 0
+    rows, not_found = state['lookup_index'].lookup('Barcode', ['123'])
+    assert len(rows) == 0 and not_found == ['123']
+    assert len(chain.take(final_df, ['Title'])) == 0
+
+
+# Response whose body arrives in pieces of a given size
+class ChunkedResponse:
+    def __init__(self, body, chunk_size):
+        self.body = body
+        self.chunk_size = chunk_size
+
+    def iter_content(self, chunk_size=None):
+        for start in range(0, len(self.body), self.chunk_size):
+            yield self.body[start:start + self.chunk_size]
+
+
+# Numbers split by a piece boundary anywhere, also right after "." or "e", are read whole
+def test_streamed_records_survive_any_chunk_size(app):
+    records = [12345, 6.7, -0.5, 1e10, 2.5E-3, -7e+2, 0, {"id": "a", "n": 3.25, "e": 1.5e-7}, [1.0, 20], "xé", True, None]
+    body = json.dumps({"items": records, "totalRecords": 123.5e1}).encode('utf-8')
+    for chunk_size in range(1, len(body) + 1):
+        fields = {}
+        streamed = list(app.iter_json_records(ChunkedResponse(body, chunk_size), "items", fields))
+        assert streamed == records, chunk_size
+        assert fields == {"totalRecords": 1235.0}, chunk_size
+
+
+# Categorical columns with numeric or flag categories and missing values, like a categorical
+# loan_count or Holdings Suppress column
+def test_excel_export_writes_nullable_categoricals(app, tmp_path):
+    chunk = pd.DataFrame({
+        'loan_count': pd.Series([3, None, 0], dtype='Int64').astype('category'),
+        'Holdings Suppress': pd.Series([True, None, False], dtype=object).astype('category'),
+        'Item Status': pd.Series(['Available', None, 'Checked out'], dtype='category'),
+    })
+    assert app.excel_cells(chunk['loan_count']) == ('write_number', [3, None, 0])
+    assert app.excel_cells(chunk['Holdings Suppress']) == ('write_boolean', [True, None, False])
+    assert app.excel_cells(chunk['Item Status']) == ('write_string', ['Available', None, 'Checked out'])
+
+    path = tmp_path / "report.xlsx"
+    app.write_export(str(path), iter([chunk]), "Excel", "Report")
+    assert path.stat().st_size > 0